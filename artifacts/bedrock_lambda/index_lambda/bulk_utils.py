@@ -0,0 +1,166 @@
+import json
+import random
+import time
+
+# Item level statuses worth retrying, anything else (mapping errors, bad vectors) fails straight away
+RETRYABLE_STATUSES = [429, 500, 502, 503, 504]
+
+
+def _bulk_lines(doc):
+    '''
+    Serializes one doc into its action and source lines. A doc may carry
+    _id and _op (index, update or delete), delete has no source line.
+    '''
+    doc = dict(doc)
+    op = doc.pop('_op', 'index')
+    action = {op: {}}
+    if '_id' in doc:
+        action[op]["_id"] = doc.pop('_id')
+    if op == 'delete':
+        return doc, json.dumps(action), None
+    if op == 'update':
+        return doc, json.dumps(action), json.dumps({"doc": doc})
+    return doc, json.dumps(action), json.dumps(doc)
+
+
+def bulk_batches(docs, max_docs=500, max_bytes=5 * 1024 * 1024):
+    '''
+    Groups documents into _bulk batches bounded by document count and payload size.
+    Each yielded batch is a list of (doc, action_line, source_line) tuples, the lines are
+    serialized once here so retries do not pay for json.dumps again.
+    '''
+    batch = []
+    batch_bytes = 0
+    for doc in docs:
+        doc, action_line, source_line = _bulk_lines(doc)
+        item_bytes = len(action_line) + (len(source_line) + 1 if source_line is not None else 0) + 1
+        if len(batch) > 0 and (len(batch) >= max_docs or batch_bytes + item_bytes > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append((doc, action_line, source_line))
+        batch_bytes = batch_bytes + item_bytes
+    if len(batch) > 0:
+        yield batch
+
+
+def _send_batch(ops_client, index_name, batch):
+    lines = []
+    for _, action_line, source_line in batch:
+        lines.append(action_line)
+        if source_line is not None:
+            lines.append(source_line)
+    body = '\n'.join(lines) + '\n'
+    response = ops_client.bulk(body=body, index=index_name)
+    if not response.get('errors'):
+        return [], []
+
+    retryable, failed = [], []
+    for item, response_item in zip(batch, response['items']):
+        result = list(response_item.values())[0]
+        status = result.get('status', 500)
+        # A delete of a chunk that is already gone is not a failure
+        if status < 300 or ('delete' in response_item and status == 404):
+            continue
+        error = result.get('error', {})
+        reason = error.get('reason', str(error)) if isinstance(error, dict) else str(error)
+        failure = {'_id': result.get('_id'), 'status': status, 'reason': reason}
+        if status in RETRYABLE_STATUSES:
+            retryable.append((item, failure))
+        else:
+            failed.append(failure)
+    return retryable, failed
+
+
+def assigned_ids(ops_client, index_name, chunk_ids):
+    '''{chunk_id: [_id, ...]} of the stored chunks with one of chunk_ids, one terms search'''
+    assigned = {}
+    if len(chunk_ids) == 0:
+        return assigned
+    # More hits than ids when concurrent ingestions stored a chunk twice
+    query = {"size": min(len(chunk_ids) * 4, 10000), "query": {"terms": {"chunk_id": sorted(chunk_ids)}}, "_source": ["chunk_id"]}
+    for hit in ops_client.search(body=query, index=index_name)["hits"]["hits"]:
+        assigned.setdefault(hit['_source']['chunk_id'], []).append(hit['_id'])
+    return assigned
+
+
+def resolve_chunk_ids(ops_client, index_name, docs, batch_size=500):
+    '''
+    For collections that reject a client supplied _id (serverless vector search collections).
+    The _id of a doc is its logical chunk id, kept in the chunk_id field, and the ids of every
+    batch_size docs are resolved to the _id the service assigned. An index replaces the stored
+    chunk (delete and index without _id in the same request), update and delete go to the
+    assigned _id and are dropped when the chunk is not stored.
+    '''
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield from _resolved(ops_client, index_name, batch)
+            batch = []
+    if len(batch) > 0:
+        yield from _resolved(ops_client, index_name, batch)
+
+
+def _resolved(ops_client, index_name, batch):
+    assigned = assigned_ids(ops_client, index_name, set(doc['_id'] for doc in batch if '_id' in doc))
+    for doc in batch:
+        if '_id' not in doc:
+            yield doc
+            continue
+        doc = dict(doc)
+        chunk_id = doc.pop('_id')
+        if doc.get('_op', 'index') == 'index':
+            for assigned_id in assigned.get(chunk_id, []):
+                yield {'_op': 'delete', '_id': assigned_id}
+            yield {**doc, 'chunk_id': chunk_id}
+            continue
+        if chunk_id not in assigned and doc.get('_op') == 'update':
+            print(f'Chunk {chunk_id} is not stored, not updated')
+        for assigned_id in assigned.get(chunk_id, []):
+            yield {**doc, '_id': assigned_id}
+
+
+def bulk_index(ops_client, index_name, docs, max_docs=500, max_bytes=5 * 1024 * 1024,
+               max_retries=3, backoff_seconds=0.5, on_batch=None, custom_ids=True):
+    '''
+    Streams docs into count and size bounded _bulk requests.
+    Only the items that failed with a retryable status are re-sent, with exponential backoff.
+    Returns a summary with the per-item failures that could not be indexed and the seconds
+    spent in _bulk requests. on_batch(indexed, seconds) is called after every request.
+    Without custom_ids the _id of the docs is resolved with resolve_chunk_ids.
+    '''
+    stats = {'indexed': 0, 'failed': [], 'requests': 0, 'retried_items': 0, 'seconds': 0.0}
+    if not custom_ids:
+        docs = resolve_chunk_ids(ops_client, index_name, docs, max_docs)
+    for batch in bulk_batches(docs, max_docs, max_bytes):
+        pending = batch
+        attempt = 0
+        while len(pending) > 0:
+            stats['requests'] = stats['requests'] + 1
+            start = time.perf_counter()
+            try:
+                retryable, failed = _send_batch(ops_client, index_name, pending)
+            except Exception as e:
+                # The whole request failed (timeout, 429 on the request), every item is retryable
+                print(f'Bulk request failed, attempt={attempt}, exception={e}')
+                retryable = [(item, {'_id': None, 'status': 500, 'reason': str(e)}) for item in pending]
+                failed = []
+            seconds = time.perf_counter() - start
+
+            stats['failed'].extend(failed)
+            indexed = len(pending) - len(retryable) - len(failed)
+            stats['indexed'] = stats['indexed'] + indexed
+            stats['seconds'] = stats['seconds'] + seconds
+            if on_batch is not None:
+                on_batch(indexed, seconds)
+            if len(retryable) == 0:
+                break
+            if attempt >= max_retries:
+                stats['failed'].extend(failure for _, failure in retryable)
+                break
+            attempt = attempt + 1
+            stats['retried_items'] = stats['retried_items'] + len(retryable)
+            time.sleep(backoff_seconds * (2 ** (attempt - 1)) * (0.5 + random.random()))
+            pending = [item for item, _ in retryable]
+    return stats
@@ -0,0 +1,129 @@
+import math
+import re
+
+# Input token limits of the embed models, text beyond the limit is rejected or truncated
+MODEL_TOKEN_LIMITS = {
+    'amazon.titan-embed-text-v1': 8192,
+    'amazon.titan-embed-text-v2': 8192,
+    'amazon.titan-embed-image-v1': 128,
+    'amazon.titan-embed-g1-text-02': 8192,
+    'cohere.embed-english-v3': 512,
+    'cohere.embed-multilingual-v3': 512
+}
+DEFAULT_TOKEN_LIMIT = 512
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+# A sentence ends at . ! ? (optionally closed by quotes or brackets) followed by whitespace
+_SENTENCE_END = re.compile(r'(?<=[.!?])["\')\]]*\s+')
+
+
+def model_token_limit(model_id):
+    for model_prefix, limit in MODEL_TOKEN_LIMITS.items():
+        if model_id.startswith(model_prefix):
+            return limit
+    return DEFAULT_TOKEN_LIMIT
+
+
+def estimate_tokens(text):
+    '''
+    Conservative token estimate without a tokenizer: subword tokenizers average about
+    4 characters or 0.75 words per token on English, the larger of the two is used.
+    '''
+    return max(math.ceil(len(text) / 4), math.ceil(len(text.split()) * 4 / 3))
+
+
+def _split_units(text):
+    '''Sentences with their trailing whitespace, a paragraph break is kept on the sentence before it'''
+    units = []
+    position = 0
+    for paragraph_break in _PARAGRAPH_BREAK.finditer(text):
+        units.extend(_split_sentences(text[position:paragraph_break.end()]))
+        position = paragraph_break.end()
+    units.extend(_split_sentences(text[position:]))
+    return units
+
+
+def _split_sentences(text):
+    sentences = []
+    position = 0
+    for sentence_end in _SENTENCE_END.finditer(text):
+        sentences.append(text[position:sentence_end.end()])
+        position = sentence_end.end()
+    if position < len(text):
+        sentences.append(text[position:])
+    return sentences
+
+
+def _split_words(sentence, max_tokens):
+    # A sentence over the budget on its own is cut between words
+    pieces = []
+    piece = ''
+    for word in re.findall(r'\S+\s*', sentence):
+        if piece and estimate_tokens(piece + word) > max_tokens:
+            pieces.append(piece)
+            piece = ''
+        piece = piece + word
+    if piece:
+        pieces.append(piece)
+    return pieces
+
+
+class TokenBudgetSplitter:
+    '''
+    Packs whole sentences into chunks of up to max_tokens estimated tokens, closing a
+    chunk early at a paragraph break once it is at least paragraph_fill full. Replaces
+    fixed size character chunks, so each embed call carries close to what the model
+    accepts and overlapping text is not embedded twice. split_text matches the langchain
+    splitters, so it plugs into pipeline.stream_chunks.
+    '''
+
+    def __init__(self, max_tokens, overlap_sentences=0, paragraph_fill=0.5):
+        self.max_tokens = max_tokens
+        self.overlap_sentences = overlap_sentences
+        self.paragraph_fill = paragraph_fill
+
+    def _carry(self, chunk, next_tokens):
+        '''
+        Trailing sentences of a closed chunk repeated at the start of the next one: at most
+        overlap_sentences and fewer than the chunk has, so every chunk moves on by at least one
+        sentence, dropped from the front until they fit the budget with the next sentence.
+        '''
+        if self.overlap_sentences <= 0:
+            return []
+        carry = chunk[len(chunk) - min(self.overlap_sentences, len(chunk) - 1):] if len(chunk) > 1 else []
+        while len(carry) > 0 and sum(estimate_tokens(carried) for carried in carry) + next_tokens > self.max_tokens:
+            carry = carry[1:]
+        return carry
+
+    def split_text(self, text):
+        units = []
+        for unit in _split_units(text):
+            if estimate_tokens(unit) > self.max_tokens:
+                units.extend(_split_words(unit, self.max_tokens))
+            else:
+                units.append(unit)
+
+        chunks = []
+        current = []
+        current_tokens = 0
+        for unit in units:
+            unit_tokens = estimate_tokens(unit)
+            if current and current_tokens + unit_tokens > self.max_tokens:
+                chunks.append(''.join(current))
+                current = self._carry(current, unit_tokens)
+                current_tokens = sum(estimate_tokens(carried) for carried in current)
+            current.append(unit)
+            current_tokens = current_tokens + unit_tokens
+            if _PARAGRAPH_BREAK.search(unit) and current_tokens >= self.max_tokens * self.paragraph_fill:
+                chunks.append(''.join(current))
+                current = []
+                current_tokens = 0
+        if current:
+            chunks.append(''.join(current))
+        return [chunk.strip() for chunk in chunks if chunk.strip() != '']
+
+
+def chunk_token_budget(model_id, share=0.9, max_tokens=1000):
+    '''Token budget of a chunk: share of the model input limit, capped to keep retrieval granular'''
+    budget = int(model_token_limit(model_id) * share)
+    return min(budget, max_tokens) if max_tokens > 0 else budget
@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+
+# Error codes Bedrock and other AWS services use when a request rate or token quota is exceeded
+THROTTLING_ERROR_CODES = ['ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException',
+                          'ModelNotReadyException', 'Throttling', 'RequestLimitExceeded']
+
+
+def is_throttling_error(e):
+    '''botocore ClientError carries the code in response, opensearchpy TransportError the HTTP status'''
+    response = getattr(e, 'response', None)
+    if isinstance(response, dict) and response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+        return True
+    return getattr(e, 'status_code', None) == 429
+
+
+class AdaptiveConcurrency:
+    '''
+    AIMD limit on in-flight calls: each success window grows the limit by one, a throttle
+    halves it. Throttled calls are retried with exponential backoff and jitter, so the limit
+    settles just below the account quota instead of a fixed worker count.
+    '''
+
+    def __init__(self, initial=4, min_limit=1, max_limit=32, decrease_factor=0.5,
+                 max_retries=5, backoff_seconds=0.2, max_backoff_seconds=10):
+        self.limit = max(min_limit, min(initial, max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.in_flight = 0
+        self.throttles = 0
+        self.retries = 0
+        self._successes = 0
+        self._last_decrease = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight = self.in_flight + 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight = self.in_flight - 1
+            self._condition.notify()
+
+    def on_success(self):
+        with self._condition:
+            self._successes = self._successes + 1
+            # Additive increase once per window of limit successful calls
+            if self._successes >= self.limit and self.limit < self.max_limit:
+                self._successes = 0
+                self.limit = self.limit + 1
+                self._condition.notify()
+
+    def on_throttle(self):
+        with self._condition:
+            self.throttles = self.throttles + 1
+            self._successes = 0
+            # Calls in flight when the quota was hit throttle together, decrease once per burst
+            now = time.monotonic()
+            if now - self._last_decrease > self.backoff_seconds:
+                self._last_decrease = now
+                self.limit = max(self.min_limit, int(self.limit * self.decrease_factor))
+                print(f'Throttled, concurrency limit lowered to {self.limit}')
+
+    def run(self, fn, *args, **kwargs):
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not is_throttling_error(e) or attempt >= self.max_retries:
+                    raise
+                self.on_throttle()
+            else:
+                self.on_success()
+                return result
+            finally:
+                self.release()
+            attempt = attempt + 1
+            self.retries = self.retries + 1
+            delay = min(self.max_backoff_seconds, self.backoff_seconds * (2 ** (attempt - 1)))
+            time.sleep(delay * (0.5 + random.random()))
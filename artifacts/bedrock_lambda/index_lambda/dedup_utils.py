@@ -0,0 +1,218 @@
+import hashlib
+import random
+import re
+from collections import OrderedDict
+
+from incremental_utils import hit_chunk_id
+
+# 63 bit hash values, they fit a long field
+_HASH_BITS = 63
+_WORD = re.compile(r'\w+')
+
+# Fields of canonical chunks used to find their near-duplicates, and the link of a duplicate to its canonical chunk
+DEDUP_MAPPING = {
+    "lsh_bands": {"type": "keyword"},
+    "minhash": {"type": "long", "index": False, "doc_values": False},
+    "duplicate_of": {"type": "keyword"}
+}
+
+
+def shingles(text, size=5):
+    '''Word size-grams of the lowercased text, whitespace, punctuation and case do not count'''
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return {' '.join(words)}
+    return {' '.join(words[position:position + size]) for position in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    '''
+    MinHash signatures of chunk texts: the share of equal values between two signatures
+    estimates the Jaccard similarity of their shingle sets. Each of the num_perm hash functions
+    is one 63 bit shingle hash XORed with its own random mask, three times cheaper in Python
+    than affine permutations for the same estimate. band_keys splits a signature in
+    bands, two chunks sharing any band key are candidates for a near-duplicate check.
+    '''
+
+    def __init__(self, num_perm=64, bands=16, shingle_size=5, seed=27):
+        if num_perm % bands != 0:
+            raise ValueError(f'num_perm {num_perm} is not a multiple of bands {bands}')
+        rng = random.Random(seed)
+        self.masks = [rng.getrandbits(_HASH_BITS) for _ in range(num_perm)]
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+    def signature(self, text):
+        hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big') >> (64 - _HASH_BITS)
+                  for shingle in shingles(text, self.shingle_size)]
+        return [min([value ^ mask for value in hashes]) for mask in self.masks]
+
+    def band_keys(self, signature):
+        keys = []
+        for band in range(self.bands):
+            rows = ','.join(str(value) for value in signature[band * self.rows:(band + 1) * self.rows])
+            keys.append(f'{band:02d}{hashlib.blake2b(rows.encode("utf-8"), digest_size=8).hexdigest()}')
+        return keys
+
+
+def similarity(signature, other):
+    return sum(1 for value, other_value in zip(signature, other) if value == other_value) / len(signature)
+
+
+class NearDuplicateIndex:
+    '''
+    In-memory LSH index of signatures by band key. Holds the max_signatures most recently
+    added or matched chunks, a few KB each, so memory does not grow with the document.
+    '''
+
+    def __init__(self, hasher, threshold, max_signatures=5000):
+        self.hasher = hasher
+        self.threshold = threshold
+        self.max_signatures = max_signatures
+        self.buckets = {}
+        self.signatures = OrderedDict()
+        self._keys = {}
+
+    def add(self, chunk_id, signature, keys=None):
+        if chunk_id in self.signatures:
+            self.signatures.move_to_end(chunk_id)
+            return
+        keys = keys or self.hasher.band_keys(signature)
+        self.signatures[chunk_id] = signature
+        self._keys[chunk_id] = keys
+        for key in keys:
+            self.buckets.setdefault(key, set()).add(chunk_id)
+        while len(self.signatures) > self.max_signatures:
+            self._evict(next(iter(self.signatures)))
+
+    def _evict(self, chunk_id):
+        del self.signatures[chunk_id]
+        for key in self._keys.pop(chunk_id):
+            bucket = self.buckets[key]
+            bucket.discard(chunk_id)
+            if len(bucket) == 0:
+                del self.buckets[key]
+
+    def find(self, signature, keys=None):
+        '''(chunk_id, similarity) of the most similar chunk at or above threshold, or None'''
+        best = None
+        candidates = set()
+        for key in keys or self.hasher.band_keys(signature):
+            candidates.update(self.buckets.get(key, []))
+        for chunk_id in candidates:
+            score = similarity(signature, self.signatures[chunk_id])
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (chunk_id, score)
+        if best is not None:
+            self.signatures.move_to_end(best[0])
+        return best
+
+
+class ChunkDeduplicator:
+    '''
+    Near-duplicate suppression for one ingestion. partition splits a group of (text, metadata)
+    chunks into the chunks to embed, each with the minhash and lsh_bands fields to store
+    on it, and the duplicates of a chunk already in index_name or earlier in this ingestion.
+    Chunks already indexed are found with one terms query on lsh_bands per group, chunks
+    still waiting for a refresh are only seen while they are among the max_signatures
+    recent ones kept in memory.
+    scope ({field: value}) limits the lookup to indexed chunks with the same values, a None
+    value to chunks without the field. A duplicate can differ from its canonical chunk in the
+    fields outside the scope, searches filtering on them resolve the link. With no scope only
+    the chunks of this ingestion are compared, {} looks up the whole index.
+    is_live(chunk_id) is False for an indexed chunk this ingestion is about to delete,
+    it is never made canonical.
+    '''
+
+    def __init__(self, ops_client, index_name, threshold=0.85, num_perm=64, bands=16, shingle_size=5, scope=None,
+                 max_signatures=5000, is_live=None):
+        self.ops_client = ops_client
+        self.index_name = index_name
+        self.scope = scope
+        self.is_live = is_live or (lambda chunk_id: True)
+        self.hasher = MinHasher(num_perm, bands, shingle_size)
+        self.index = NearDuplicateIndex(self.hasher, threshold, max_signatures)
+        self.duplicates = 0
+        self._next_local_id = 0
+
+    def _fetch_candidates(self, keys, size):
+        if self.scope is None:
+            return
+        clauses = [{"terms": {"lsh_bands": sorted(keys)}}] + [{"term": {field: value}} for field, value in self.scope.items()
+                                                              if value is not None]
+        absent = [{"exists": {"field": field}} for field, value in self.scope.items() if value is None]
+        query = {"size": size, "query": {"bool": {"filter": clauses, "must_not": absent}},
+                 "_source": ["minhash", "lsh_bands", "chunk_id"]}
+        try:
+            hits = self.ops_client.search(body=query, index=self.index_name)["hits"]["hits"]
+        except Exception as e:
+            print(f'Near-duplicate lookup failed, chunks are only compared within the ingestion, exception={e}')
+            return
+        for hit in hits:
+            chunk_id = hit_chunk_id(hit)
+            if chunk_id not in self.index.signatures and hit['_source'].get('minhash') and self.is_live(chunk_id):
+                self.index.add(chunk_id, hit['_source']['minhash'], hit['_source'].get('lsh_bands'))
+
+    def partition(self, group):
+        '''
+        Returns (unique, duplicates): unique is a list of (text, metadata, dedup_fields), duplicates a
+        list of (text, metadata, canonical_id, similarity). canonical_id is None when the canonical
+        chunk has no id yet (chunks indexed without a source).
+        '''
+        signed = []
+        all_keys = set()
+        for text, metadata in group:
+            signature = self.hasher.signature(text)
+            keys = self.hasher.band_keys(signature)
+            signed.append((text, metadata, signature, keys))
+            all_keys.update(keys)
+        self._fetch_candidates(all_keys, min(len(group) * 10, 1000))
+        unique = []
+        duplicates = []
+        for text, metadata, signature, keys in signed:
+            match = self.index.find(signature, keys)
+            if match is not None:
+                canonical_id, score = match
+                duplicates.append((text, metadata, None if canonical_id.startswith('local:') else canonical_id, round(score, 3)))
+                continue
+            chunk_id = metadata['_id'] if metadata else None
+            if chunk_id is None:
+                self._next_local_id = self._next_local_id + 1
+                chunk_id = f'local:{self._next_local_id}'
+            self.index.add(chunk_id, signature, keys)
+            unique.append((text, metadata, {'minhash': signature, 'lsh_bands': keys}))
+        self.duplicates = self.duplicates + len(duplicates)
+        return unique, duplicates
+
+
+def fetch_links(ops_client, index_name, canonical_ids, page_size=1000, doc_id=None):
+    '''
+    Chunks of any document stored as a link to one of canonical_ids, as hits with their _source.
+    Their canonical chunks are being deleted or moved out of the scope, they have to be embedded themselves.
+    With doc_id, the links of that document follow, its collection or tenant is changing.
+    '''
+    canonical_ids = sorted(canonical_ids)
+    filters = [{"terms": {"duplicate_of": canonical_ids[start:start + page_size]}}
+               for start in range(0, len(canonical_ids), page_size)]
+    if doc_id is not None:
+        filters.append({"bool": {"filter": [{"term": {"doc_id": doc_id}}, {"exists": {"field": "duplicate_of"}}]}})
+    for filter in filters:
+        search_after = None
+        while True:
+            query = {
+                "size": page_size,
+                "query": {"bool": {"filter": [filter]}},
+                "sort": [{"doc_id": "asc"}, {"chunk_ordinal": "asc"}, {"content_hash": "asc"}]
+            }
+            if search_after is not None:
+                query["search_after"] = search_after
+            try:
+                hits = ops_client.search(body=query, index=index_name)["hits"]["hits"]
+            except Exception as e:
+                print(f'Could not fetch the links of {len(canonical_ids)} chunks, exception={e}')
+                return
+            yield from hits
+            if len(hits) < page_size:
+                break
+            search_after = hits[-1]['sort']
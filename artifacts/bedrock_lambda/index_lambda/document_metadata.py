@@ -0,0 +1,52 @@
+import re
+
+# Document metadata stored on every chunk, so a query can scope its kNN search with a filter
+DOCUMENT_METADATA_MAPPING = {
+    "doc_type": {"type": "keyword"},
+    "collection": {"type": "keyword"},
+    "tenant": {"type": "keyword"},
+    "document_date": {"type": "date"}
+}
+# Fields that partition the corpus, near-duplicate links stay within their values.
+# Queries filtering on other fields resolve links to their canonical chunk (query_lambda retrieval)
+SCOPE_FIELDS = ['collection', 'tenant']
+_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+
+def document_metadata(source=None, metadata=None):
+    '''
+    Validated metadata of an ingested document: collection, tenant, doc_type and document_date
+    (ISO 8601) from the request, doc_type defaults to the extension of the source.
+    Raises ValueError for other keys, which would be dynamically mapped and not filterable.
+    '''
+    metadata = dict(metadata or {})
+    unknown = [key for key in metadata if key not in DOCUMENT_METADATA_MAPPING]
+    if len(unknown) > 0:
+        raise ValueError(f'Unknown metadata {unknown}, supported: {list(DOCUMENT_METADATA_MAPPING)}')
+    for key, value in metadata.items():
+        if not isinstance(value, str) or value.strip() == '':
+            raise ValueError(f'Metadata {key} must be a non empty string')
+    if 'document_date' in metadata and not _DATE.match(metadata['document_date']):
+        raise ValueError(f'document_date must be an ISO 8601 date, got {metadata["document_date"]}')
+    if 'doc_type' not in metadata and source is not None and '.' in source.rsplit('/', 1)[-1]:
+        metadata['doc_type'] = source[source.rindex('.') + 1:].lower()
+    return metadata
+
+
+def metadata_outdated(ops_client, index_name, doc_id, fields):
+    '''True when a chunk of doc_id is indexed with other values for fields, checked with one search'''
+    if len(fields) == 0:
+        return False
+    query = {
+        "size": 1,
+        "_source": False,
+        "query": {"bool": {
+            "filter": [{"term": {"doc_id": doc_id}}],
+            "must_not": [{"bool": {"filter": [{"term": {key: value}} for key, value in fields.items()]}}]
+        }}
+    }
+    try:
+        return len(ops_client.search(body=query, index=index_name)["hits"]["hits"]) > 0
+    except Exception as e:
+        print(f'Could not check the metadata of {doc_id}, exception={e}')
+        return True
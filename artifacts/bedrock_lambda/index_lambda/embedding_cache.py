@@ -0,0 +1,298 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# An embedding is held as a list of Python floats, a pointer and a float object per element
+EMBEDDING_ELEMENT_BYTES = 32
+# Key, list header and the OrderedDict entry of each cached embedding
+ENTRY_OVERHEAD_BYTES = 256
+
+
+def embedding_cache_key(text, model_id, dimension, input_type='search_document'):
+    '''
+    Content address of an embedding, byte identical text embedded by the same
+    model, dimension and input type always maps to the same key
+    '''
+    digest = hashlib.sha256()
+    for part in [model_id, str(dimension), input_type, text]:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    '''
+    Backend interface, get returns None on a miss.
+    get_many/put_many can be overridden by backends that have a cheaper batch path.
+    '''
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def put(self, key, embedding):
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            embedding = self.get(key)
+            if embedding is not None:
+                found[key] = embedding
+        return found
+
+    def put_many(self, embeddings):
+        for key, embedding in embeddings.items():
+            self.put(key, embedding)
+
+
+def embedding_bytes(embedding):
+    '''Estimated memory held by a cached embedding'''
+    return len(embedding) * EMBEDDING_ELEMENT_BYTES + ENTRY_OVERHEAD_BYTES
+
+
+class LRUEmbeddingCache(EmbeddingCache):
+    '''
+    In-process cache, survives across warm invocations of the same container. Bounded by the
+    estimated bytes of the embeddings held rather than their count, so the bound holds whatever
+    the dimension.
+    '''
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+            return embedding
+
+    def put(self, key, embedding):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes = self.bytes - embedding_bytes(previous)
+            self._entries[key] = embedding
+            self.bytes = self.bytes + embedding_bytes(embedding)
+            while self.bytes > self.max_bytes and len(self._entries) > 0:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes = self.bytes - embedding_bytes(evicted)
+
+
+class FileEmbeddingCache(EmbeddingCache):
+    '''
+    One JSON file per embedding under /tmp, outlives the in-process cache on a warm Lambda.
+    The files take at most max_bytes, least recently used ones are deleted first, so the cache
+    never fills the 512 MB /tmp other users of it share. Files left by an earlier invocation
+    are picked up oldest first.
+    '''
+
+    def __init__(self, directory='/tmp/embedding-cache', max_bytes=128 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._sizes = None
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.json')
+
+    def _load(self):
+        # Called with the lock held, scans the directory once per container
+        if self._sizes is not None:
+            return
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, name[:-len('.json')], stat.st_size))
+        self._sizes = OrderedDict((key, size) for _, key, size in sorted(files))
+        self.bytes = sum(self._sizes.values())
+        self._evict()
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self._sizes) > 0:
+            key, size = self._sizes.popitem(last=False)
+            self.bytes = self.bytes - size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'r') as f:
+                embedding = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._load()
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+        return embedding
+
+    def put(self, key, embedding):
+        path = self._path(key)
+        data = json.dumps(embedding)
+        with self._lock:
+            self._load()
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+                return
+            # Room is made before writing, a full /tmp would fail the write
+            self.bytes = self.bytes + len(data)
+            self._sizes[key] = len(data)
+            self._evict()
+            if key not in self._sizes:
+                return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so a concurrent reader never sees a partial file
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f'Could not write embedding cache file {path}, exception={e}')
+            with self._lock:
+                if self._sizes.pop(key, None) is not None:
+                    self.bytes = self.bytes - len(data)
+
+
+class S3EmbeddingCache(EmbeddingCache):
+    '''Shared cache across containers, one object per embedding under a prefix'''
+
+    def __init__(self, s3_client, bucket, prefix='embedding-cache/', max_workers=16):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_workers = max_workers
+
+    def get(self, key):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=f'{self.prefix}{key}.json')
+            return json.loads(response['Body'].read())
+        except Exception:
+            return None
+
+    def put(self, key, embedding):
+        try:
+            self.s3_client.put_object(Bucket=self.bucket, Key=f'{self.prefix}{key}.json',
+                                      Body=json.dumps(embedding).encode('utf-8'))
+        except Exception as e:
+            print(f'Could not write embedding cache object {key}, exception={e}')
+
+    def get_many(self, keys):
+        if len(keys) == 0:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(keys))) as executor:
+            results = executor.map(self.get, keys)
+        return {key: embedding for key, embedding in zip(keys, results) if embedding is not None}
+
+    def put_many(self, embeddings):
+        if len(embeddings) == 0:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(embeddings))) as executor:
+            list(executor.map(lambda item: self.put(item[0], item[1]), embeddings.items()))
+
+
+class TieredEmbeddingCache(EmbeddingCache):
+    '''Reads tiers in order (fastest first) and back-fills the faster tiers on a hit'''
+
+    def __init__(self, tiers):
+        self.tiers = tiers
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put(self, key, embedding):
+        self.put_many({key: embedding})
+
+    def get_many(self, keys):
+        found = {}
+        missing = list(keys)
+        for i, tier in enumerate(self.tiers):
+            if len(missing) == 0:
+                break
+            tier_found = tier.get_many(missing)
+            if len(tier_found) > 0:
+                for faster_tier in self.tiers[:i]:
+                    faster_tier.put_many(tier_found)
+                found.update(tier_found)
+                missing = [key for key in missing if key not in tier_found]
+        return found
+
+    def put_many(self, embeddings):
+        for tier in self.tiers:
+            tier.put_many(embeddings)
+
+
+class CachedEmbedder:
+    '''
+    Wraps an embedding adapter, only the texts missing from the cache are sent to the model.
+    hits/misses are cumulative for the container, callers diff them per request.
+    '''
+
+    def __init__(self, adapter, cache):
+        self.adapter = adapter
+        self.cache = cache
+        self.max_batch_size = adapter.max_batch_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def calls(self):
+        return self.adapter.calls
+
+    def embed(self, texts, input_type='search_document'):
+        keys = [embedding_cache_key(text, self.adapter.model_id, self.adapter.dimension, input_type) for text in texts]
+        found = self.cache.get_many(list(set(keys)))
+
+        # Identical texts within one request are embedded once
+        missing = OrderedDict()
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if len(missing) > 0:
+            embeddings = self.adapter.embed(list(missing.values()), input_type)
+            computed = dict(zip(missing.keys(), embeddings))
+            self.cache.put_many(computed)
+            found.update(computed)
+
+        with self._lock:
+            self.hits = self.hits + len(texts) - len(missing)
+            self.misses = self.misses + len(missing)
+        return [found[key] for key in keys]
+
+
+def build_embedding_cache(backends, s3_client=None, bucket=None, max_bytes=64 * 1024 * 1024, directory='/tmp/embedding-cache',
+                          max_file_bytes=128 * 1024 * 1024):
+    '''
+    backends is a comma separated list in lookup order, e.g. "memory,file,s3".
+    max_bytes bounds the memory tier, max_file_bytes the file tier. Returns None when no backend is configured.
+    '''
+    tiers = []
+    for backend in [b.strip() for b in backends.split(',') if b.strip() != '']:
+        if backend == 'memory':
+            tiers.append(LRUEmbeddingCache(max_bytes))
+        elif backend == 'file':
+            tiers.append(FileEmbeddingCache(directory, max_file_bytes))
+        elif backend == 's3' and s3_client is not None and bucket is not None:
+            tiers.append(S3EmbeddingCache(s3_client, bucket))
+        else:
+            print(f'Ignoring unknown embedding cache backend {backend}')
+    if len(tiers) == 0:
+        return None
+    return tiers[0] if len(tiers) == 1 else TieredEmbeddingCache(tiers)
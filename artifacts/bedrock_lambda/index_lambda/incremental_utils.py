@@ -0,0 +1,111 @@
+import hashlib
+
+# Chunk metadata stored next to the text and embedding of every indexed chunk
+CHUNK_METADATA_MAPPING = {
+    "chunk_id": {"type": "keyword"},
+    "doc_id": {"type": "keyword"},
+    "source": {"type": "keyword"},
+    "chunk_ordinal": {"type": "integer"},
+    "content_hash": {"type": "keyword"},
+    "timestamp": {"type": "date"}
+}
+
+
+def _sha256(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+def document_id(source):
+    '''Stable id of a source document, e.g. its S3 key'''
+    return _sha256(source)[:32]
+
+
+def hit_chunk_id(hit):
+    '''Logical id of a stored chunk, its _id unless the service assigned one (see bulk_utils.resolve_chunk_ids)'''
+    return hit.get('_source', {}).get('chunk_id') or hit['_id']
+
+
+def iter_chunk_ids(source, chunk_texts):
+    '''
+    Yields (text, metadata) for a stream of chunks, in document order.
+    The _id is derived from the source, the content hash and the ordinal of that content
+    among identical chunks of the document, and kept in chunk_id for services that assign their own. The position of the chunk is kept in
+    chunk_ordinal instead of the id, so text inserted on page 10 does not change
+    the id of every chunk after it.
+    '''
+    doc_id = document_id(source)
+    seen = {}
+    for ordinal, text in enumerate(chunk_texts):
+        content_hash = _sha256(text)
+        occurrence = seen.get(content_hash, 0)
+        seen[content_hash] = occurrence + 1
+        chunk_id = _sha256(f'{source}|{content_hash}|{occurrence}')
+        yield text, {
+            '_id': chunk_id,
+            'chunk_id': chunk_id,
+            'doc_id': doc_id,
+            'source': source,
+            'chunk_ordinal': ordinal,
+            'content_hash': content_hash
+        }
+
+
+def fetch_existing_chunks(ops_client, index_name, doc_id, page_size=1000):
+    '''
+    Returns {chunk_id: chunk_ordinal} for every chunk already indexed for doc_id.
+    Pages with search_after, which serverless collections support unlike scroll.
+    '''
+    existing = {}
+    search_after = None
+    while True:
+        query = {
+            "size": page_size,
+            "query": {"term": {"doc_id": doc_id}},
+            "_source": ["chunk_ordinal", "chunk_id"],
+            "sort": [{"chunk_ordinal": "asc"}, {"content_hash": "asc"}]
+        }
+        if search_after is not None:
+            query["search_after"] = search_after
+        try:
+            response = ops_client.search(body=query, index=index_name)
+        except Exception as e:
+            print(f'Could not fetch existing chunks for {doc_id}, exception={e}')
+            return existing
+        hits = response["hits"]["hits"]
+        for hit in hits:
+            existing[hit_chunk_id(hit)] = hit['_source'].get('chunk_ordinal')
+        if len(hits) < page_size:
+            return existing
+        search_after = hits[-1]['sort']
+
+
+class IncrementalPlan:
+    '''
+    Diffs a stream of (text, metadata) chunks against the chunks already indexed ({_id: chunk_ordinal}).
+    chunks_to_embed only passes on new chunks, chunks that only moved are collected in moved
+    so their chunk_ordinal can be updated, unchanged ones in unchanged_ids, and removed_ids is
+    known once the stream is exhausted.
+    '''
+
+    def __init__(self, existing):
+        self.existing = existing
+        self.seen_ids = set()
+        self.moved = []
+        self.unchanged_ids = []
+
+    def chunks_to_embed(self, chunks):
+        for text, metadata in chunks:
+            self.seen_ids.add(metadata['_id'])
+            if metadata['_id'] not in self.existing:
+                yield text, metadata
+            elif self.existing[metadata['_id']] != metadata['chunk_ordinal']:
+                self.moved.append(metadata)
+            else:
+                self.unchanged_ids.append(metadata['_id'])
+
+    @property
+    def unchanged(self):
+        return len(self.unchanged_ids)
+
+    def removed_ids(self):
+        return [chunk_id for chunk_id in self.existing if chunk_id not in self.seen_ids]
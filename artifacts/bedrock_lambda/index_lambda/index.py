@@ -12,6 +12,26 @@ import base64
 from datetime import datetime, timezone
 import time
 import threading
+import uuid
+from bulk_utils import bulk_index
+from chunking import TokenBudgetSplitter, chunk_token_budget, estimate_tokens
+from concurrency import AdaptiveConcurrency
+from dedup_utils import DEDUP_MAPPING, ChunkDeduplicator, fetch_links
+from document_metadata import DOCUMENT_METADATA_MAPPING, SCOPE_FIELDS, document_metadata, metadata_outdated
+from embedding_utils import embedding_dimension, get_embedding_adapter, to_byte_vector
+from embedding_cache import CachedEmbedder, build_embedding_cache
+from incremental_utils import (CHUNK_METADATA_MAPPING, IncrementalPlan, document_id, fetch_existing_chunks, hit_chunk_id,
+                               iter_chunk_ids)
+from pipeline import grouped, iter_file_segments, iter_string_segments, pipelined, stream_chunks
+from progress import IngestionProgress
+from index_profiles import build_index_body, load_index_profile
+from index_versions import (create_first_index, create_versioned_index, delete_indexes, first_index_name, missing_documents,
+                            resolve_alias, swap_alias)
+from job_store import DynamoDBJobStore, InMemoryJobStore
+from ocr_utils import IMAGE_EXTENSIONS, OCRResultCache, cached_image_text, ocr_images, s3_etag
+from s3_stream import iter_s3_text
+from textract_utils import cached_job_status, is_textract_notification, parse_textract_notifications, poll_job_status
+from work_queue import SQLiteWorkQueue, SQSWorkQueue, checkpoint_id, drain, is_work_queue_event, parse_work_queue_event
 
 LOG = logging.getLogger()
 LOG.setLevel(logging.INFO)
@@ -22,16 +42,118 @@ SAMPLE_DATA_DIR=getenv("SAMPLE_DATA_DIR", "sample_data")
 INDEX_NAME = getenv("VECTOR_INDEX_NAME", "sample-embeddings-store-dev")
 s3_bucket_name = getenv("S3_BUCKET_NAME", "S3_BUCKET_NAME_MISSING")
 embed_model_id = getenv("EMBED_MODEL_ID", "amazon.titan-embed-image-v1")
+# bulk -> embedded chunks are streamed into _bulk requests, single -> one index call per chunk
+INDEXING_MODE = getenv("INDEXING_MODE", "bulk")
+BULK_MAX_DOCS = int(getenv("BULK_MAX_DOCS", "500"))
+BULK_MAX_BYTES = int(getenv("BULK_MAX_BYTES", str(5 * 1024 * 1024)))
+BULK_MAX_RETRIES = int(getenv("BULK_MAX_RETRIES", "3"))
+# Embedding and single-mode indexing calls in flight adapt between the min and max worker counts,
+# growing while calls succeed and halving on throttling
+EMBED_MIN_WORKERS = int(getenv("EMBED_MIN_WORKERS", "2"))
+EMBED_MAX_WORKERS = int(getenv("EMBED_MAX_WORKERS", "32"))
+EMBED_MAX_RETRIES = int(getenv("EMBED_MAX_RETRIES", "5"))
+# Engine, HNSW parameters, dimension and vector storage of the index, resolved from cdk.json
+INDEX_PROFILE = load_index_profile(getenv("INDEX_PROFILE", ""))
+EMBED_DIMENSION = embedding_dimension(embed_model_id, INDEX_PROFILE['dimension'])
+# bedrock -> EMBED_MODEL_ID on Bedrock, local -> CPU model at EMBED_MODEL_PATH, hashing -> deterministic test vectors
+EMBED_BACKEND = getenv("EMBED_BACKEND", "bedrock")
+EMBED_MODEL_PATH = getenv("EMBED_MODEL_PATH", "")
+# Textract publishes job completion to this topic, which triggers indexing. Empty falls back to polling
+TEXTRACT_SNS_TOPIC_ARN = getenv("TEXTRACT_SNS_TOPIC_ARN", "")
+TEXTRACT_SNS_ROLE_ARN = getenv("TEXTRACT_SNS_ROLE_ARN", "")
+# Longest wait for a Textract job in index-files without a completion topic, indexing needs the rest of the 300 s
+TEXTRACT_POLL_SECONDS = int(getenv("TEXTRACT_POLL_SECONDS", "60"))
+# An INDEXING claim on a Textract job older than this belongs to a lambda that died, the job can be indexed again
+INDEXING_CLAIM_SECONDS = int(getenv("INDEXING_CLAIM_SECONDS", "900"))
+JOB_STATUS_TABLE = getenv("JOB_STATUS_TABLE", "")
+# Max items waiting between the read/chunk, embed and index stages
+PIPELINE_QUEUE_SIZE = int(getenv("PIPELINE_QUEUE_SIZE", "256"))
+# Lookup order for the content addressed embedding cache, any of memory,file,s3. Empty disables it
+EMBED_CACHE_BACKENDS = getenv("EMBED_CACHE_BACKENDS", "memory,file")
+# Share of the function memory the in-process embedding cache may hold, EMBED_CACHE_MAX_MB overrides it
+EMBED_CACHE_MEMORY_SHARE = float(getenv("EMBED_CACHE_MEMORY_SHARE", "0.1"))
+EMBED_CACHE_MAX_MB = int(getenv("EMBED_CACHE_MAX_MB",
+                                str(int(int(getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "1024")) * EMBED_CACHE_MEMORY_SHARE))))
+# /tmp the file tier may fill, of the 512 MB Lambda gives by default
+EMBED_CACHE_FILE_MAX_MB = int(getenv("EMBED_CACHE_FILE_MAX_MB", "128"))
+# token -> sentence aligned chunks sized from the embed model token limit, character -> fixed CHARACTER_CHUNK_SIZE characters,
+# auto -> token where the model takes more than a character chunk. Short-context models (titan-embed-image-v1) keep
+# character chunks, token chunks would multiply their chunks and change every chunk id
+CHUNKER = getenv("CHUNKER", "auto")
+CHARACTER_CHUNK_SIZE = 1000
+CHUNK_TOKEN_SHARE = float(getenv("CHUNK_TOKEN_SHARE", "0.9"))
+# Upper bound on chunk tokens whatever the model accepts, 0 for none
+CHUNK_MAX_TOKENS = int(getenv("CHUNK_MAX_TOKENS", "1000"))
+CHUNK_OVERLAP_SENTENCES = int(getenv("CHUNK_OVERLAP_SENTENCES", "0"))
+# link -> near-duplicate chunks of the same collection and tenant are stored without an embedding and point
+# to their canonical chunk, skip -> they are not stored, off -> every chunk is embedded
+DEDUP_MODE = getenv("DEDUP_MODE", "link")
+# Estimated Jaccard similarity of word 5-gram sets from which a chunk is a near-duplicate
+DEDUP_THRESHOLD = float(getenv("DEDUP_THRESHOLD", "0.85"))
+# Chunk signatures kept in memory per ingestion for near-duplicate lookups, a few KB each
+DEDUP_MAX_SIGNATURES = int(getenv("DEDUP_MAX_SIGNATURES", "5000"))
+# Extracted text of images and PDFs is cached in S3 by ETag, re-indexing never repeats OCR
+OCR_CACHE = getenv("OCR_CACHE", "yes")
+OCR_CACHE_PREFIX = getenv("OCR_CACHE_PREFIX", "ocr-cache/")
+OCR_MAX_WORKERS = int(getenv("OCR_MAX_WORKERS", "8"))
+# Bytes per ranged GET when streaming text objects from S3
+S3_RANGE_SIZE = int(getenv("S3_RANGE_SIZE", str(8 * 1024 * 1024)))
+# Batch ingestion work items go to this SQS queue. Empty uses a SQLite queue in /tmp drained by the request itself
+INGEST_QUEUE_URL = getenv("INGEST_QUEUE_URL", "")
+INGEST_QUEUE_PATH = getenv("INGEST_QUEUE_PATH", "/tmp/ingest-queue.db")
+# Time a batch request spends draining the local queue, leaves headroom before the 300 s lambda timeout
+INGEST_DRAIN_SECONDS = int(getenv("INGEST_DRAIN_SECONDS", "240"))
 
 credentials = boto3.Session().get_credentials()
 
-service = 'aoss'
+# aoss for serverless collections, es for provisioned domains, which also accept replica and refresh settings
+service = getenv("OPENSEARCH_SERVICE", "aoss")
+TUNE_INDEX_SETTINGS = service != 'aoss'
+# Vector search collections reject a client supplied _id on index and _bulk, chunks are then found by
+# their chunk_id field to be replaced, updated or deleted (bulk_utils.resolve_chunk_ids)
+CUSTOM_DOC_IDS = getenv("CUSTOM_DOC_IDS", "no" if service == 'aoss' else "yes") == 'yes'
 region = getenv("REGION", "us-east-1")
 awsauth = AWS4Auth(credentials.access_key, credentials.secret_key,
                    region, service, session_token=credentials.token)
 
 bedrock_client = boto3.client('bedrock-runtime')
 textract_client = boto3.client('textract')
+s3_client = boto3.client('s3')
+embed_limiter = AdaptiveConcurrency(initial=EMBED_MIN_WORKERS * 2, min_limit=EMBED_MIN_WORKERS,
+                                    max_limit=EMBED_MAX_WORKERS, max_retries=EMBED_MAX_RETRIES)
+index_limiter = AdaptiveConcurrency(initial=EMBED_MIN_WORKERS * 2, min_limit=EMBED_MIN_WORKERS,
+                                    max_limit=EMBED_MAX_WORKERS, max_retries=EMBED_MAX_RETRIES)
+embedder = get_embedding_adapter(bedrock_client, embed_model_id, dimension=EMBED_DIMENSION,
+                                 max_workers=EMBED_MAX_WORKERS, limiter=embed_limiter,
+                                 backend=EMBED_BACKEND, model_path=EMBED_MODEL_PATH)
+# A local model decides its own dimension
+EMBED_DIMENSION = embedder.dimension
+embedding_cache = build_embedding_cache(EMBED_CACHE_BACKENDS, s3_client, s3_bucket_name,
+                                        max_bytes=EMBED_CACHE_MAX_MB * 1024 * 1024,
+                                        max_file_bytes=EMBED_CACHE_FILE_MAX_MB * 1024 * 1024)
+if embedding_cache is not None:
+    embedder = CachedEmbedder(embedder, embedding_cache)
+
+job_store = DynamoDBJobStore(boto3.resource('dynamodb').Table(JOB_STATUS_TABLE)) if JOB_STATUS_TABLE else InMemoryJobStore()
+# Job store record of the rebuild of VECTOR_INDEX_NAME in progress, ingestion writes follow its target_index
+REBUILD_ID = f'rebuild:{INDEX_NAME}'
+ocr_cache = OCRResultCache(s3_client, s3_bucket_name, OCR_CACHE_PREFIX) if OCR_CACHE == 'yes' else None
+# Textract synchronous APIs have a low TPS quota, concurrent OCR backs off on throttling
+ocr_limiter = AdaptiveConcurrency(initial=2, min_limit=1, max_limit=OCR_MAX_WORKERS)
+work_queue = SQSWorkQueue(boto3.client('sqs'), INGEST_QUEUE_URL) if INGEST_QUEUE_URL else SQLiteWorkQueue(INGEST_QUEUE_PATH)
+
+if CHUNKER == 'auto':
+    CHUNKER = ('token' if chunk_token_budget(embed_model_id, CHUNK_TOKEN_SHARE, CHUNK_MAX_TOKENS) >= CHARACTER_CHUNK_SIZE / 4
+               else 'character')
+if CHUNKER == 'token':
+    # Sentence aligned chunks packed up to a share of the embed model input limit
+    text_splitter = TokenBudgetSplitter(chunk_token_budget(embed_model_id, CHUNK_TOKEN_SHARE, CHUNK_MAX_TOKENS),
+                                        overlap_sentences=CHUNK_OVERLAP_SENTENCES)
+else:
+    text_splitter = RecursiveCharacterTextSplitter(
+        # Set a really small chunk size, just to show.
+        chunk_size = CHARACTER_CHUNK_SIZE,
+        chunk_overlap  = 50)
 
 ops_client = OpenSearch(
         hosts=[{'host': endpoint, 'port': 443}],
@@ -41,121 +163,637 @@ ops_client = OpenSearch(
         connection_class=RequestsHttpConnection,
         timeout=300
     )
+# Existence is checked on every ingestion, another container may have deleted the index since.
+# The document metadata mapping only needs adding once per container.
+metadata_mapped = False
+index_lock = threading.Lock()
 
 
 def index_sample_data(event):
+    '''
+    Sample files are ingested concurrently against a single index-existence check. The file
+    name is the source, so chunk ids are deterministic and a repeated call neither duplicates
+    documents nor re-embeds unchanged chunks. A failing file does not stop the others.
+    '''
     print(f'In index_sample_data {event}')
     payload = json.loads(event['body'])
     type = payload['type']
+    try:
+        fields = document_metadata(metadata={'collection': f'sample-{type}', **(payload.get('metadata') or {})})
+    except ValueError as e:
+        return failure_response(f'{e}')
     create_index()
-    for i in range(1, 5):
-        try:    
-            file_name=f"{SAMPLE_DATA_DIR}/{type}_doc_{i}.txt"
-            f = open(file_name, "r")
-            data = f.read()
-            if data is not None:
-                index_documents({"body": json.dumps({"text": data}) })
-        except Exception as e:
-            print(f'Error indexing sample data {file_name}, exception={e}')
-            return failure_response('Sample data could not be indexed')
+    file_names = [f"{SAMPLE_DATA_DIR}/{type}_doc_{i}.txt" for i in range(1, 5)]
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(file_names)) as executor:
+        futures = {executor.submit(_index_sample_file, file_name, fields): file_name for file_name in file_names}
+        for future in as_completed(futures):
+            file_name = futures[future]
+            try:
+                results[file_name] = future.result()
+            except Exception as e:
+                print(f'Error indexing sample data {file_name}, exception={e}')
+                results[file_name] = failure_response(f'{e}')
+    failed = [file_name for file_name, result in results.items() if result['statusCode'] != "200"]
+    if len(failed) > 0:
+        return failure_response({'message': 'Sample data could not be indexed', 'failed_files': failed,
+                                 'indexed_files': len(file_names) - len(failed)})
     return success_response('Sample Documents Indexed Successfully')
-    
+
+
+def _index_sample_file(file_name, fields):
+    source = os.path.basename(file_name)
+    return index_text_stream(iter_file_segments(file_name), source=source, incremental=True,
+                             document_fields=document_metadata(source, fields))
+
+
+def index_batch(event):
+    '''
+    Batch ingestion of an S3 prefix or a list of keys. One work item per document goes on
+    the durable queue and workers index them with a checkpoint per document, so a large
+    backfill survives the lambda timeout and resumes after a crash without redoing
+    finished documents. Progress is tracked on the batch_id record of the job store.
+    '''
+    payload = json.loads(event['body'])
+    create_index()
+    return enqueue_batch(payload)
+
+
+def enqueue_batch(payload, index_name=None, **batch_fields):
+    batch_id = payload.get('batch_id') or str(uuid.uuid4())
+    try:
+        # Validated once here, every document of the batch gets the same metadata
+        document_metadata(metadata=payload.get('metadata'))
+    except ValueError as e:
+        return failure_response(f'{e}')
+    s3_keys = payload.get('s3_keys') or list_s3_keys(payload.get('s3_prefix', ''))
+    if len(s3_keys) == 0:
+        return failure_response('No documents found, provide s3_keys or a non empty s3_prefix')
+    items = [{'batch_id': batch_id, 's3_key': s3_key, 'incremental': payload.get('incremental', True)} for s3_key in s3_keys]
+    for item in items:
+        if index_name is not None:
+            item['index_name'] = index_name
+        if payload.get('metadata'):
+            item['metadata'] = payload['metadata']
+    job_store.update(batch_id, batch_status='QUEUED', total=len(items), s3_prefix=payload.get('s3_prefix'), **batch_fields)
+    enqueued = work_queue.enqueue(items)
+    print(f'Batch {batch_id} enqueued {enqueued} of {len(items)} documents')
+    result = {'batch_id': batch_id, 'enqueued': enqueued}
+    if not INGEST_QUEUE_URL:
+        # No queue consumer without SQS, the request drains what it can and a repeated call resumes
+        result.update(drain(work_queue, process_work_item, max_workers=4, deadline=time.time() + INGEST_DRAIN_SECONDS))
+        result.update(work_queue.counts())
+    return success_response(result)
+
+
+def start_reindex(event):
+    '''
+    Full re-index without downtime: the documents are ingested into a new physical index
+    (no replicas and no refresh while building, where the service allows it) through the batch
+    queue, while VECTOR_INDEX_NAME keeps pointing at the current index for queries.
+    Other ingestions write to the new index while it builds, they are searchable after the swap.
+    Once every document is in, the alias is swapped atomically and the old index deleted, unless the
+    old index holds sources the new one does not (documents not in the batch), see swap_index.
+    force takes over from a rebuild in progress.
+    '''
+    payload = json.loads(event['body'])
+    create_index()
+    if not job_store.claim(REBUILD_ID, 'rebuild_status', 'BUILDING', [] if payload.get('force', False) else ['BUILDING']):
+        return failure_response({'message': f'A rebuild of {INDEX_NAME} is in progress', **(job_store.get(REBUILD_ID) or {})})
+    payload['batch_id'] = payload.get('batch_id') or str(uuid.uuid4())
+    target_index = create_versioned_index(ops_client, INDEX_NAME, index_body(), tune_settings=TUNE_INDEX_SETTINGS,
+                                          attach_alias=False)
+    job_store.update(REBUILD_ID, batch_id=payload['batch_id'], target_index=target_index)
+    print(f'Rebuilding {INDEX_NAME} into {target_index}')
+    result = enqueue_batch(payload, target_index, rebuild_status='BUILDING', target_index=target_index)
+    if not result['success']:
+        job_store.update(REBUILD_ID, rebuild_status='ABANDONED')
+        delete_indexes(ops_client, [target_index])
+        return result
+    result['result']['target_index'] = target_index
+    maybe_finish_reindex(result['result']['batch_id'])
+    return result
+
+
+def swap_index(event):
+    '''
+    Swaps the alias to a rebuilt index once every document of the batch is indexed and no source of the
+    current index is missing from it, e.g. after ingesting the missing documents (they go to the rebuilt index).
+    force swaps even if documents failed or are missing, they are dropped with the old index.
+    '''
+    payload = json.loads(event['body'])
+    rebuild = job_store.get(payload['batch_id']) or {}
+    if rebuild.get('rebuild_status') != 'BUILDING':
+        return failure_response(f'No rebuild in progress for batch {payload["batch_id"]}')
+    if not payload.get('force', False):
+        if not _batch_indexed(rebuild):
+            return failure_response({'message': 'Rebuild still in progress or documents failed', **rebuild})
+        missing = _missing_documents(payload['batch_id'], rebuild['target_index'])
+        if missing is not None:
+            return failure_response({'message': 'The rebuilt index is missing documents of the current index', **missing})
+    return success_response(finish_reindex(payload['batch_id'], rebuild['target_index']))
+
+
+def _batch_indexed(batch):
+    # A PDF counts once its Textract job is indexed, not when the job is submitted
+    return int(batch.get('indexed', 0)) >= int(batch.get('total', 0))
+
+
+def _batch_done(batch):
+    # Documents whose Textract job failed are done too, a re-run of the batch starts them again
+    return int(batch.get('indexed', 0)) + int(batch.get('failed', 0)) >= int(batch.get('total', 0))
+
+
+def batch_progress(batch_id):
+    '''Marks the batch COMPLETED once every document is indexed or failed, a rebuild waiting on it can swap'''
+    batch = job_store.get(batch_id) or {}
+    if batch.get('batch_status') != 'COMPLETED' and _batch_done(batch):
+        job_store.update(batch_id, batch_status='COMPLETED', completed_at=time.time())
+    maybe_finish_reindex(batch_id)
+
+
+def maybe_finish_reindex(batch_id):
+    rebuild = job_store.get(batch_id) or {}
+    if rebuild.get('rebuild_status') != 'BUILDING':
+        return
+    if _batch_indexed(rebuild):
+        if _missing_documents(batch_id, rebuild['target_index']) is None:
+            finish_reindex(batch_id, rebuild['target_index'])
+    elif _batch_done(rebuild):
+        print(f'Rebuild {batch_id} has {rebuild.get("failed")} failed documents, re-run the batch or force the swap')
+
+
+def _missing_documents(batch_id, target_index):
+    '''None when the rebuilt index has every source of the current one, else what is missing, recorded on the batch'''
+    current = [index for index in resolve_alias(ops_client, INDEX_NAME) if index != target_index]
+    sources, unsourced = missing_documents(ops_client, current, target_index)
+    if len(sources) == 0 and unsourced == 0:
+        return None
+    missing = {'missing_source_count': len(sources), 'missing_sources': sources[:50], 'missing_unsourced_chunks': unsourced}
+    print(f'Not swapping {INDEX_NAME} to {target_index}, missing {len(sources)} sources and {unsourced} chunks without a source')
+    job_store.update(batch_id, **missing)
+    return missing
+
+
+def finish_reindex(batch_id, target_index):
+    previous = swap_alias(ops_client, INDEX_NAME, target_index, tune_settings=TUNE_INDEX_SETTINGS)
+    print(f'{INDEX_NAME} now points to {target_index}, deleting {previous}')
+    job_store.update(batch_id, rebuild_status='SWAPPED', swapped_at=time.time(), previous_indexes=previous)
+    if (job_store.get(REBUILD_ID) or {}).get('target_index') == target_index:
+        job_store.update(REBUILD_ID, rebuild_status='SWAPPED')
+    delete_indexes(ops_client, previous)
+    return {'batch_id': batch_id, 'index': target_index, 'deleted': previous}
+
+
+def list_s3_keys(s3_prefix):
+    s3_keys = []
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=s3_bucket_name, Prefix=s3_prefix):
+        s3_keys.extend(obj['Key'] for obj in page.get('Contents', []) if not obj['Key'].endswith('/'))
+    return s3_keys
+
+
+def process_work_item(item):
+    '''Indexes one document of a batch, returns True once the document needs no further attempt'''
+    checkpoint = checkpoint_id(item)
+    state = job_store.get(checkpoint) or {}
+    if state.get('status') == 'INDEXED' or (state.get('status') == 'TEXTRACT_STARTED' and TEXTRACT_SNS_TOPIC_ARN):
+        print(f'Skipping {checkpoint}, already {state["status"]}')
+        return True
+    if state.get('status') == 'TEXTRACT_STARTED':
+        # Retried while the Textract job was still running
+        return wait_and_index_textract_job(state['textract_job_id'], item)
+    s3_key = item['s3_key']
+    file_extension = _file_extension(s3_key)
+    job_store.update(checkpoint, status='INDEXING', attempts=int(state.get('attempts', 0)) + 1)
+    pdf_text = cached_pdf_text(s3_key) if file_extension in ['pdf'] else None
+    if file_extension in ['pdf'] and pdf_text is None:
+        job_id = start_pdf_text_detection_job(s3_key, item.get('index_name'), item.get('metadata'),
+                                              batch_id=item['batch_id'], checkpoint=checkpoint)
+        job_store.update(checkpoint, status='TEXTRACT_STARTED', textract_job_id=job_id)
+        job_store.increment(item['batch_id'], submitted=1)
+        if TEXTRACT_SNS_TOPIC_ARN:
+            # Indexed by handle_textract_notification once Textract completes
+            return True
+        return wait_and_index_textract_job(job_id, item)
+    start = time.perf_counter()
+    segments = document_segments(s3_key, file_extension, pdf_text)
+    job_store.update(checkpoint, s3_key=s3_key, file_type=file_extension,
+                     extract_seconds=round(time.perf_counter() - start, 3))
+    result = index_text_stream(segments, s3_key, item.get('incremental', True), checkpoint, item.get('index_name'),
+                               document_metadata(s3_key, item.get('metadata')))
+    if result['success']:
+        _checkpoint_indexed(checkpoint, item['batch_id'])
+        return True
+    job_store.update(checkpoint, status='FAILED', error=json.dumps(result['errorMessage'], cls=CustomJsonEncoder)[:1000])
+    job_store.increment(item['batch_id'], failed_attempts=1)
+    return False
+
+
+def wait_and_index_textract_job(job_id, item):
+    '''
+    Without a completion topic the worker polls Textract for up to TEXTRACT_POLL_SECONDS and indexes
+    the job itself. A job still running is retried with the work item, which resumes the same job.
+    '''
+    status = isJobComplete(job_id)
+    if status == 'IN_PROGRESS':
+        print(f'Textract job {job_id} of {item["s3_key"]} still running, retrying later')
+        return False
+    if status != 'SUCCEEDED':
+        _batch_textract_failed(job_id, status)
+        return True
+    return index_textract_job(job_id, item['s3_key'], item.get('incremental', True))['success']
+
+
+def _checkpoint_indexed(checkpoint, batch_id):
+    '''Checkpoints a document of a batch as indexed, counting it once'''
+    state = job_store.get(checkpoint) or {}
+    if state.get('status') == 'INDEXED':
+        return
+    job_store.update(checkpoint, status='INDEXED', failure_counted=False)
+    counters = {'indexed': 1}
+    if state.get('failure_counted'):
+        # Failed for good before, a re-run of the batch indexed it
+        counters['failed'] = -1
+    job_store.increment(batch_id, **counters)
+    batch_progress(batch_id)
+
+
+def _batch_textract_failed(jobId, status):
+    '''Checkpoints the batch document of a failed Textract job as FAILED, it counts toward batch completion'''
+    job = job_store.get(jobId) or {}
+    checkpoint = job.get('checkpoint')
+    if job.get('batch_id') is None or checkpoint is None:
+        return
+    # SNS redelivers notifications, the failure is counted once
+    if not job_store.claim(checkpoint, 'status', 'FAILED', ['FAILED', 'INDEXED']):
+        return
+    job_store.update(checkpoint, error=f'Textract job {jobId} finished with status {status}', failure_counted=True)
+    job_store.increment(job['batch_id'], failed=1)
+    batch_progress(job['batch_id'])
+
+
+def handle_work_queue_messages(event):
+    '''
+    Entry point for the SQS event source of the ingestion queue. Failed messages are
+    reported back so only they are retried, and reach the dead letter queue after the redrive limit.
+    '''
+    create_index()
+    failures = []
+    messages = parse_work_queue_event(event)
+    # OCR of every image of the delivery runs concurrently up front, processing then reads the cache
+    image_keys = [item['s3_key'] for _, item in messages if _file_extension(item['s3_key']) in IMAGE_EXTENSIONS]
+    if ocr_cache is not None and len(image_keys) > 1:
+        ocr_images(textract_client, s3_client, s3_bucket_name, image_keys, ocr_cache, ocr_limiter, OCR_MAX_WORKERS)
+    for message_id, item in messages:
+        try:
+            done = process_work_item(item)
+        except Exception as e:
+            print(f'Error processing work item {item}, exception={e}')
+            done = False
+        if not done:
+            failures.append({'itemIdentifier': message_id})
+    return {'batchItemFailures': failures}
+
 
 def create_index() :
-    print(f'In create index')
-    if not ops_client.indices.exists(index=INDEX_NAME):
-    # Create indicies
-        settings = {
-            "settings": {
-                "index": {
-                    "knn": True,
-                }
-            },
-            "mappings": {
-                "properties": {
-                    "id": {"type": "integer"},
-                    "text": {"type": "text"},
-                    "embedding": {
-                        "type": "knn_vector",
-                        "dimension": 384,
-                        "method": {
-                            "name":"hnsw",
-                            "engine":"nmslib",
-                            "space_type": "cosinesimil"
-                        }
-                    },
-                }
-            },
-        }
-        res = ops_client.indices.create(index=INDEX_NAME, body=settings, ignore=[400])
-        print(res)
+    global metadata_mapped
+    # Concurrent ingestions in a warm container create the index once
+    with index_lock:
+        if not ops_client.indices.exists(index=INDEX_NAME):
+            # VECTOR_INDEX_NAME is an alias over a versioned physical index, so it can be rebuilt and swapped
+            print(f'Creating index with profile {INDEX_PROFILE["name"]}, dimension {EMBED_DIMENSION}')
+            if not create_first_index(ops_client, INDEX_NAME, index_body()):
+                print(f'Index {first_index_name(INDEX_NAME)} was created by another container')
+            metadata_mapped = True
+        elif not metadata_mapped:
+            # Indexes created before the document metadata and chunk_id fields map them explicitly, not dynamically
+            try:
+                ops_client.indices.put_mapping(index=INDEX_NAME, body={"properties": {
+                    **DOCUMENT_METADATA_MAPPING, "chunk_id": CHUNK_METADATA_MAPPING["chunk_id"]}})
+            except Exception as e:
+                print(f'Document metadata mapping not added, exception={_error_reason(e)}')
+            metadata_mapped = True
+
+
+def index_body():
+    return build_index_body(INDEX_PROFILE, EMBED_DIMENSION, {
+        "id": {"type": "integer"},
+        "text": {"type": "text"},
+        **CHUNK_METADATA_MAPPING,
+        **DOCUMENT_METADATA_MAPPING,
+        **DEDUP_MAPPING
+    })
 
 def index_documents(event):
     print(f'In index documents {event}')
     payload = json.loads(event['body'])
     text_val = payload['text']
+    # With a source (S3 key) chunks get deterministic ids and re-ingesting only touches changed chunks
+    source = payload.get('source')
+    incremental = source is not None and payload.get('incremental', True)
+    # Progress of the ingestion is readable from get-job-status with this id
+    job_id = payload.get('job_id') or str(uuid.uuid4())
+    try:
+        # collection, tenant, doc_type and document_date, filterable at query time
+        fields = document_metadata(source, payload.get('metadata'))
+    except ValueError as e:
+        return failure_response(f'{e}')
 
-    text_splitter = RecursiveCharacterTextSplitter(
-    # Set a really small chunk size, just to show.
-    chunk_size = 1000,
-    chunk_overlap  = 50)
+    if text_val is None or text_val.strip() == '':
+        return success_response('Documents indexed successfully')
 
-    texts = text_splitter.create_documents([text_val])
+    create_index()
+    indexing_mode = payload.get('indexing_mode', INDEXING_MODE)
+    if indexing_mode == 'bulk' or incremental:
+        return index_text_stream(iter_string_segments(text_val), source, incremental, job_id, document_fields=fields)
 
-    if texts is not None and len(texts) > 0:
-        create_index()
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            futures = [executor.submit(_generate_embeddings_and_index,chunk_text) for chunk_text in texts]
-            for future in as_completed(futures):
-                result = future.result()
-                if result['statusCode'] != "200":
-                    return failure_response(result['errorMessage'])
-                else:
-                    print(result)
-                    
-    return success_response('Documents indexed successfully')
-
-
-def _generate_embeddings_and_index(chunk_text):
-        body = json.dumps({"inputText": chunk_text.page_content, "embeddingConfig": {"outputEmbeddingLength": 384}})
-        
+    progress = IngestionProgress(job_store, job_id)
+    texts = text_splitter.split_text(text_val)
+    progress.count(chunks=len(texts))
+    chunks = iter_chunk_ids(source, texts) if source is not None else [(chunk_text, {}) for chunk_text in texts]
+    chunks = [(chunk_text, {**fields, **metadata} or None) for chunk_text, metadata in chunks]
+    # The pool is only the ceiling, index_limiter decides how many calls are in flight
+    with ThreadPoolExecutor(max_workers=EMBED_MAX_WORKERS) as executor:
+        index_name = write_index()
+        futures = [executor.submit(_generate_embeddings_and_index, chunk_text, metadata, progress, index_name)
+                   for chunk_text, metadata in chunks]
+        # Every chunk is awaited, a failed chunk does not hide the outcome of the others
+        failed = [result['errorMessage'] for result in (future.result() for future in as_completed(futures))
+                  if result['statusCode'] != "200"]
+    progress.finish(failed)
+    if len(failed) > 0:
+        return failure_response({'message': f'{len(failed)} of {len(futures)} chunks failed', 'failed': failed[:50], 'job_id': job_id})
+    return success_response({'message': 'Documents indexed successfully', 'job_id': job_id})
+
+
+def index_text_stream(segments, source=None, incremental=False, job_id=None, index_name=None, document_fields=None):
+    '''
+    Streaming ingestion: text segments are chunked lazily, embedded in the largest batches
+    the embed model supports and streamed into bounded _bulk batches. Each stage runs on
+    its own thread with a bounded queue in between, so memory stays flat with document size
+    and the first chunks are searchable before the last ones are read.
+    In incremental mode only new chunks are embedded, moved chunks get their
+    ordinal updated and chunks no longer in the document are deleted.
+    With a job_id, stage timings, counts and throughput are recorded on the job record.
+    Near-duplicates of a chunk of the same collection and tenant are not embedded (DEDUP_MODE),
+    chunks linked to a chunk that is deleted or moves to another collection or tenant are embedded again.
+    index_name targets a physical index being rebuilt instead of the VECTOR_INDEX_NAME alias,
+    without it the chunks go to the index of a rebuild in progress.
+    document_fields (document_metadata) are stored on every chunk, unchanged chunks are updated
+    in place when the document was indexed with other values.
+    '''
+    index_name = write_index(index_name)
+    document_fields = document_metadata(source) if document_fields is None else document_fields
+    embed_failures = []
+    progress = IngestionProgress(job_store, job_id)
+    dedup_saved_tokens = []
+    relinked = []
+    plan = None
+    if source is not None and incremental:
+        plan = IncrementalPlan(fetch_existing_chunks(ops_client, index_name, document_id(source)))
+    dedup = None
+    if DEDUP_MODE != 'off':
+        # Links stay within the collection and tenant, queries filtering on other fields resolve them.
+        # Without a source a link could not be relinked, only chunks of this ingestion are compared
+        scope = {field: document_fields.get(field) for field in SCOPE_FIELDS} if source is not None else None
+        # A chunk of the previous version not seen again (yet) may be deleted, it is never made canonical
+        is_live = (lambda chunk_id: chunk_id not in plan.existing or chunk_id in plan.seen_ids) if plan is not None else None
+        dedup = ChunkDeduplicator(ops_client, index_name, DEDUP_THRESHOLD, scope=scope, max_signatures=DEDUP_MAX_SIGNATURES,
+                                  is_live=is_live)
+
+    def chunks():
+        for chunk_text in progress.timed(stream_chunks(segments, text_splitter.split_text), 'read_chunk'):
+            progress.count(chunks=1)
+            yield chunk_text
+
+    def chunks_to_embed():
+        if source is None:
+            return ((chunk_text, None) for chunk_text in chunks())
+        with_ids = iter_chunk_ids(source, chunks())
+        return plan.chunks_to_embed(with_ids) if plan is not None else with_ids
+
+    def embedded_docs(pending):
+        # Enough chunks per group to keep every embedding worker busy
+        for group in grouped(pending, embedder.max_batch_size * EMBED_MAX_WORKERS):
+            if dedup is not None:
+                start = time.perf_counter()
+                group, duplicates = dedup.partition(group)
+                progress.add_time('dedup', time.perf_counter() - start)
+                progress.count(duplicates=len(duplicates))
+                dedup_saved_tokens.extend(estimate_tokens(chunk_text) for chunk_text, _, _, _ in duplicates)
+                for chunk_text, metadata, canonical_id, score in duplicates:
+                    if DEDUP_MODE == 'link' and metadata is not None and canonical_id is not None:
+                        yield {**_duplicate_doc(chunk_text, metadata, canonical_id, score), **document_fields}
+            else:
+                group = [(chunk_text, metadata, None) for chunk_text, metadata in group]
+            if len(group) == 0:
+                continue
+            start = time.perf_counter()
+            try:
+                embeddings = embedder.embed([chunk_text for chunk_text, _, _ in group])
+            except Exception as e:
+                embed_failures.extend({'_id': metadata['_id'] if metadata else None, 'status': 'embed_error',
+                                       'reason': str(e)} for _, metadata, _ in group)
+                continue
+            finally:
+                progress.add_time('embed', time.perf_counter() - start)
+            progress.count(embedded=len(group))
+            for (chunk_text, metadata, dedup_fields), embedding in zip(group, embeddings):
+                doc = _embedded_doc(chunk_text, embedding, metadata)
+                doc.update(document_fields)
+                if dedup_fields is not None:
+                    doc.update(dedup_fields)
+                yield doc
+
+    def bulk_docs():
+        for doc in pipelined(embedded_docs(pipelined(chunks_to_embed(), PIPELINE_QUEUE_SIZE)), PIPELINE_QUEUE_SIZE):
+            yield doc
+        # The chunk stream is exhausted here, moved and removed chunks are known
+        if plan is not None:
+            kept_ids = plan.unchanged_ids + [metadata['_id'] for metadata in plan.moved]
+            # Checked before the kept chunks are updated. Links to them leave a collection or tenant they no longer share
+            new_scope = {field: value for field, value in scope_values(document_fields).items() if value is not None}
+            rescoped = (dedup is not None and len(kept_ids) > 0 and
+                        metadata_outdated(ops_client, index_name, document_id(source), new_scope))
+            outdated = len(plan.unchanged_ids) > 0 and metadata_outdated(ops_client, index_name, document_id(source), document_fields)
+            for metadata in plan.moved:
+                yield {'_op': 'update', '_id': metadata['_id'], 'chunk_ordinal': metadata['chunk_ordinal'], **document_fields}
+            if outdated:
+                for chunk_id in plan.unchanged_ids:
+                    yield {'_op': 'update', '_id': chunk_id, **document_fields}
+            removed_ids = plan.removed_ids()
+            for chunk_id in removed_ids:
+                yield {'_op': 'delete', '_id': chunk_id}
+            if len(removed_ids) > 0 or rescoped:
+                yield from relinked_docs(set(removed_ids), set(kept_ids) if rescoped else set())
+
+    def relinked_docs(removed_ids, rescoped_ids):
+        # Links whose canonical chunk is gone or in another collection or tenant now get their own embedding.
+        # When this document changes scope, so do its links to chunks of other documents
+        moved_ordinals = {metadata['_id']: metadata['chunk_ordinal'] for metadata in plan.moved}
+        own_doc_id = document_id(source) if len(rescoped_ids) > 0 else None
+        links = (hit for hit in fetch_links(ops_client, index_name, removed_ids | rescoped_ids, doc_id=own_doc_id)
+                 if hit_chunk_id(hit) not in removed_ids and
+                 (hit['_source'].get('duplicate_of') in removed_ids or
+                  (hit['_source'].get('doc_id') == own_doc_id and hit['_source'].get('duplicate_of') not in plan.seen_ids) or
+                  (hit['_source'].get('doc_id') != document_id(source) and
+                   scope_values(hit['_source']) != scope_values(document_fields))))
+        for group in grouped(links, embedder.max_batch_size * EMBED_MAX_WORKERS):
+            try:
+                embeddings = embedder.embed([hit['_source']['text'] for hit in group])
+            except Exception as e:
+                embed_failures.extend({'_id': hit_chunk_id(hit), 'status': 'embed_error', 'reason': str(e)} for hit in group)
+                continue
+            for hit, embedding in zip(group, embeddings):
+                chunk_id = hit_chunk_id(hit)
+                # A link keeps the fields of its own document
+                metadata = {key: value for key, value in hit['_source'].items()
+                            if key not in ['text', 'duplicate_of', 'duplicate_similarity', 'timestamp']}
+                if metadata.get('doc_id') == document_id(source):
+                    metadata.update(document_fields)
+                    metadata['chunk_ordinal'] = moved_ordinals.get(chunk_id, metadata.get('chunk_ordinal'))
+                doc = _embedded_doc(hit['_source']['text'], embedding, {'_id': chunk_id, **metadata})
+                if dedup is not None:
+                    signature = dedup.hasher.signature(doc['text'])
+                    doc.update({'minhash': signature, 'lsh_bands': dedup.hasher.band_keys(signature)})
+                relinked.append(chunk_id)
+                yield doc
+
+    def on_batch(indexed, seconds):
+        progress.add_time('index', seconds)
+        progress.count(indexed=indexed)
+
+    progress.flush(force=True)
+    embed_calls, embed_throttles = embedder.calls, embed_limiter.throttles
+    cache_hits, cache_misses = getattr(embedder, 'hits', 0), getattr(embedder, 'misses', 0)
+    stats = bulk_index(ops_client, index_name, bulk_docs(), max_docs=BULK_MAX_DOCS, max_bytes=BULK_MAX_BYTES,
+                       max_retries=BULK_MAX_RETRIES, on_batch=on_batch, custom_ids=CUSTOM_DOC_IDS)
+    failed = embed_failures + stats.pop('failed')
+    stats.pop('seconds')
+    stats['chunks'] = progress.counts['chunks']
+    stats['unchanged'] = plan.unchanged if plan is not None else 0
+    stats['moved'] = len(plan.moved) if plan is not None else 0
+    stats['deleted'] = len(plan.removed_ids()) if plan is not None else 0
+    stats['relinked'] = len(relinked)
+    stats['embedded'] = progress.counts['embedded']
+    # What near-duplicate suppression saved: embed model input and vectors in the HNSW graph
+    stats['near_duplicates'] = dedup.duplicates if dedup is not None else 0
+    stats['dedup_saved_tokens'] = sum(dedup_saved_tokens)
+    stats['dedup_saved_vector_bytes'] = stats['near_duplicates'] * EMBED_DIMENSION * (1 if INDEX_PROFILE['data_type'] == 'byte' else 4)
+    stats['embed_calls'] = embedder.calls - embed_calls
+    stats['embed_cache_hits'] = getattr(embedder, 'hits', 0) - cache_hits
+    stats['embed_cache_misses'] = getattr(embedder, 'misses', 0) - cache_misses
+    stats['embed_throttles'] = embed_limiter.throttles - embed_throttles
+    stats['embed_concurrency'] = embed_limiter.limit
+    progress.count(unchanged=stats['unchanged'], moved=stats['moved'], deleted=stats['deleted'])
+    record = progress.finish(failed)
+    stats['stage_seconds'] = record['stage_seconds']
+    stats['throughput'] = record['throughput']
+    if job_id is not None:
+        stats['job_id'] = job_id
+    print(f'Bulk indexing failed={len(failed)}, ' + ', '.join(f'{key}={value}' for key, value in stats.items()))
+    if len(failed) > 0:
+        return failure_response({'message': f'{len(failed)} chunk operations failed', **stats, 'failed': failed[:50]})
+    return success_response({'message': 'Documents indexed successfully', **stats})
+
+
+def _embedded_doc(chunk_text, embedding, metadata=None):
+    if INDEX_PROFILE['data_type'] == 'byte':
+        embedding = to_byte_vector(embedding)
+    doc = {
+        'embedding' : embedding,
+        'text': chunk_text,
+        'timestamp': datetime.today().replace(tzinfo=timezone.utc).isoformat()
+    }
+    if metadata is not None:
+        doc.update(metadata)
+    return doc
+
+
+def scope_values(fields):
+    return {field: fields.get(field) for field in SCOPE_FIELDS}
+
+
+def _duplicate_doc(chunk_text, metadata, canonical_id, score):
+    # No embedding, the chunk is not in the vector graph and searches return its canonical chunk
+    return {
+        **metadata,
+        'text': chunk_text,
+        'duplicate_of': canonical_id,
+        'duplicate_similarity': score,
+        'timestamp': datetime.today().replace(tzinfo=timezone.utc).isoformat()
+    }
+
+
+def _generate_embeddings(chunk_text, metadata=None):
+    return _embedded_doc(chunk_text, embedder.embed([chunk_text])[0], metadata)
+
+
+def write_index(index_name=None):
+    '''Where ingestion writes go: index_name, else the index of a rebuild in progress, else the alias'''
+    if index_name is not None:
+        return index_name
+    rebuild = job_store.get(REBUILD_ID) or {}
+    if rebuild.get('rebuild_status') == 'BUILDING' and rebuild.get('target_index') is not None:
+        return rebuild['target_index']
+    return INDEX_NAME
+
+
+def _generate_embeddings_and_index(chunk_text, metadata=None, progress=None, index_name=INDEX_NAME):
+        progress = progress or IngestionProgress(job_store)
         try:
-            response = bedrock_client.invoke_model(
-                    body = body,
-                    modelId = embed_model_id,
-                    accept = 'application/json',
-                    contentType = 'application/json'
-            )
-            result = json.loads(response['body'].read())
-
-            finish_reason = result.get("message")
-            if finish_reason is not None:
-                print(f'Embed Error {finish_reason}')
-                
-            embeddings = result.get("embedding")
+            start = time.perf_counter()
+            doc = _generate_embeddings(chunk_text, metadata)
+            progress.add_time('embed', time.perf_counter() - start)
+            progress.count(embedded=1)
         except Exception as e:
-            return failure_response(f'Do you have access to embed model {embed_model_id}. Error {e.info["error"]["reason"]}')
-        doc = {
-            'embedding' : embeddings,
-            'text': chunk_text.page_content,
-            'timestamp': datetime.today().replace(tzinfo=timezone.utc).isoformat()
-        }
+            return failure_response(f'Do you have access to embed model {embed_model_id}. Error {e}')
         try:
             # Index the document
-            ops_client.index(index=INDEX_NAME, body=doc)
+            chunk_id = doc.pop('_id', None)
+            start = time.perf_counter()
+            if chunk_id is not None and not CUSTOM_DOC_IDS:
+                # Replaces the chunk stored under the same chunk_id
+                stats = index_limiter.run(bulk_index, ops_client, index_name, [{**doc, '_id': chunk_id}], max_retries=0,
+                                          custom_ids=False)
+                if len(stats['failed']) > 0:
+                    raise RuntimeError(stats['failed'][0]['reason'])
+            else:
+                index_limiter.run(ops_client.index, index=index_name, body=doc, id=chunk_id)
+            progress.add_time('index', time.perf_counter() - start)
+            progress.count(indexed=1)
             return success_response('Documents Indexed Successfully')
         except Exception as e:
-            print(e.info["error"]["reason"])
-            return failure_response(f'error indexing documents {e.info["error"]["reason"]}')
+            print(_error_reason(e))
+            return failure_response(f'error indexing documents {_error_reason(e)}')
+
+
+def _error_reason(e):
+    # opensearchpy errors carry the response body in info, connection errors and botocore errors do not
+    info = getattr(e, 'info', None)
+    if isinstance(info, dict) and isinstance(info.get('error'), dict):
+        return info['error'].get('reason', str(e))
+    return str(e)
         
 
 
 def delete_index(event):
     try:
-        res = ops_client.indices.delete(index=INDEX_NAME)
+        # Deleting through an alias is rejected, the physical indexes behind it are deleted
+        indexes = resolve_alias(ops_client, INDEX_NAME)
+        if len(indexes) == 0:
+            return failure_response(f'error deleting index. {INDEX_NAME} does not exist')
+        rebuild = job_store.get(REBUILD_ID) or {}
+        if rebuild.get('rebuild_status') == 'BUILDING':
+            # Writes would otherwise keep going to the rebuilt index
+            job_store.update(REBUILD_ID, rebuild_status='ABANDONED')
+            job_store.update(rebuild['batch_id'], rebuild_status='ABANDONED')
+            if ops_client.indices.exists(index=rebuild['target_index']):
+                indexes.append(rebuild['target_index'])
+        res = ops_client.indices.delete(index=','.join(indexes))
         print(res)
     except Exception as e:
-        return failure_response(f'error deleting index. {e.info["error"]["reason"]}')
+        return failure_response(f'error deleting index. {_error_reason(e)}')
     return success_response('Index deleted successfully')
 
 def connect_tracker(event):
@@ -203,49 +841,215 @@ def get_job_status(event):
     if 'queryStringParameters' in event:
         query_params = event['queryStringParameters']
     if all(key in query_params for key in (['jobId'])):
-        return success_response(isJobCompleted(query_params['jobId']))
+        job = job_status(query_params['jobId'])
+        if job is None:
+            return failure_response(f'Unknown job {query_params["jobId"]}', status_code="404")
+        return success_response(job)
     else:
         return failure_response('jobId is missing')
+
+
+def job_status(jobId):
+    '''
+    The job record: Textract status for PDFs, then stage timings, chunk counts,
+    throughput and failures of the ingestion. completed is True once the document is searchable,
+    or for a batch once every document is indexed or failed.
+    None for a job id the job store does not know, Textract is not asked about it.
+    '''
+    job = job_store.get(jobId)
+    if job is None:
+        return None
+    if 'batch_status' in job:
+        job['jobId'] = jobId
+        job['completed'] = job['batch_status'] == 'COMPLETED'
+        return job
+    # Textract jobs and batch checkpoints of PDFs, other records never ran Textract
+    textract_job_id = job.get('textract_job_id', jobId if job.get('file_type') == 'pdf' else None)
+    if 'ingestion_status' not in job and textract_job_id is not None:
+        # Still waiting on Textract, the cached status refreshes the record
+        try:
+            isJobCompleted(textract_job_id)
+            job = {**job, **(job_store.get(jobId) or {}),
+                   'textract_status': (job_store.get(textract_job_id) or {}).get('textract_status')}
+        except Exception as e:
+            print(f'Could not read Textract status of job {textract_job_id}, exception={e}')
+    job['jobId'] = jobId
+    job['completed'] = job.get('ingestion_status') == 'COMPLETED'
+    return job
     
 def detect_text_index(event):
     payload = json.loads(event['body'])
+    if 's3_keys' in payload:
+        return detect_text_index_many(payload)
     s3_key = payload['s3_key']
-    file_extension = 'txt'
-    if '.' in s3_key:
-        file_extension = s3_key[s3_key.rindex('.')+1:]
-    
-    if file_extension.lower() in ['pdf']:
-            job_id = start_pdf_text_detection_job(s3_key)
+    file_extension = _file_extension(s3_key)
+    try:
+        fields = document_metadata(s3_key, payload.get('metadata'))
+    except ValueError as e:
+        return failure_response(f'{e}')
+
+    pdf_text = cached_pdf_text(s3_key) if file_extension in ['pdf'] else None
+    if file_extension in ['pdf'] and pdf_text is None:
+            job_id = start_pdf_text_detection_job(s3_key, metadata=payload.get('metadata'))
             # t1 = threading.Thread(target=async_indexing(file_extension, event, job_id))
-            return success_response({'jobId': job_id})
+            # s3_key is handed back so index-files can re-index the document incrementally
+            return success_response({'jobId': job_id, 's3_key': s3_key})
     else:
-        content = get_contents(file_extension, get_file_from_s3(s3_key), None)
-        event['body'] = json.dumps({"text": content})
+        job_id = str(uuid.uuid4())
+        start = time.perf_counter()
+        segments = document_segments(s3_key, file_extension, pdf_text)
+        job_store.update(job_id, s3_key=s3_key, file_type=file_extension,
+                         extract_seconds=round(time.perf_counter() - start, 3))
         # Directly index as the content is readable through normal decoding
         # TODO Integrate wrangler for xls files
-        return index_documents(event)
+        create_index()
+        return index_text_stream(segments, s3_key, payload.get('incremental', True), job_id, document_fields=fields)
+
 
+def detect_text_index_many(payload):
+    '''
+    detect-text for a list of s3_keys. Images are OCRed concurrently, PDFs start their
+    Textract jobs (indexed on completion) and every other document is indexed in turn.
+    '''
+    s3_keys = payload['s3_keys']
+    incremental = payload.get('incremental', True)
+    metadata = payload.get('metadata')
+    image_keys = [s3_key for s3_key in s3_keys if _file_extension(s3_key) in IMAGE_EXTENSIONS]
+    image_texts = ocr_images(textract_client, s3_client, s3_bucket_name, image_keys, ocr_cache, ocr_limiter, OCR_MAX_WORKERS)
+    results = {}
+    for s3_key in s3_keys:
+        text = image_texts.get(s3_key)
+        if isinstance(text, Exception):
+            results[s3_key] = failure_response(f'OCR failed. {text}')
+        elif text is not None:
+            results[s3_key] = index_documents({'body': json.dumps({'text': text, 'source': s3_key, 'incremental': incremental,
+                                                                   'metadata': metadata})})
+        else:
+            results[s3_key] = detect_text_index({'body': json.dumps({'s3_key': s3_key, 'incremental': incremental,
+                                                                     'metadata': metadata})})
+    failed = [s3_key for s3_key, result in results.items() if result['statusCode'] != "200"]
+    response = {'documents': {s3_key: result.get('result', result.get('errorMessage')) for s3_key, result in results.items()}}
+    if len(failed) > 0:
+        return failure_response({'message': f'{len(failed)} of {len(s3_keys)} documents failed', 'failed': failed, **response})
+    return success_response(response)
+
+
+def _file_extension(s3_key):
+    return s3_key[s3_key.rindex('.') + 1:].lower() if '.' in s3_key else 'txt'
 
-def get_file_from_s3(s3_key):
-    s3 = boto3.resource('s3')
-    obj = s3.Object(s3_bucket_name, s3_key)
-    file_bytes = obj.get()['Body'].read()
-    print(f'returns S3 encoded object from key {s3_bucket_name}/{s3_key}')
-    return file_bytes
+
+def document_segments(s3_key, file_extension, pdf_text=None):
+    '''
+    Text segments of a document that needs no Textract job: OCR for images and cached PDF
+    text (by ETag, pdf_text when the caller already looked it up), otherwise the object is
+    streamed with ranged GETs and decoded incrementally, so memory does not grow with the object size.
+    '''
+    if file_extension in IMAGE_EXTENSIONS:
+        return iter_string_segments(get_contents(file_extension, None, s3_key))
+    if pdf_text is None and file_extension in ['pdf']:
+        pdf_text = cached_pdf_text(s3_key)
+    if pdf_text is not None:
+        return iter_string_segments(pdf_text)
+    return iter_s3_text(s3_client, s3_bucket_name, s3_key, S3_RANGE_SIZE)
+
+
+def cached_pdf_text(s3_key):
+    '''Text of a PDF extracted by an earlier Textract job on the same content, None when there is none'''
+    if ocr_cache is None:
+        return None
+    try:
+        return ocr_cache.get(s3_etag(s3_client, s3_bucket_name, s3_key))
+    except Exception as e:
+        print(f'Could not look up OCR cache for {s3_key}, exception={e}')
+        return None
 
 
 def index_file_in_aoss(event):
     '''
     This function is called for PDF files which passed through Textract
-    Once the PDF job is complete we retrieve the contents based on JobID
-    and initiate the indexing
+    Once the PDF job is complete we stream the contents page by page based on JobID
+    into the indexing pipeline. Jobs already indexed from their completion event are skipped.
+    With a completion topic the SNS event indexes the job, a job still running is not waited on.
+    Otherwise Textract is polled for up to TEXTRACT_POLL_SECONDS and a job still running
+    is reported so the caller retries.
     '''
     payload = json.loads(event['body'])
     jobId = payload['jobId']
-    content = get_contents('pdf', None, None, jobId)
-    event['body'] = json.dumps({"text": content})
+    job = job_store.get(jobId) or {}
+    if job.get('indexing_status') in ['INDEXING', 'INDEXED']:
+        return success_response({'jobId': jobId, 'indexing_status': job['indexing_status']})
+    if TEXTRACT_SNS_TOPIC_ARN:
+        status = cached_job_status(textract_client, jobId, job_store, max_age_seconds=0)
+    else:
+        status = isJobComplete(jobId)
+    if status == 'IN_PROGRESS':
+        return success_response({'jobId': jobId, 'textract_status': status})
+    if status != 'SUCCEEDED':
+        return failure_response(f'Textract job {jobId} finished with status {status}')
+    return index_textract_job(jobId, payload.get('s3_key', job.get('s3_key')), payload.get('incremental', True))
+
+
+def index_textract_job(jobId, s3_key=None, incremental=True):
+    '''
+    Indexes the text of a finished Textract job. The completion event, its SNS redeliveries and
+    index-files can all get here for the same job, only the caller that claims it indexes.
+    '''
+    if not job_store.claim(jobId, 'indexing_status', 'INDEXING', ['INDEXING', 'INDEXED'], INDEXING_CLAIM_SECONDS):
+        print(f'Skipping Textract job {jobId}, already indexing or indexed')
+        return success_response({'jobId': jobId, 'indexing_status': (job_store.get(jobId) or {}).get('indexing_status')})
+    create_index()
+    job = job_store.get(jobId) or {}
+    started_at = job.get('textract_started_at')
+    if started_at is not None:
+        job_store.update(jobId, textract_seconds=round(time.time() - float(started_at), 3))
     print('Asynchronous Indexing of data')
-    return index_documents(event)
+    pages = []
+
+    def job_text():
+        # Kept to store the extracted text in the OCR cache once every page was indexed
+        for text in iter_job_text(jobId):
+            pages.append(text)
+            yield text
+
+    # Metadata of the detect-text request, validated before the Textract job was started
+    fields = document_metadata(s3_key, job.get('document_metadata'))
+    result = index_text_stream(job_text(), s3_key, s3_key is not None and incremental, jobId, job.get('index_name'), fields)
+    etag = (job_store.get(jobId) or {}).get('source_etag')
+    if ocr_cache is not None and etag and result['success']:
+        ocr_cache.put(etag, ''.join(pages))
+    job_store.update(jobId, indexing_status='INDEXED' if result['success'] else 'FAILED')
+    if job.get('batch_id') is not None:
+        _batch_textract_done(job, result)
+    return result
+
+
+def _batch_textract_done(job, result):
+    '''Checkpoints the batch document of a Textract job, a rebuild waiting on it can swap now'''
+    checkpoint = job['checkpoint']
+    if not result['success']:
+        # A re-run of the batch starts the document again
+        job_store.update(checkpoint, status='FAILED', error=json.dumps(result['errorMessage'], cls=CustomJsonEncoder)[:1000])
+        job_store.increment(job['batch_id'], failed_attempts=1)
+        return
+    _checkpoint_indexed(checkpoint, job['batch_id'])
+
+
+def handle_textract_notification(event):
+    '''
+    Entry point for the Textract completion messages delivered through SNS.
+    Records the final job status and indexes successful jobs, so neither this
+    lambda nor the UI has to poll Textract for completion.
+    '''
+    for notification in parse_textract_notifications(event):
+        jobId = notification['job_id']
+        print(f'Textract job {jobId} completed with status {notification["status"]}')
+        job_store.update(jobId, textract_status=notification['status'], status_checked_at=time.time())
+        if notification['status'] == 'SUCCEEDED':
+            result = index_textract_job(jobId, notification['s3_key'])
+            print(f'Indexed Textract job {jobId}, result={result}')
+        else:
+            _batch_textract_failed(jobId, notification['status'])
+    return success_response('Textract notifications processed')
 
 # def async_indexing(file_extension, event, job_id):
 #     content = get_contents(file_extension, None, None, job_id)
@@ -254,60 +1058,61 @@ def index_file_in_aoss(event):
 #     return index_documents(event)
 
 def getJobResults(jobId):
-
-    pages = []
-    response = textract_client.get_document_text_detection(JobId=jobId)
-    
-    pages.append(response)
-    print("Resultset page recieved: {}".format(len(pages)))
+    '''
+    Yields the Textract result pages as each NextToken page arrives,
+    instead of collecting every page before the text is assembled
+    '''
     nextToken = None
-    if('NextToken' in response):
-        nextToken = response['NextToken']
+    page_count = 0
+    while True:
+        if nextToken:
+            response = textract_client.get_document_text_detection(JobId=jobId, NextToken=nextToken)
+        else:
+            response = textract_client.get_document_text_detection(JobId=jobId)
+        page_count = page_count + 1
+        print("Resultset page recieved: {}".format(page_count))
+        yield response
+        nextToken = response.get('NextToken')
+        if not nextToken:
+            return
 
-    while(nextToken):
-        response = textract_client.get_document_text_detection(JobId=jobId, NextToken=nextToken)
 
-        pages.append(response)
-        print("Resultset page recieved: {}".format(len(pages)))
-        nextToken = None
-        if('NextToken' in response):
-            nextToken = response['NextToken']
-    return pages
+def iter_job_text(jobId):
+    '''Yields the LINE text of a Textract job, one result page at a time'''
+    for resultPage in getJobResults(jobId):
+        lines = [item["Text"] for item in resultPage["Blocks"] if item["BlockType"] == "LINE"]
+        if len(lines) > 0:
+            yield ' ' + ' '.join(lines)
 
 def isJobCompleted(jobId):
-    response = textract_client.get_document_text_detection(JobId=jobId)
-    status = response["JobStatus"]
-    print("Job status: {}".format(status))
-    return True if status == "SUCCEEDED" else False
+    return cached_job_status(textract_client, jobId, job_store) == "SUCCEEDED"
     
 
 def isJobComplete(jobId):
-    response = textract_client.get_document_text_detection(JobId=jobId)
-    status = response["JobStatus"]
-    print("Job status: {}".format(status))
-
-    while(status == "IN_PROGRESS"):
-        time.sleep(3)
-        response = textract_client.get_document_text_detection(JobId=jobId)
-        status = response["JobStatus"]
-        print("Job status: {}".format(status))
-
-    return status
+    return poll_job_status(textract_client, jobId, job_store, timeout=TEXTRACT_POLL_SECONDS)
 
 def startJob(s3BucketName, objectName):
-    response = None
-    response = textract_client.start_document_text_detection(
-    DocumentLocation={
-        'S3Object': {
-            'Bucket': s3BucketName,
-            'Name': objectName
+    request = {
+        'DocumentLocation': {
+            'S3Object': {
+                'Bucket': s3BucketName,
+                'Name': objectName
+            }
         }
-    })
+    }
+    if TEXTRACT_SNS_TOPIC_ARN and TEXTRACT_SNS_ROLE_ARN:
+        request['NotificationChannel'] = {'SNSTopicArn': TEXTRACT_SNS_TOPIC_ARN, 'RoleArn': TEXTRACT_SNS_ROLE_ARN}
+    response = textract_client.start_document_text_detection(**request)
 
     return response["JobId"]
 
-def start_pdf_text_detection_job(s3_key):
+def start_pdf_text_detection_job(s3_key, index_name=None, metadata=None, batch_id=None, checkpoint=None):
+    # ETag of the content Textract reads, the extracted text is cached under it
+    etag = s3_etag(s3_client, s3_bucket_name, s3_key) if ocr_cache is not None else None
     jobId = startJob(s3_bucket_name, s3_key)
+    job_store.update(jobId, s3_key=s3_key, file_type='pdf', textract_status='IN_PROGRESS', source_etag=etag, index_name=index_name,
+                     document_metadata=metadata, batch_id=batch_id, checkpoint=checkpoint,
+                     textract_started_at=time.time(), status_checked_at=time.time())
     print("Started job with id: {}".format(jobId))
     return jobId
 
@@ -315,18 +1120,14 @@ def get_contents(file_extension: str, file_bytes=None, s3_key=None, jobId=None):
     content = ' '
     try:
         if file_extension.lower() in ['pdf']:
-            if(isJobComplete(jobId)):
-                response = getJobResults(jobId)
-                # Print detected text
-                for resultPage in response:
-                    for item in resultPage["Blocks"]:
-                        if item["BlockType"] == "LINE":
-                            content = content + ' ' + item["Text"]
-        elif file_extension.lower() in ['png', 'jpg', 'jpeg']:
+            if isJobComplete(jobId) == 'SUCCEEDED':
+                content = content + ''.join(iter_job_text(jobId))
+        elif file_extension.lower() in IMAGE_EXTENSIONS and s3_key is not None:
+            content = content + ' ' + cached_image_text(textract_client, s3_client, s3_bucket_name, s3_key, ocr_cache, ocr_limiter)
+        elif file_extension.lower() in IMAGE_EXTENSIONS:
             response = textract_client.detect_document_text(Document={'Bytes': file_bytes})
-            for block in response['Blocks']:
-                if block['BlockType'] == 'LINE':
-                    content = content + ' ' + block['Text']
+            lines = [block['Text'] for block in response['Blocks'] if block['BlockType'] == 'LINE']
+            content = content + ' ' + ' '.join(lines)
         else: 
             content = file_bytes.decode()
     except Exception as e:
@@ -339,10 +1140,17 @@ def get_contents(file_extension: str, file_bytes=None, s3_key=None, jobId=None):
     pass
 def handler(event, context):
     LOG.info("---  Amazon Opensearch Serverless vector db example with Amazon Bedrock Models ---")
+    if is_textract_notification(event):
+        return handle_textract_notification(event)
+    if is_work_queue_event(event):
+        return handle_work_queue_messages(event)
 
     api_map = {
         'POST/rag/index-sample-data': lambda x: index_sample_data(x),
         'POST/rag/index-documents': lambda x: index_documents(x),
+        'POST/rag/index-batch': lambda x: index_batch(x),
+        'POST/rag/reindex': lambda x: start_reindex(x),
+        'POST/rag/swap-index': lambda x: swap_index(x),
         'DELETE/rag/index-documents': lambda x: delete_index(x),
         'GET/rag/connect-tracker': lambda x: connect_tracker(x),
         'POST/rag/detect-text': lambda x: detect_text_index(x),
@@ -366,8 +1174,8 @@ def handler(event, context):
         return respond(failure_response('system_exception'), None)
 
 
-def failure_response(error_message):
-    return {"success": False, "errorMessage": error_message, "statusCode": "400"}
+def failure_response(error_message, status_code="400"):
+    return {"success": False, "errorMessage": error_message, "statusCode": status_code}
    
 def success_response(result):
     return {"success": True, "result": result, "statusCode": "200"}
@@ -0,0 +1,67 @@
+import json
+
+# faiss HNSW, 384 float dimensions. faiss applies metadata filters inside the kNN search, the nmslib
+# index the lambda created before (nmslib-default in cdk.json) can only filter the neighbours it found
+DEFAULT_INDEX_PROFILE = {
+    "name": "faiss-hnsw",
+    "engine": "faiss",
+    "space_type": "l2",
+    "m": 16,
+    "ef_construction": 128,
+    "ef_search": 100,
+    "dimension": 384,
+    "data_type": "float"
+}
+
+
+def load_index_profile(profile_json):
+    '''
+    The profile is resolved from cdk.json (vector_index_profiles + the index_profile of the
+    environment) and handed to the lambdas as JSON. Missing keys fall back to the default profile.
+    '''
+    profile = dict(DEFAULT_INDEX_PROFILE)
+    if profile_json:
+        try:
+            profile.update(json.loads(profile_json))
+        except ValueError as e:
+            print(f'Invalid INDEX_PROFILE {profile_json}, using the default profile. exception={e}')
+    return profile
+
+
+def build_index_body(profile, dimension, extra_properties=None):
+    '''
+    Index settings and mappings for a profile. fp16 compresses faiss vectors server side
+    with the scalar quantization encoder, byte stores lucene vectors as int8 which the
+    lambdas quantize before indexing and searching.
+    '''
+    parameters = {"m": profile["m"], "ef_construction": profile["ef_construction"]}
+    if profile["engine"] == 'faiss' and profile.get("encoder") == 'fp16':
+        parameters["encoder"] = {"name": "sq", "parameters": {"type": "fp16"}}
+
+    embedding = {
+        "type": "knn_vector",
+        "dimension": dimension,
+        "method": {
+            "name": "hnsw",
+            "engine": profile["engine"],
+            "space_type": profile["space_type"],
+            "parameters": parameters
+        }
+    }
+    if profile.get("data_type", "float") != 'float':
+        embedding["data_type"] = profile["data_type"]
+
+    index_settings = {"knn": True}
+    # lucene has no ef_search setting, retrieval.knn_query raises the k of the query to it instead
+    if profile["engine"] != 'lucene':
+        index_settings["knn.algo_param.ef_search"] = profile["ef_search"]
+
+    return {
+        "settings": {"index": index_settings},
+        "mappings": {
+            "properties": {
+                **(extra_properties or {}),
+                "embedding": embedding
+            }
+        }
+    }
@@ -0,0 +1,127 @@
+from datetime import datetime, timezone
+
+# A physical index being rebuilt takes writes only: no replicas to copy every segment to, no periodic refresh
+BUILD_SETTINGS = {"index": {"number_of_replicas": 0, "refresh_interval": "-1"}}
+SERVING_SETTINGS = {"index": {"number_of_replicas": 1, "refresh_interval": "1s"}}
+
+
+def versioned_index_name(alias):
+    return f'{alias}-v{datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")}'
+
+
+def first_index_name(alias):
+    # Fixed, so containers creating the first index at the same time all name the same one
+    return f'{alias}-v1'
+
+
+def resolve_alias(ops_client, alias):
+    '''
+    Physical indexes behind alias. An index created before aliases were used has the alias
+    name itself and is returned as is, an empty list means neither exists.
+    '''
+    if ops_client.indices.exists_alias(name=alias):
+        return sorted(ops_client.indices.get_alias(name=alias).keys())
+    if ops_client.indices.exists(index=alias):
+        return [alias]
+    return []
+
+
+def create_versioned_index(ops_client, alias, body, tune_settings=False, attach_alias=True):
+    '''
+    Creates a new physical index for alias and returns its name. attach_alias points the alias at it
+    straight away (first index), a rebuild attaches it later with swap_alias.
+    With tune_settings the index is created with BUILD_SETTINGS, which managed collections reject.
+    '''
+    index_name = versioned_index_name(alias)
+    body = dict(body)
+    if tune_settings:
+        body["settings"] = {"index": {**body.get("settings", {}).get("index", {}), **BUILD_SETTINGS["index"]}}
+    if attach_alias:
+        body["aliases"] = {alias: {}}
+    ops_client.indices.create(index=index_name, body=body)
+    return index_name
+
+
+def create_first_index(ops_client, alias, body):
+    '''
+    Creates the first physical index of alias with the alias attached, returns False when it
+    already existed (another container won the race), then the alias is made to point at it.
+    Any other error is raised.
+    '''
+    index_name = first_index_name(alias)
+    try:
+        ops_client.indices.create(index=index_name, body={**body, "aliases": {alias: {}}})
+        return True
+    except Exception as e:
+        if getattr(e, 'error', None) != 'resource_already_exists_exception':
+            raise
+    # Adding an alias an index already has is a no-op
+    ops_client.indices.update_aliases(body={"actions": [{"add": {"index": index_name, "alias": alias}}]})
+    return False
+
+
+def swap_alias(ops_client, alias, new_index, tune_settings=False):
+    '''
+    Restores serving settings on new_index, makes its documents searchable and moves alias to it
+    in one atomic _aliases call, searches see either the old or the new index, never neither.
+    Returns the previous physical indexes, a legacy index named like the alias is removed by the swap itself.
+    '''
+    if tune_settings:
+        ops_client.indices.put_settings(index=new_index, body=SERVING_SETTINGS)
+    ops_client.indices.refresh(index=new_index)
+    previous = [index for index in resolve_alias(ops_client, alias) if index != new_index]
+    actions = []
+    for index in previous:
+        if index == alias:
+            actions.append({"remove_index": {"index": index}})
+        else:
+            actions.append({"remove": {"index": index, "alias": alias}})
+    actions.append({"add": {"index": new_index, "alias": alias}})
+    ops_client.indices.update_aliases(body={"actions": actions})
+    return [index for index in previous if index != alias]
+
+
+def missing_documents(ops_client, indexes, target_index, page_size=1000):
+    '''
+    What swapping the alias from indexes to target_index would drop: the sources indexed in indexes
+    but not in target_index, and how many more chunks without a source indexes hold.
+    '''
+    # A rebuilt index does not refresh while building
+    ops_client.indices.refresh(index=target_index)
+    missing = set()
+    unsourced = 0
+    for index in indexes:
+        missing.update(_sources(ops_client, index, page_size))
+        unsourced = unsourced + _unsourced_chunks(ops_client, index)
+    missing.difference_update(_sources(ops_client, target_index, page_size))
+    return sorted(missing), max(unsourced - _unsourced_chunks(ops_client, target_index), 0)
+
+
+def _sources(ops_client, index, page_size):
+    # Distinct source values, paged with a composite aggregation
+    sources = set()
+    after = None
+    while True:
+        composite = {"size": page_size, "sources": [{"source": {"terms": {"field": "source"}}}]}
+        if after is not None:
+            composite["after"] = after
+        response = ops_client.search(index=index, body={"size": 0, "aggs": {"sources": {"composite": composite}}})
+        buckets = response["aggregations"]["sources"]["buckets"]
+        sources.update(bucket["key"]["source"] for bucket in buckets)
+        after = response["aggregations"]["sources"].get("after_key")
+        if len(buckets) < page_size or after is None:
+            return sources
+
+
+def _unsourced_chunks(ops_client, index):
+    query = {"size": 0, "track_total_hits": True, "query": {"bool": {"must_not": [{"exists": {"field": "source"}}]}}}
+    return ops_client.search(index=index, body=query)["hits"]["total"]["value"]
+
+
+def delete_indexes(ops_client, indexes):
+    for index in indexes:
+        try:
+            ops_client.indices.delete(index=index)
+            print(f'Deleted index {index}')
+        except Exception as e:
+            print(f'Could not delete index {index}, exception={e}')
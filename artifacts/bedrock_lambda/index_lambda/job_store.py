@@ -0,0 +1,121 @@
+import copy
+import threading
+import time
+from decimal import Decimal
+
+
+def _to_dynamo(value):
+    # DynamoDB rejects floats, numbers go in as Decimal
+    if isinstance(value, float):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: _to_dynamo(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_dynamo(v) for v in value]
+    return value
+
+
+class InMemoryJobStore:
+    '''
+    Job status records for a single container. Used when no JOB_STATUS_TABLE is
+    configured and as the local stand-in of the DynamoDB table.
+    '''
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return copy.deepcopy(job) if job is not None else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.setdefault(job_id, {'job_id': job_id})
+            job.update(copy.deepcopy(fields))
+            job['updated_at'] = time.time()
+
+    def increment(self, job_id, **counters):
+        with self._lock:
+            job = self._jobs.setdefault(job_id, {'job_id': job_id})
+            for name, value in counters.items():
+                job[name] = job.get(name, 0) + value
+            job['updated_at'] = time.time()
+
+    def claim(self, job_id, field, value, unless, stale_seconds=None):
+        '''
+        Sets field to value unless it already holds one of unless, True when this caller set it.
+        A claim on value older than stale_seconds (its holder died) can be taken over.
+        '''
+        now = time.time()
+        with self._lock:
+            job = self._jobs.setdefault(job_id, {'job_id': job_id})
+            current = job.get(field)
+            stale = (stale_seconds is not None and current == value
+                     and float(job.get(f'{field}_claimed_at', now)) < now - stale_seconds)
+            if current in unless and not stale:
+                return False
+            job[field] = value
+            job[f'{field}_claimed_at'] = now
+            job['updated_at'] = now
+            return True
+
+
+class DynamoDBJobStore:
+    '''Job status records in a DynamoDB table keyed on job_id, shared by every container'''
+
+    def __init__(self, table):
+        self.table = table
+
+    def get(self, job_id):
+        try:
+            return self.table.get_item(Key={'job_id': job_id}, ConsistentRead=True).get('Item')
+        except Exception as e:
+            print(f'Could not read job {job_id} from job status table, exception={e}')
+            return None
+
+    def update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        names = {f'#f{i}': name for i, name in enumerate(fields)}
+        values = {f':v{i}': _to_dynamo(value) for i, value in enumerate(fields.values())}
+        expression = 'SET ' + ', '.join(f'#f{i} = :v{i}' for i in range(len(fields)))
+        try:
+            self.table.update_item(Key={'job_id': job_id}, UpdateExpression=expression,
+                                   ExpressionAttributeNames=names, ExpressionAttributeValues=values)
+        except Exception as e:
+            print(f'Could not update job {job_id} in job status table, exception={e}')
+
+    def increment(self, job_id, **counters):
+        # ADD is atomic, workers of every container can count into the same record
+        names = {f'#f{i}': name for i, name in enumerate(counters)}
+        values = {f':v{i}': _to_dynamo(value) for i, value in enumerate(counters.values())}
+        names['#updated_at'] = 'updated_at'
+        values[':updated_at'] = _to_dynamo(time.time())
+        expression = 'ADD ' + ', '.join(f'#f{i} :v{i}' for i in range(len(counters))) + ' SET #updated_at = :updated_at'
+        try:
+            self.table.update_item(Key={'job_id': job_id}, UpdateExpression=expression,
+                                   ExpressionAttributeNames=names, ExpressionAttributeValues=values)
+        except Exception as e:
+            print(f'Could not update job {job_id} in job status table, exception={e}')
+
+    def claim(self, job_id, field, value, unless, stale_seconds=None):
+        '''Conditional update, a single writer wins even when containers race on the same job'''
+        now = time.time()
+        names = {'#f': field, '#claimed_at': f'{field}_claimed_at', '#updated_at': 'updated_at'}
+        values = {':v': value, ':now': _to_dynamo(now)}
+        values.update({f':u{i}': status for i, status in enumerate(unless)})
+        condition = 'attribute_not_exists(#f) OR NOT #f IN (' + ', '.join(f':u{i}' for i in range(len(unless))) + ')'
+        if stale_seconds is not None:
+            values[':stale'] = _to_dynamo(now - stale_seconds)
+            condition = condition + ' OR (#f = :v AND #claimed_at < :stale)'
+        try:
+            self.table.update_item(Key={'job_id': job_id}, UpdateExpression='SET #f = :v, #claimed_at = :now, #updated_at = :now',
+                                   ConditionExpression=condition, ExpressionAttributeNames=names, ExpressionAttributeValues=values)
+            return True
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            # Same as a failed update, the job is not held up by the status table
+            print(f'Could not claim job {job_id} in job status table, exception={e}')
+            return True
@@ -0,0 +1,102 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = ['png', 'jpg', 'jpeg']
+# Bumped when the way text is assembled from Textract blocks changes, older entries are then ignored
+OCR_CACHE_VERSION = 'lines-v1'
+
+
+def s3_etag(s3_client, bucket, key):
+    return s3_client.head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+
+
+def detect_image_text(textract_client, bucket, key):
+    '''Synchronous OCR of an image, Textract reads it from S3 so the bytes never pass through the lambda'''
+    response = textract_client.detect_document_text(Document={'S3Object': {'Bucket': bucket, 'Name': key}})
+    return ' '.join(block['Text'] for block in response['Blocks'] if block['BlockType'] == 'LINE')
+
+
+class OCRResultCache:
+    '''
+    Extracted text keyed on the S3 ETag of the source object, in S3 under prefix and in
+    memory for the warm container. The ETag changes with the content only, so re-indexing
+    the same image or PDF, under any key or with another embed model, skips Textract.
+    '''
+
+    def __init__(self, s3_client, bucket, prefix='ocr-cache/', max_memory_entries=256):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_memory_entries = max_memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, etag):
+        return f'{self.prefix}{OCR_CACHE_VERSION}/{etag}.txt'
+
+    def get(self, etag):
+        with self._lock:
+            if etag in self._memory:
+                self._memory.move_to_end(etag)
+                self.hits = self.hits + 1
+                return self._memory[etag]
+        try:
+            text = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(etag))['Body'].read().decode('utf-8')
+        except Exception:
+            with self._lock:
+                self.misses = self.misses + 1
+            return None
+        self._remember(etag, text)
+        with self._lock:
+            self.hits = self.hits + 1
+        return text
+
+    def put(self, etag, text):
+        self._remember(etag, text)
+        try:
+            self.s3_client.put_object(Bucket=self.bucket, Key=self._key(etag), Body=text.encode('utf-8'),
+                                      ContentType='text/plain; charset=utf-8')
+        except Exception as e:
+            print(f'Could not store OCR result {etag}, exception={e}')
+
+    def _remember(self, etag, text):
+        with self._lock:
+            self._memory[etag] = text
+            self._memory.move_to_end(etag)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+
+def cached_image_text(textract_client, s3_client, bucket, key, cache=None, limiter=None):
+    if cache is None:
+        return detect_image_text(textract_client, bucket, key)
+    etag = s3_etag(s3_client, bucket, key)
+    text = cache.get(etag)
+    if text is None:
+        if limiter is not None:
+            text = limiter.run(detect_image_text, textract_client, bucket, key)
+        else:
+            text = detect_image_text(textract_client, bucket, key)
+        cache.put(etag, text)
+    return text
+
+
+def ocr_images(textract_client, s3_client, bucket, keys, cache=None, limiter=None, max_workers=8):
+    '''
+    OCR of many images at once on a bounded pool, cached results are served without a
+    Textract call. Returns {key: text}, images that failed map to their exception.
+    '''
+    def extract(key):
+        try:
+            return cached_image_text(textract_client, s3_client, bucket, key, cache, limiter)
+        except Exception as e:
+            print(f'OCR failed for {key}, exception={e}')
+            return e
+
+    if len(keys) == 0:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as executor:
+        return dict(zip(keys, executor.map(extract, keys)))
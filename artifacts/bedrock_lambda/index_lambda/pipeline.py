@@ -0,0 +1,102 @@
+import queue
+import threading
+
+_DONE = object()
+
+
+class _StageError:
+    def __init__(self, error):
+        self.error = error
+
+
+def iter_string_segments(text, segment_size=64 * 1024):
+    '''Yields an in-memory string in slices, so chunking never materializes every chunk at once'''
+    for start in range(0, len(text), segment_size):
+        yield text[start:start + segment_size]
+
+
+def iter_file_segments(file_name, segment_size=64 * 1024, encoding='utf-8'):
+    with open(file_name, 'r', encoding=encoding) as f:
+        while True:
+            segment = f.read(segment_size)
+            if not segment:
+                return
+            yield segment
+
+
+def stream_chunks(segments, split_text, window=64 * 1024):
+    '''
+    Lazily chunks a stream of text segments with split_text (e.g. a langchain splitter).
+    Text is buffered up to window characters and split, every chunk but the last is emitted,
+    the last one is carried over and re-split with the next segments so chunk boundaries
+    land where they would have if the whole text had been split in one go.
+    '''
+    buffer = ''
+    for segment in segments:
+        buffer = buffer + segment
+        if len(buffer) < window:
+            continue
+        chunks = split_text(buffer)
+        if len(chunks) <= 1:
+            continue
+        for chunk in chunks[:-1]:
+            yield chunk
+        # Splitters strip chunk edges, keep the trailing whitespace so words do not run together
+        buffer = chunks[-1] + buffer[len(buffer.rstrip()):]
+    if buffer.strip() != '':
+        for chunk in split_text(buffer):
+            yield chunk
+
+
+def pipelined(iterable, queue_size=64):
+    '''
+    Runs iterable on its own thread and yields its items through a bounded queue.
+    The producer blocks once queue_size items are waiting, which keeps memory flat,
+    errors in the producer are re-raised in the consumer.
+    '''
+    items = queue.Queue(maxsize=queue_size)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_DONE)
+        except Exception as e:
+            put(_StageError(e))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    finally:
+        # Unblocks the producer when the consumer stops early
+        stopped.set()
+        producer.join(timeout=5)
+
+
+def grouped(iterable, group_size):
+    group = []
+    for item in iterable:
+        group.append(item)
+        if len(group) >= group_size:
+            yield group
+            group = []
+    if len(group) > 0:
+        yield group
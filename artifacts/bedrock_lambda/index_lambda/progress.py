@@ -0,0 +1,93 @@
+import threading
+import time
+
+# Failure reasons kept on the job record, the full list is in the indexing response
+MAX_RECORDED_FAILURES = 10
+
+
+class IngestionProgress:
+    '''
+    Stage timings, chunk counts and throughput of one ingestion, written to the job store
+    under job_id while it runs (at most every flush_seconds) and once more when it ends,
+    so get-job-status reports live progress. Stages overlap in the streaming pipeline,
+    stage_seconds is the busy time of each stage and elapsed_seconds the wall time.
+    Without a job_id nothing is written and only the summary is returned.
+    '''
+
+    def __init__(self, job_store, job_id=None, flush_seconds=2):
+        self.job_store = job_store
+        self.job_id = job_id
+        self.flush_seconds = flush_seconds
+        self.started_at = time.time()
+        self.stage_seconds = {'read_chunk': 0.0, 'embed': 0.0, 'index': 0.0}
+        self.counts = {'chunks': 0, 'embedded': 0, 'indexed': 0, 'failed': 0}
+        self._last_flush = 0
+        self._lock = threading.Lock()
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    def count(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                self.counts[name] = self.counts.get(name, 0) + value
+        self.flush()
+
+    def timed(self, iterable, stage):
+        '''Yields the items of iterable, the time spent producing them is added to stage'''
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def throughput(self):
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        with self._lock:
+            stage_seconds, counts = dict(self.stage_seconds), dict(self.counts)
+
+        def rate(count, seconds):
+            return round(count / seconds, 2) if seconds > 0 else 0
+
+        return {
+            'chunks_per_second': rate(counts['chunks'], elapsed),
+            'embed_chunks_per_second': rate(counts['embedded'], stage_seconds['embed']),
+            'index_docs_per_second': rate(counts['indexed'], stage_seconds['index'])
+        }
+
+    def record(self, status):
+        with self._lock:
+            record = {
+                'ingestion_status': status,
+                'started_at': self.started_at,
+                'elapsed_seconds': round(time.time() - self.started_at, 3),
+                'stage_seconds': {stage: round(seconds, 3) for stage, seconds in self.stage_seconds.items()},
+                **self.counts
+            }
+        record['throughput'] = self.throughput()
+        return record
+
+    def flush(self, force=False):
+        if self.job_id is None:
+            return
+        now = time.time()
+        if not force and now - self._last_flush < self.flush_seconds:
+            return
+        self._last_flush = now
+        self.job_store.update(self.job_id, **self.record('RUNNING'))
+
+    def finish(self, failed):
+        '''Writes the final record and returns it, failed is the list of failed chunk operations'''
+        with self._lock:
+            self.counts['failed'] = len(failed)
+        record = self.record('FAILED' if len(failed) > 0 else 'COMPLETED')
+        record['finished_at'] = time.time()
+        if self.job_id is not None:
+            self.job_store.update(self.job_id, **record, failures=[str(failure)[:500] for failure in failed[:MAX_RECORDED_FAILURES]])
+        return record
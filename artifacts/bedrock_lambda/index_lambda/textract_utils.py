@@ -0,0 +1,70 @@
+import json
+import random
+import time
+
+# Textract job statuses after which the job will not change anymore
+TERMINAL_STATUSES = ['SUCCEEDED', 'FAILED', 'PARTIAL_SUCCESS']
+
+
+def parse_textract_notifications(event):
+    '''
+    Returns the completion messages Textract published to the SNS topic of
+    start_document_text_detection, one dict per record with job_id, status, bucket and s3_key
+    '''
+    notifications = []
+    for record in event.get('Records', []):
+        if 'Sns' not in record:
+            continue
+        message = json.loads(record['Sns']['Message'])
+        location = message.get('DocumentLocation', {})
+        notifications.append({
+            'job_id': message['JobId'],
+            'status': message['Status'],
+            'bucket': location.get('S3Bucket'),
+            's3_key': location.get('S3ObjectName')
+        })
+    return notifications
+
+
+def is_textract_notification(event):
+    records = event.get('Records', [])
+    return len(records) > 0 and records[0].get('EventSource') == 'aws:sns'
+
+
+def _fetch_status(textract_client, job_id, job_store):
+    response = textract_client.get_document_text_detection(JobId=job_id, MaxResults=1)
+    status = response["JobStatus"]
+    job_store.update(job_id, textract_status=status, status_checked_at=time.time())
+    print("Job status: {}".format(status))
+    return status
+
+
+def cached_job_status(textract_client, job_id, job_store, max_age_seconds=5):
+    '''
+    Status of a Textract job, read from the job status table. Textract is only asked
+    when the job is not finished and the cached status is older than max_age_seconds,
+    so a UI polling get-job-status does not turn into a Textract call per request.
+    '''
+    job = job_store.get(job_id)
+    if job is not None and 'textract_status' in job:
+        status = job['textract_status']
+        checked_at = float(job.get('status_checked_at', 0))
+        if status in TERMINAL_STATUSES or time.time() - checked_at < max_age_seconds:
+            return status
+    return _fetch_status(textract_client, job_id, job_store)
+
+
+def poll_job_status(textract_client, job_id, job_store, initial_delay=1, max_delay=10, timeout=60):
+    '''
+    Waits for a Textract job where no completion event is available, with exponential
+    backoff and jitter between checks instead of a fixed sleep. A status already recorded
+    in the job status table (e.g. by the completion event) ends the wait without a Textract call.
+    '''
+    deadline = time.time() + timeout
+    delay = initial_delay
+    status = cached_job_status(textract_client, job_id, job_store, max_age_seconds=0)
+    while status == 'IN_PROGRESS' and time.time() < deadline:
+        time.sleep(min(delay, max(deadline - time.time(), 0)) * (0.8 + 0.4 * random.random()))
+        delay = min(delay * 2, max_delay)
+        status = cached_job_status(textract_client, job_id, job_store, max_age_seconds=0)
+    return status
@@ -0,0 +1,125 @@
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# SQS send_message_batch accepts up to 10 messages
+SQS_MAX_BATCH = 10
+
+
+def is_work_queue_event(event):
+    records = event.get('Records') if isinstance(event, dict) else None
+    return bool(records) and records[0].get('eventSource') == 'aws:sqs'
+
+
+def parse_work_queue_event(event):
+    '''(message id, work item) for each SQS record delivered to the lambda'''
+    return [(record['messageId'], json.loads(record['body'])) for record in event['Records']]
+
+
+def checkpoint_id(item):
+    # One checkpoint per document of a batch, a resumed batch skips documents already done
+    return f"{item['batch_id']}/{item['s3_key']}"
+
+
+class SQSWorkQueue:
+    '''
+    Work items on an SQS queue. The index lambda consumes it through an event source
+    mapping, messages of failed items become visible again and land in the
+    dead letter queue after the redrive limit.
+    '''
+
+    def __init__(self, sqs_client, queue_url):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+
+    def enqueue(self, items):
+        enqueued = 0
+        for start in range(0, len(items), SQS_MAX_BATCH):
+            batch = items[start:start + SQS_MAX_BATCH]
+            response = self.sqs_client.send_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(i), 'MessageBody': json.dumps(item)} for i, item in enumerate(batch)])
+            for failure in response.get('Failed', []):
+                print(f'Could not enqueue {batch[int(failure["Id"])]}, reason={failure.get("Message")}')
+            enqueued = enqueued + len(response.get('Successful', []))
+        return enqueued
+
+
+class SQLiteWorkQueue:
+    '''
+    Durable local queue with the SQS semantics the workers rely on: a received item is
+    invisible until acked or its visibility timeout expires, so items in flight when a
+    worker crashes are delivered again. Items received max_receive_count times are dead.
+    Used when no INGEST_QUEUE_URL is configured and as the local stand-in of SQS.
+    '''
+
+    def __init__(self, path='/tmp/ingest-queue.db', max_receive_count=3):
+        self.max_receive_count = max_receive_count
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('CREATE TABLE IF NOT EXISTS work_items (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'body TEXT NOT NULL, visible_at REAL NOT NULL, receive_count INTEGER NOT NULL DEFAULT 0)')
+
+    def enqueue(self, items):
+        with self._lock:
+            self._db.executemany('INSERT INTO work_items (body, visible_at) VALUES (?, 0)',
+                                 [(json.dumps(item),) for item in items])
+        return len(items)
+
+    def receive(self, max_items=10, visibility_timeout=300):
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            rows = self._db.execute('SELECT id, body FROM work_items WHERE visible_at <= ? AND receive_count < ? '
+                                    'ORDER BY id LIMIT ?', (now, self.max_receive_count, max_items)).fetchall()
+            self._db.executemany('UPDATE work_items SET visible_at = ?, receive_count = receive_count + 1 WHERE id = ?',
+                                 [(now + visibility_timeout, row[0]) for row in rows])
+            self._db.execute('COMMIT')
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def ack(self, receipt):
+        with self._lock:
+            self._db.execute('DELETE FROM work_items WHERE id = ?', (receipt,))
+
+    def release(self, receipt):
+        '''Makes a failed item visible again right away'''
+        with self._lock:
+            self._db.execute('UPDATE work_items SET visible_at = 0 WHERE id = ?', (receipt,))
+
+    def counts(self):
+        with self._lock:
+            pending, dead = self._db.execute('SELECT COALESCE(SUM(receive_count < ?), 0), COALESCE(SUM(receive_count >= ?), 0) '
+                                             'FROM work_items', (self.max_receive_count, self.max_receive_count)).fetchone()
+        return {'pending': pending, 'dead': dead}
+
+
+def drain(queue, process, max_workers=4, visibility_timeout=300, deadline=None):
+    '''
+    Processes items of a SQLiteWorkQueue until it is empty or the deadline (epoch seconds)
+    passes. process returns True when the item is done, done items are acked and
+    failed ones released for another attempt.
+    '''
+    stats = {'processed': 0, 'failed': 0}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while deadline is None or time.time() < deadline:
+            received = queue.receive(max_workers, visibility_timeout)
+            if len(received) == 0:
+                break
+            for (receipt, item), done in zip(received, executor.map(lambda entry: _process_safely(process, entry[1]), received)):
+                if done:
+                    queue.ack(receipt)
+                    stats['processed'] = stats['processed'] + 1
+                else:
+                    queue.release(receipt)
+                    stats['failed'] = stats['failed'] + 1
+    return stats
+
+
+def _process_safely(process, item):
+    try:
+        return process(item)
+    except Exception as e:
+        print(f'Error processing work item {item}, exception={e}')
+        return False
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import math
+import threading
+import time
+
+
+def fingerprint(*parts):
+    '''Digest of what the answer was generated from, e.g. the retrieved context in prompt order'''
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8') if isinstance(part, str) else json.dumps(part, sort_keys=True).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+def cosine_similarity(vector, other):
+    dot = sum(a * b for a, b in zip(vector, other))
+    norm = math.sqrt(sum(a * a for a in vector)) * math.sqrt(sum(b * b for b in other))
+    return dot / norm if norm > 0 else 0.0
+
+
+class IndexGeneration:
+    '''
+    Names the physical indexes behind the index alias, a re-index swap, delete or re-create
+    changes it. Resolved at most every check_seconds so a cache lookup does not pay for it.
+    '''
+
+    def __init__(self, ops_client, index_name, check_seconds=30):
+        self.ops_client = ops_client
+        self.index_name = index_name
+        self.check_seconds = check_seconds
+        self._generation = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def current(self):
+        with self._lock:
+            if self._generation is not None and time.time() - self._checked_at < self.check_seconds:
+                return self._generation
+        try:
+            if self.ops_client.indices.exists_alias(name=self.index_name):
+                generation = ','.join(sorted(self.ops_client.indices.get_alias(name=self.index_name).keys()))
+            else:
+                generation = self.index_name if self.ops_client.indices.exists(index=self.index_name) else ''
+        except Exception as e:
+            print(f'Could not resolve the index generation, exception={e}')
+            generation = ''
+        with self._lock:
+            self._generation = generation
+            self._checked_at = time.time()
+        return generation
+
+
+class SemanticAnswerCache:
+    '''
+    Final answers keyed on what they were generated from: model, behaviour, the fingerprint
+    of the retrieved context (and chat history) and the index generation. Within a key,
+    a query whose embedding is at least threshold cosine-similar to a stored query reuses
+    its answer, so paraphrases that retrieve the same context skip the generation. A change
+    of the retrieved chunks or of the physical index gives a new key, stale answers are
+    never found and expire with the TTL of the tiers. Each key holds the last max_entries
+    answers, tiers are a query_cache.TTLCache and an optional shared DynamoDBCacheTier.
+    '''
+
+    def __init__(self, memory, shared=None, threshold=0.95, max_entries=8):
+        self.memory = memory
+        self.shared = shared
+        self.threshold = threshold
+        self.max_entries = max_entries
+
+    @staticmethod
+    def key(model_id, behaviour, context_fingerprint, generation):
+        return 'answer:' + fingerprint(model_id, behaviour, context_fingerprint, generation)
+
+    def _entries(self, key):
+        entries = self.memory.get(key)
+        if entries is None and self.shared is not None:
+            entries = self.shared.get(key)
+            if entries is not None:
+                self.memory.put(key, entries)
+        return entries or []
+
+    def get(self, key, query_embedding):
+        '''(answer, similarity) of the most similar stored query at or above threshold, or None'''
+        best = None
+        for entry in self._entries(key):
+            score = cosine_similarity(query_embedding, entry['embedding'])
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (entry['answer'], score)
+        return best
+
+    def put(self, key, query_embedding, answer):
+        entries = [entry for entry in self._entries(key)] + [{'embedding': list(query_embedding), 'answer': answer}]
+        entries = entries[-self.max_entries:]
+        self.memory.put(key, entries)
+        if self.shared is not None:
+            self.shared.put(key, entries)
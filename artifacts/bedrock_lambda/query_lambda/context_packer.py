@@ -0,0 +1,124 @@
+import re
+
+from chunking import TokenBudgetSplitter, estimate_tokens
+
+# Tokens of retrieved context per prompt, by LLM id prefix (first match wins). Well under the context
+# windows, more context adds time to first token long before it adds answer quality
+MODEL_CONTEXT_BUDGETS = {
+    'anthropic.claude-3': 4000,
+    'anthropic.claude': 3000,
+    'meta.llama2': 1500,
+    'cohere.command': 1500,
+    'amazon.titan-': 3000,
+    'ai21.j2-': 3000
+}
+DEFAULT_CONTEXT_BUDGET = 2000
+# Shortest shared prefix/suffix treated as chunk overlap rather than a coincidence
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 2000
+# Word overlap (Jaccard) with a packed passage from which a passage is a duplicate and left out
+DUPLICATE_SIMILARITY = 0.8
+# Passages left with fewer tokens than this after trimming are dropped
+MIN_PASSAGE_TOKENS = 8
+
+_WORD = re.compile(r'\w+')
+
+
+def context_budget(model_id, max_tokens=0):
+    '''max_tokens overrides the per-model budget when set'''
+    if max_tokens > 0:
+        return max_tokens
+    for model_prefix, budget in MODEL_CONTEXT_BUDGETS.items():
+        if model_id.startswith(model_prefix):
+            return budget
+    return DEFAULT_CONTEXT_BUDGET
+
+
+def _words(text):
+    return set(_WORD.findall(text.lower()))
+
+
+def _similarity(words, other):
+    if len(words) == 0 or len(other) == 0:
+        return 0.0
+    return len(words & other) / len(words | other)
+
+
+def _overlap(before, after):
+    '''Length of the longest suffix of before that is a prefix of after'''
+    if len(after) < MIN_OVERLAP_CHARS:
+        return 0
+    # Only where the first MIN_OVERLAP_CHARS of after occur in the tail of before, earliest is longest
+    head = after[:MIN_OVERLAP_CHARS]
+    tail_start = max(0, len(before) - min(len(after), MAX_OVERLAP_CHARS))
+    position = before.find(head, tail_start)
+    while position != -1:
+        if after.startswith(before[position:]):
+            return len(before) - position
+        position = before.find(head, position + 1)
+    return 0
+
+
+def trim_overlaps(text, selected):
+    '''Removes from text the leading or trailing span it shares with a selected passage (splitter overlap)'''
+    for other in selected:
+        length = _overlap(other, text)
+        if length > 0:
+            text = text[length:]
+        length = _overlap(text, other)
+        if length > 0:
+            text = text[:len(text) - length]
+    return text.strip()
+
+
+def _relevance(passages):
+    '''Retrieval scores min-max normalized to [0, 1], rank based when the scores do not differ'''
+    scores = [score for _, score in passages]
+    low, high = min(scores), max(scores)
+    if high > low:
+        return [(score - low) / (high - low) for score in scores]
+    return [1 - rank / len(passages) for rank in range(len(passages))]
+
+
+def pack_context(passages, budget, mmr_lambda=0.7):
+    '''
+    Assembles the prompt context from retrieved (text, score) passages, best first. Passages are
+    picked by maximal marginal relevance (mmr_lambda * relevance - (1 - mmr_lambda) * the highest
+    word overlap with a passage already picked), near-duplicates of a picked passage are left out,
+    the text shared with picked passages is trimmed and passages are added until budget estimated
+    tokens are used, the last one cut at a sentence boundary. Returns the context and the token
+    counts before and after.
+    '''
+    passages = [(text, score or 0.0) for text, score in passages if text and text.strip() != '']
+    stats = {'passages': len(passages), 'packed_passages': 0, 'tokens_retrieved': 0, 'tokens_packed': 0}
+    if len(passages) == 0:
+        return '', stats
+    stats['tokens_retrieved'] = estimate_tokens(' '.join(text for text, _ in passages))
+
+    relevance = _relevance(passages)
+    words = [_words(text) for text, _ in passages]
+    remaining = list(range(len(passages)))
+    picked = []
+    packed = []
+    used = 0
+    while len(remaining) > 0 and used < budget:
+        redundancy = {i: max([_similarity(words[i], words[j]) for j in picked], default=0.0) for i in remaining}
+        best = max(remaining, key=lambda i: mmr_lambda * relevance[i] - (1 - mmr_lambda) * redundancy[i])
+        remaining.remove(best)
+        if redundancy[best] >= DUPLICATE_SIMILARITY:
+            continue
+        picked.append(best)
+        text = trim_overlaps(passages[best][0], packed)
+        tokens = estimate_tokens(text)
+        if tokens < MIN_PASSAGE_TOKENS:
+            continue
+        if used + tokens > budget:
+            if budget - used < MIN_PASSAGE_TOKENS * 4:
+                break
+            text = TokenBudgetSplitter(budget - used).split_text(text)[0]
+            tokens = estimate_tokens(text)
+        packed.append(text)
+        used = used + tokens
+    stats['packed_passages'] = len(packed)
+    stats['tokens_packed'] = used
+    return '\n\n'.join(packed), stats
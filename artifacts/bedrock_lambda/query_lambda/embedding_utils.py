@@ -0,0 +1,221 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Cohere embed models on Bedrock accept up to 96 texts per invoke_model call
+COHERE_MAX_TEXTS = 96
+# Output dimensions each model accepts, a single one where it cannot be chosen.
+# Models not listed honour the requested dimension
+ALLOWED_DIMENSIONS = {
+    'amazon.titan-embed-text-v1': [1536],
+    'amazon.titan-embed-text-v2': [256, 512, 1024],
+    'amazon.titan-embed-image-v1': [256, 384, 1024],
+    'cohere.embed-english-v3': [1024],
+    'cohere.embed-multilingual-v3': [1024]
+}
+
+
+def embedding_dimension(model_id, requested=384):
+    '''The requested dimension if the model accepts it, else the smallest larger one it accepts (or its largest)'''
+    for model_prefix, dimensions in ALLOWED_DIMENSIONS.items():
+        if model_id.startswith(model_prefix):
+            if requested in dimensions:
+                return requested
+            dimension = min([d for d in dimensions if d > requested], default=max(dimensions))
+            print(f'{model_id} does not support dimension {requested}, using {dimension}')
+            return dimension
+    return requested
+
+
+def to_byte_vector(vector):
+    '''Quantizes a normalized float embedding to the int8 range of a byte knn_vector field'''
+    return [max(-128, min(127, round(value * 127))) for value in vector]
+
+
+class TitanEmbeddingAdapter:
+    '''
+    Titan embeds a single text per request, so a batch is fanned out
+    over a bounded thread pool. Results come back in input order.
+    With a limiter (concurrency.AdaptiveConcurrency) the calls in flight follow
+    the limiter and throttled calls are retried, max_workers is only the ceiling.
+    '''
+    max_batch_size = 1
+
+    def __init__(self, bedrock_client, model_id, dimension=384, max_workers=10, limiter=None):
+        self.bedrock_client = bedrock_client
+        self.model_id = model_id
+        self.dimension = dimension
+        self.max_workers = max_workers
+        self.limiter = limiter
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _request_body(self, text):
+        if 'titan-embed-text-v1' in self.model_id:
+            return {"inputText": text}
+        elif 'titan-embed-text-v2' in self.model_id:
+            return {"inputText": text, "dimensions": self.dimension}
+        return {"inputText": text, "embeddingConfig": {"outputEmbeddingLength": self.dimension}}
+
+    def _invoke(self, body):
+        if self.limiter is not None:
+            return self.limiter.run(self._invoke_model, body)
+        return self._invoke_model(body)
+
+    def _invoke_model(self, body):
+        with self._lock:
+            self.calls = self.calls + 1
+        response = self.bedrock_client.invoke_model(
+            body=json.dumps(body),
+            modelId=self.model_id,
+            accept='application/json',
+            contentType='application/json'
+        )
+        result = json.loads(response['body'].read())
+        finish_reason = result.get("message")
+        if finish_reason is not None:
+            print(f'Embed Error {finish_reason}')
+        return result
+
+    def _embed_one(self, text):
+        return self._invoke(self._request_body(text)).get("embedding")
+
+    def embed(self, texts, input_type='search_document'):
+        if len(texts) == 1:
+            return [self._embed_one(texts[0])]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(texts))) as executor:
+            return list(executor.map(self._embed_one, texts))
+
+
+class CohereEmbeddingAdapter(TitanEmbeddingAdapter):
+    '''
+    Cohere accepts many texts per request, texts are grouped into requests of
+    COHERE_MAX_TEXTS and the requests themselves run on the bounded pool.
+    '''
+    max_batch_size = COHERE_MAX_TEXTS
+
+    def _embed_batch(self, batch, input_type):
+        return self._invoke({"texts": batch, "input_type": input_type}).get("embeddings")
+
+    def embed(self, texts, input_type='search_document'):
+        batches = [texts[i:i + self.max_batch_size] for i in range(0, len(texts), self.max_batch_size)]
+        if len(batches) == 1:
+            return self._embed_batch(batches[0], input_type)
+        embeddings = []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+            for batch_embeddings in executor.map(lambda batch: self._embed_batch(batch, input_type), batches):
+                embeddings.extend(batch_embeddings)
+        return embeddings
+
+
+def _normalized(vector):
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm > 0 else vector
+
+
+def _tokens(text):
+    return re.findall(r'\w+', text.lower())
+
+
+class HashingEmbeddingAdapter:
+    '''
+    Deterministic feature hashing of word unigrams and bigrams, no model and no network.
+    Texts sharing words land close to each other, enough for tests and offline runs,
+    not a substitute for a semantic model.
+    '''
+    max_batch_size = 64
+
+    def __init__(self, dimension=384):
+        self.model_id = f'hashing-{dimension}'
+        self.dimension = dimension
+        self.calls = 0
+
+    def _embed_one(self, text):
+        vector = [0.0] * self.dimension
+        tokens = _tokens(text)
+        for feature in tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]:
+            digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], 'little') % self.dimension
+            vector[bucket] = vector[bucket] + (1.0 if digest[4] & 1 else -1.0)
+        return _normalized(vector)
+
+    def embed(self, texts, input_type='search_document'):
+        self.calls = self.calls + 1
+        return [self._embed_one(text) for text in texts]
+
+
+class LocalModelEmbeddingAdapter:
+    '''
+    Embeds in process on the CPU from a model on disk (packaged with the lambda or on EFS).
+    model_path is either
+      - a directory with model.onnx and tokenizer.json (a sentence embedding model exported
+        to ONNX), mean pooled over the attention mask. Needs onnxruntime, tokenizers, numpy.
+      - a .npz with a vocab array and an embeddings matrix (static token embeddings),
+        mean pooled over the known tokens of the text. Needs numpy.
+    '''
+    max_batch_size = 32
+
+    def __init__(self, model_path, max_length=256):
+        import numpy
+        self.np = numpy
+        self.model_id = f'local-{os.path.basename(os.path.normpath(model_path))}'
+        self.max_length = max_length
+        self.calls = 0
+        self._lock = threading.Lock()
+        if os.path.isdir(model_path):
+            import onnxruntime
+            from tokenizers import Tokenizer
+            self.session = onnxruntime.InferenceSession(os.path.join(model_path, 'model.onnx'),
+                                                        providers=['CPUExecutionProvider'])
+            self.tokenizer = Tokenizer.from_file(os.path.join(model_path, 'tokenizer.json'))
+            self.tokenizer.enable_truncation(max_length)
+            self.tokenizer.enable_padding()
+            self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+            self.dimension = self.session.get_outputs()[0].shape[-1]
+            self.vocab = None
+        else:
+            model = numpy.load(model_path, allow_pickle=False)
+            self.vocab = {token: i for i, token in enumerate(model['vocab'].tolist())}
+            self.embeddings = model['embeddings'].astype(numpy.float32)
+            self.dimension = self.embeddings.shape[1]
+            self.session = None
+
+    def _embed_static(self, texts):
+        vectors = []
+        for text in texts:
+            ids = [self.vocab[token] for token in _tokens(text)[:self.max_length] if token in self.vocab]
+            vector = self.embeddings[ids].mean(axis=0) if ids else self.np.zeros(self.dimension, dtype=self.np.float32)
+            vectors.append(vector)
+        return self.np.stack(vectors)
+
+    def _embed_onnx(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        ids = self.np.array([encoding.ids for encoding in encodings], dtype=self.np.int64)
+        mask = self.np.array([encoding.attention_mask for encoding in encodings], dtype=self.np.int64)
+        inputs = {'input_ids': ids, 'attention_mask': mask, 'token_type_ids': self.np.zeros_like(ids)}
+        hidden = self.session.run(None, {name: inputs[name] for name in self.input_names})[0]
+        weights = mask[:, :, None].astype(self.np.float32)
+        return (hidden * weights).sum(axis=1) / self.np.clip(weights.sum(axis=1), 1e-9, None)
+
+    def embed(self, texts, input_type='search_document'):
+        with self._lock:
+            self.calls = self.calls + 1
+        vectors = self._embed_onnx(texts) if self.session is not None else self._embed_static(texts)
+        norms = self.np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / self.np.clip(norms, 1e-9, None)).tolist()
+
+
+def get_embedding_adapter(bedrock_client, model_id, dimension=384, max_workers=10, limiter=None,
+                          backend='bedrock', model_path=None):
+    '''backend is bedrock, local (model_path on disk, see LocalModelEmbeddingAdapter) or hashing'''
+    if backend == 'hashing':
+        return HashingEmbeddingAdapter(dimension)
+    if backend == 'local':
+        return LocalModelEmbeddingAdapter(model_path)
+    if 'cohere' in model_id:
+        return CohereEmbeddingAdapter(bedrock_client, model_id, dimension, max_workers, limiter)
+    return TitanEmbeddingAdapter(bedrock_client, model_id, dimension, max_workers, limiter)
@@ -0,0 +1,25 @@
+import json
+import time
+
+NAMESPACE = 'AgenticRAG'
+
+
+def emit_metrics(metrics, dimensions=None, namespace=NAMESPACE):
+    '''
+    Prints metrics in CloudWatch embedded metric format, Lambda ships the log line and
+    CloudWatch extracts the metrics (percentiles included) without a PutMetricData call.
+    Names ending in _ms are in milliseconds, anything else is a count.
+    '''
+    dimensions = dimensions or {}
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [list(dimensions.keys())],
+                'Metrics': [{'Name': name, 'Unit': 'Milliseconds' if name.endswith('_ms') else 'Count'} for name in metrics]
+            }]
+        },
+        **dimensions,
+        **metrics
+    }))
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING_PUNCTUATION = re.compile(r'[\s?.!]+$')
+
+
+def normalize_query(text):
+    '''Case, Unicode form, runs of whitespace and trailing ?.! do not change what is asked'''
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return _TRAILING_PUNCTUATION.sub('', _WHITESPACE.sub(' ', text).strip())
+
+
+def query_cache_key(text, model_id, dimension, input_type='search_query'):
+    digest = hashlib.sha256()
+    for part in [model_id, str(dimension), input_type, normalize_query(text)]:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class TTLCache:
+    '''
+    Size bounded LRU whose entries expire ttl_seconds after they were put.
+    Kept at module level it survives across warm invocations of the container.
+    '''
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DynamoDBCacheTier:
+    '''
+    Cache shared by every container, one item per key with the value as JSON (no Decimal
+    conversion of vectors) and expires_at as the table TTL attribute. DynamoDB deletes
+    expired items lazily, so expiry is checked on read as well. Errors count as misses.
+    '''
+
+    def __init__(self, table, ttl_seconds=3600):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        try:
+            item = self.table.get_item(Key={'cache_key': key}).get('Item')
+        except Exception as e:
+            print(f'Shared cache read failed, exception={e}')
+            return None
+        if item is None or int(item['expires_at']) <= time.time():
+            return None
+        return json.loads(item['value'])
+
+    def put(self, key, value):
+        try:
+            self.table.put_item(Item={'cache_key': key, 'value': json.dumps(value),
+                                      'expires_at': int(time.time() + self.ttl_seconds)})
+        except Exception as e:
+            print(f'Shared cache write failed, exception={e}')
+
+
+class QueryEmbeddingCache:
+    '''
+    Query embeddings keyed on the normalized query text, embed model and dimension. The
+    in-process tier is read first, then the shared tier (back-filling the in-process one),
+    and only a miss in both calls the embed model. embed_query returns the embedding and
+    the metrics of the request: which tier served it and how long it took.
+    '''
+
+    def __init__(self, embedder, memory, shared=None):
+        self.embedder = embedder
+        self.memory = memory
+        self.shared = shared
+
+    def embed_query(self, text, input_type='search_query'):
+        start = time.perf_counter()
+        key = query_cache_key(text, self.embedder.model_id, self.embedder.dimension, input_type)
+        tier = 'memory'
+        embedding = self.memory.get(key)
+        if embedding is None and self.shared is not None:
+            tier = 'shared'
+            embedding = self.shared.get(key)
+            if embedding is not None:
+                self.memory.put(key, embedding)
+        if embedding is None:
+            tier = 'miss'
+            embedding = self.embedder.embed([text], input_type=input_type)[0]
+            self.memory.put(key, embedding)
+            if self.shared is not None:
+                self.shared.put(key, embedding)
+        return embedding, {
+            'query_embedding_cache_hit': 0 if tier == 'miss' else 1,
+            'query_embedding_shared_hit': 1 if tier == 'shared' else 0,
+            'query_embedding_ms': round((time.perf_counter() - start) * 1000, 3)
+        }
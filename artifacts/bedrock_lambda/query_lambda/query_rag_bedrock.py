@@ -12,9 +12,18 @@ import base64
 import datetime
 import csv
 import re
+import time
 
 
 from prompt_utils import get_system_prompt, agent_execution_step
+from embedding_utils import embedding_dimension, get_embedding_adapter, to_byte_vector
+from answer_cache import IndexGeneration, SemanticAnswerCache, fingerprint
+from context_packer import context_budget, pack_context
+from metrics import emit_metrics
+from query_cache import DynamoDBCacheTier, QueryEmbeddingCache, TTLCache
+from retrieval import index_engine, metadata_filter, search_chunks
+from s3_stream import read_s3_text
+from websocket_stream import BackgroundSender, WebSocketStream, encode_frame
 
 bedrock_client = boto3.client('bedrock-runtime')
 embed_model_id = getenv("EMBED_MODEL_ID", "amazon.titan-embed-image-v1")
@@ -33,6 +42,9 @@ is_wrangler_enabled = getenv("IS_WRANGLER_ENABLED", "no")
 WRANGLER_FUNCTION_NAME = getenv('WRANGLER_NAME', 'bedrock_wrangler_dev')
 websocket_client = boto3.client('apigatewaymanagementapi', endpoint_url=wss_url)
 lambda_client = boto3.client('lambda')
+s3_client = boto3.client('s3')
+# Characters of an attached text file passed to the model, larger files are truncated rather than read whole
+QUERY_FILE_MAX_CHARS = int(getenv("QUERY_FILE_MAX_CHARS", "400000"))
 
 credentials = boto3.Session().get_credentials()
 service = 'aoss'
@@ -60,12 +72,78 @@ if is_rag_enabled == 'yes':
     )
 
 bedrock_client = boto3.client('bedrock-runtime')
-
-
-def query_data(query, behaviour, model_id, query_vectordb, connect_id):
+# Same index profile as the index lambda, the query vector must match its dimension and data type
+index_profile = json.loads(getenv("INDEX_PROFILE", "{}"))
+# The engine is read from the index mapping, an index created before the profile changed keeps its engine.
+# Re-read after the TTL, a rebuild can swap the alias to an index of another engine
+INDEX_ENGINE_TTL = int(getenv("INDEX_ENGINE_TTL", "300"))
+index_engines = TTLCache(4, INDEX_ENGINE_TTL)
+# Must be the backend the index lambda embeds with, a local backend saves the Bedrock round trip per query
+EMBED_BACKEND = getenv("EMBED_BACKEND", "bedrock")
+EMBED_MODEL_PATH = getenv("EMBED_MODEL_PATH", "")
+embedder = get_embedding_adapter(bedrock_client, embed_model_id,
+                                 dimension=embedding_dimension(embed_model_id, index_profile.get('dimension', 384)),
+                                 backend=EMBED_BACKEND, model_path=EMBED_MODEL_PATH)
+# Repeated questions reuse the query embedding of earlier requests on this container, entries expire after the TTL.
+# A size of 0 disables the cache, the per-request metrics are still emitted
+QUERY_EMBED_CACHE_SIZE = int(getenv("QUERY_EMBED_CACHE_SIZE", "1024"))
+QUERY_EMBED_CACHE_TTL = int(getenv("QUERY_EMBED_CACHE_TTL", "3600"))
+# DynamoDB table shared by all containers, empty keeps the cache per container
+QUERY_CACHE_TABLE = getenv("QUERY_CACHE_TABLE", "")
+query_embeddings = QueryEmbeddingCache(
+    embedder, TTLCache(QUERY_EMBED_CACHE_SIZE, QUERY_EMBED_CACHE_TTL),
+    DynamoDBCacheTier(boto3.resource('dynamodb').Table(QUERY_CACHE_TABLE), QUERY_EMBED_CACHE_TTL) if QUERY_CACHE_TABLE else None)
+# Behaviours whose answers are replayed for paraphrased questions retrieving the same context, comma separated
+# (e.g. english,chat). Empty disables the answer cache
+ANSWER_CACHE_BEHAVIOURS = [behaviour.strip() for behaviour in getenv("ANSWER_CACHE_BEHAVIOURS", "").split(',') if behaviour.strip() != '']
+# Cosine similarity of the query embeddings from which a stored answer is reused
+ANSWER_CACHE_THRESHOLD = float(getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = int(getenv("ANSWER_CACHE_TTL", "3600"))
+answer_cache = SemanticAnswerCache(
+    TTLCache(int(getenv("ANSWER_CACHE_SIZE", "512")), ANSWER_CACHE_TTL),
+    DynamoDBCacheTier(boto3.resource('dynamodb').Table(QUERY_CACHE_TABLE), ANSWER_CACHE_TTL) if QUERY_CACHE_TABLE else None,
+    ANSWER_CACHE_THRESHOLD)
+index_generation = IndexGeneration(ops_client, INDEX_NAME) if is_rag_enabled == 'yes' else None
+# knn -> vector query only, hybrid -> BM25 and vector queries in one _msearch, fused in the Lambda.
+# A request can override both with retrieval and fusion in its payload
+RETRIEVAL_MODE = getenv("RETRIEVAL_MODE", "knn")
+# rrf -> reciprocal-rank fusion, weighted -> min-max normalized scores weighted by HYBRID_LEXICAL_WEIGHT
+HYBRID_FUSION = getenv("HYBRID_FUSION", "rrf")
+HYBRID_LEXICAL_WEIGHT = float(getenv("HYBRID_LEXICAL_WEIGHT", "1.0"))
+# Passages retrieved as candidates for the context, packed by relevance and novelty into the token budget
+CONTEXT_CANDIDATES = int(getenv("CONTEXT_CANDIDATES", "10"))
+# 1 -> relevance only, lower values favour passages that add new content
+CONTEXT_MMR_LAMBDA = float(getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# Tokens of context per prompt, 0 -> the per-model budget of context_packer.MODEL_CONTEXT_BUDGETS
+CONTEXT_MAX_TOKENS = int(getenv("CONTEXT_MAX_TOKENS", "0"))
+# Streamed answer text is sent once this many bytes are pending or the oldest pending text is this old
+STREAM_FLUSH_BYTES = int(getenv("STREAM_FLUSH_BYTES", "512"))
+STREAM_FLUSH_MS = int(getenv("STREAM_FLUSH_MS", "30"))
+# Framing of websocket messages (websocket_stream.FRAMINGS), a UI can ask for another with framing in its payload
+WEBSOCKET_FRAMING = getenv("WEBSOCKET_FRAMING", "base64")
+websocket_framing = WEBSOCKET_FRAMING
+# Frames waiting for the background websocket sender before the stream reader is held back
+WEBSOCKET_SEND_QUEUE = int(getenv("WEBSOCKET_SEND_QUEUE", "64"))
+
+
+def search_engine():
+    '''kNN engine of the index behind INDEX_NAME, the profile's when the mapping cannot be read'''
+    engine = index_engines.get(INDEX_NAME)
+    if engine is None:
+        engine = index_engine(ops_client, INDEX_NAME, index_profile.get('engine', 'faiss'))
+        index_engines.put(INDEX_NAME, engine)
+    return engine
+
+
+def query_data(query, behaviour, model_id, query_vectordb, connect_id, retrieval_mode=None, fusion=None, filters=None):
     global DEFAULT_PROMPT
     global embed_model_id
     global bedrock_client
+    try:
+        # Scopes the search to a collection, tenant, date range or source file
+        search_filter = metadata_filter(filters)
+    except ValueError as e:
+        return failure_response(connect_id, f'{e}')
     prompt = DEFAULT_PROMPT
     if behaviour in ['english', 'hindi', 'thai', 'spanish', 'french', 'german', 'bengali', 'tamil', 'arabic', 'italian']:
         prompt = f''' Output Rules :
@@ -116,6 +194,7 @@ def query_data(query, behaviour, model_id, query_vectordb, connect_id):
 
     context = ''
     user_query = ''
+    query_embedding = None
     if behaviour == 'chat':
         query_vectordb='yes'
         
@@ -134,42 +213,31 @@ def query_data(query, behaviour, model_id, query_vectordb, connect_id):
                 # QnA
                 user_query, img_ids =extract_query_image_values(query)
 
-            embeddings_key="embedding"
-            if 'cohere' in   embed_model_id:
-                response = bedrock_client.invoke_model(
-                body=json.dumps({"texts": [user_query], "input_type": 'search_query'}),
-                modelId=embed_model_id,
-                accept='application/json',
-                contentType='application/json'
-                )
-                embeddings_key="embeddings"
-            else:
-                # Get the query embedding from amazon-titan-embed model
-                response = bedrock_client.invoke_model(
-                    body=json.dumps({"inputText": user_query, "embeddingConfig": {"outputEmbeddingLength": 384}}),
-                    modelId=embed_model_id,
-                    accept='application/json',
-                    contentType='application/json'
-                )
-            result = json.loads(response['body'].read())
-            embedded_search = result.get(embeddings_key)
-
-            vector_query = {
-                "size": 10,
-                "query": {"knn": {"embedding": {"vector": embedded_search, "k": 5}}},
-                "_source": False,
-                "fields": ["text", "doc_type"]
-            }
-            print(f'Search for context from Opensearch serverless vector collections {vector_query}')
+            embedded_search, embedding_metrics = query_embeddings.embed_query(user_query)
+            emit_metrics(embedding_metrics, {'EmbedModel': embed_model_id})
+            query_embedding = embedded_search
+            if index_profile.get('data_type') == 'byte':
+                embedded_search = to_byte_vector(embedded_search)
+
+            retrieval_mode = retrieval_mode or RETRIEVAL_MODE
+            print(f'Search for context from Opensearch serverless vector collections, retrieval {retrieval_mode}, filter {search_filter}')
 
             try:
-                response = ops_client.search(body=vector_query, index=INDEX_NAME)
-                #print(response["hits"]["hits"])
-                for data in response["hits"]["hits"]:
-                    if context == '':
-                        context = data['fields']['text'][0]
-                    else:
-                        context = context + ' ' + data['fields']['text'][0]
+                start = time.perf_counter()
+                hits = search_chunks(ops_client, INDEX_NAME, user_query, embedded_search, retrieval_mode,
+                                     fusion or HYBRID_FUSION, k=CONTEXT_CANDIDATES, size=CONTEXT_CANDIDATES,
+                                     lexical_weight=HYBRID_LEXICAL_WEIGHT, filter=search_filter,
+                                     engine=search_engine(), ef_search=index_profile.get('ef_search'))
+                emit_metrics({'retrieval_ms': round((time.perf_counter() - start) * 1000, 3), 'retrieved_chunks': len(hits)},
+                             {'RetrievalMode': retrieval_mode, 'Filtered': 'yes' if search_filter is not None else 'no'})
+                context, packing = pack_context([(data['fields']['text'][0], data.get('_score')) for data in hits
+                                                 if len(data.get('fields', {}).get('text', [])) > 0],
+                                                context_budget(model_id, CONTEXT_MAX_TOKENS), CONTEXT_MMR_LAMBDA)
+                print(f'Packed {packing["packed_passages"]} of {packing["passages"]} passages, '
+                      f'tokens {packing["tokens_packed"]} of {packing["tokens_retrieved"]}')
+                emit_metrics({'context_tokens': packing['tokens_packed'],
+                              'context_tokens_saved': packing['tokens_retrieved'] - packing['tokens_packed'],
+                              'packed_passages': packing['packed_passages']}, {'LLMModel': model_id})
             except Exception as e:
                 print('Vector Index does not exist. Please index some documents')
 
@@ -185,8 +253,15 @@ def query_data(query, behaviour, model_id, query_vectordb, connect_id):
 
 
         if model_id.startswith(tuple(model_list)):
+            answer_key = None
+            if behaviour in ANSWER_CACHE_BEHAVIOURS:
+                replayed, answer_key, query_embedding = lookup_answer(query, behaviour, model_id, context, query_embedding, connect_id)
+                if replayed:
+                    return
             prompt_template = prepare_prompt_template(model_id, behaviour, prompt, context, query)
-            query_bedrock_models(model_id, prompt_template, connect_id, behaviour)
+            answer, completed = query_bedrock_models(model_id, prompt_template, connect_id, behaviour)
+            if answer_key is not None and completed and answer.strip() != '':
+                answer_cache.put(answer_key, query_embedding, answer)
         else:
             return failure_response(connect_id, f'Model not available on Amazon Bedrock {model_id}')
 
@@ -196,7 +271,55 @@ def query_data(query, behaviour, model_id, query_vectordb, connect_id):
 
 
 
+def answer_cache_key(query, behaviour, model_id, context):
+    '''
+    (question text, cache key) of a query whose answer only depends on its text, the retrieved
+    context and, for chat, the earlier turns. (None, None) for queries with images or files.
+    '''
+    generation = index_generation.current() if index_generation is not None else ''
+    try:
+        if behaviour == 'chat':
+            chat_history_list = json.loads(base64.b64decode(query))
+            if len(chat_history_list) == 0 or 'Human' not in chat_history_list[0]:
+                return None, None
+            return chat_history_list[0]['Human'], SemanticAnswerCache.key(model_id, behaviour, fingerprint(context, chat_history_list[1:]), generation)
+        query_parts = json.loads(base64.b64decode(query))
+        if any(part.get('type') != 'text' for part in query_parts):
+            return None, None
+        return ' '.join(part['data'] for part in query_parts), SemanticAnswerCache.key(model_id, behaviour, fingerprint(context), generation)
+    except Exception as e:
+        print(f'Query not cacheable, exception={e}')
+        return None, None
+
+
+def lookup_answer(query, behaviour, model_id, context, query_embedding, connect_id):
+    '''
+    Returns (replayed, key, query_embedding). A cached answer is replayed over the websocket,
+    otherwise key and query_embedding are what the generated answer is stored under
+    (key None when the query is not cacheable).
+    '''
+    start = time.perf_counter()
+    user_query, key = answer_cache_key(query, behaviour, model_id, context)
+    if key is None or user_query.strip() == '':
+        return False, None, query_embedding
+    if query_embedding is None:
+        query_embedding, embedding_metrics = query_embeddings.embed_query(user_query)
+        emit_metrics(embedding_metrics, {'EmbedModel': embed_model_id})
+    cached = answer_cache.get(key, query_embedding)
+    emit_metrics({'answer_cache_hit': 0 if cached is None else 1,
+                  'answer_cache_lookup_ms': round((time.perf_counter() - start) * 1000, 3)}, {'Behaviour': behaviour})
+    if cached is None:
+        return False, key, query_embedding
+    answer, score = cached
+    print(f'Answer cache hit, similarity {score:.3f}')
+    websocket_send(connect_id, { "text": answer } )
+    if behaviour == 'chat':
+        websocket_send(connect_id, { "text": "ack-end-of-string" } )
+    return True, None, None
+
+
 def query_bedrock_models(model, prompt, connect_id, behaviour):
+    '''Streams the answer to the websocket, returns it and whether the stream completed without an error event'''
     print(f'Bedrock prompt {prompt}')
     response = bedrock_client.invoke_model_with_response_stream(
         body=json.dumps(prompt),
@@ -210,51 +333,74 @@ def query_bedrock_models(model, prompt, connect_id, behaviour):
     assistant_chat = ''
     counter=0
     sent_ack = False
-    for evt in response['body']:
-        counter = counter + 1
-        print(dir(evt))
-        chunk_str = None
-        if 'chunk' in evt:
-            sent_ack = False
-            chunk = evt['chunk']['bytes']
-            chunk_json = json.loads(chunk.decode("UTF-8"))
-            print(f'Chunk JSON {json.loads(str(chunk, "UTF-8"))}' )
-            if 'llama2' in model:
-                chunk_str = chunk_json['generation']
-            elif 'claude-3-' in model:
-                if chunk_json['type'] == 'content_block_delta' and chunk_json['delta']['type'] == 'text_delta':
-                    chunk_str = chunk_json['delta']['text']
-            else:
-                chunk_str = chunk_json['completion']
-            print(f'chunk string {chunk_str}')
-            if chunk_str is not None:
-                websocket_send(connect_id, { "text": chunk_str } )
-                assistant_chat = assistant_chat + chunk_str
-            if behaviour == 'chat' and counter%100 == 0:
-                # send ACK to UI, so it print the chats
-                websocket_send(connect_id, { "text": "ack-end-of-string" } )
+    completed = True
+    # Frames are posted on the sender thread, reading the Bedrock stream does not wait on API Gateway
+    sender = BackgroundSender(lambda data: websocket_post(connect_id, data), WEBSOCKET_SEND_QUEUE)
+    stream = WebSocketStream(sender.submit, websocket_framing, STREAM_FLUSH_BYTES, STREAM_FLUSH_MS / 1000,
+                             busy=sender.busy)
+    try:
+        for evt in response['body']:
+            if sender.error is not None:
+                # The client is gone, closing the stream stops generating the rest of the answer
+                response['body'].close()
+                completed = False
+                break
+            counter = counter + 1
+            print(dir(evt))
+            chunk_str = None
+            if 'chunk' in evt:
+                sent_ack = False
+                chunk = evt['chunk']['bytes']
+                chunk_json = json.loads(chunk.decode("UTF-8"))
+                print(f'Chunk JSON {json.loads(str(chunk, "UTF-8"))}' )
+                if 'llama2' in model:
+                    chunk_str = chunk_json['generation']
+                elif 'claude-3-' in model:
+                    if chunk_json['type'] == 'content_block_delta' and chunk_json['delta']['type'] == 'text_delta':
+                        chunk_str = chunk_json['delta']['text']
+                else:
+                    chunk_str = chunk_json['completion']
+                print(f'chunk string {chunk_str}')
+                if chunk_str is not None:
+                    stream.text(chunk_str)
+                    assistant_chat = assistant_chat + chunk_str
+                if behaviour == 'chat' and counter%100 == 0:
+                    # send ACK to UI, so it print the chats
+                    stream.send({ "text": "ack-end-of-string" } )
+                    sent_ack = True
+                #websocket_send(connect_id, { "text": result } )
+            elif 'internalServerException' in evt:
+                result = evt['internalServerException']['message']
+                stream.send({ "text": result } )
+                completed = False
+                break
+            elif 'modelStreamErrorException' in evt:
+                result = evt['modelStreamErrorException']['message']
+                stream.send({ "text": result } )
+                completed = False
+                break
+            elif 'throttlingException' in evt:
+                result = evt['throttlingException']['message']
+                stream.send({ "text": result } )
+                completed = False
+                break
+            elif 'validationException' in evt:
+                result = evt['validationException']['message']
+                stream.send({ "text": result } )
+                completed = False
+                break
+
+        if behaviour == 'chat' and not sent_ack:
                 sent_ack = True
-            #websocket_send(connect_id, { "text": result } )
-        elif 'internalServerException' in evt:
-            result = evt['internalServerException']['message']
-            websocket_send(connect_id, { "text": result } )
-            break
-        elif 'modelStreamErrorException' in evt:
-            result = evt['modelStreamErrorException']['message']
-            websocket_send(connect_id, { "text": result } )
-            break
-        elif 'throttlingException' in evt:
-            result = evt['throttlingException']['message']
-            websocket_send(connect_id, { "text": result } )
-            break
-        elif 'validationException' in evt:
-            result = evt['validationException']['message']
-            websocket_send(connect_id, { "text": result } )
-            break
-
-    if behaviour == 'chat' and not sent_ack:
-            sent_ack = True
-            websocket_send(connect_id, { "text": "ack-end-of-string" } )
+                stream.send({ "text": "ack-end-of-string" } )
+    finally:
+        # Final flush, the frames are posted before the Lambda returns
+        streaming = stream.close()
+        streaming.update(sender.close())
+    print(f'Streamed {counter} events in {streaming["websocket_frames"]} frames, ' +
+          ', '.join(f'{key}={value}' for key, value in streaming.items()))
+    emit_metrics(streaming, {'Framing': stream.framing})
+    return assistant_chat, completed
 
 
 def get_conversations_query(connect_id):
@@ -337,30 +483,35 @@ def format_prompt_invoke_function(agent_type, user_input, connect_id):
     prompt_flow = []
     prompt_flow.extend(chat_history_list)
 
-    # Try to solve a user query in 5 steps
-    for i in range(10):
-        output = invoke_model(i, prompt_template, connect_id)
-        print(f'Step {i} output {output}')
-        done, human_prompt, assistant_prompt = agent_execution_step(i, output)
-        prompt_flow.append({"role":"assistant", "content": assistant_prompt })
-        if human_prompt is not None:
-            prompt_flow.append({"role":"user", "content":  human_prompt })
-        # To be displayed in StackTrace
-        websocket_send(connect_id, {"prompt_flow": prompt_flow, "done": done})
-
-        if not done:
-            print(f'{assistant_prompt}')
-        else:
-            print('Final answer from LLM:\n'+f'{assistant_prompt}')
-            return assistant_prompt
-            #break
+    # The steps are posted in the background, the next step starts while the last one is sent
+    sender = BackgroundSender(lambda data: websocket_post(connect_id, data), WEBSOCKET_SEND_QUEUE)
+    try:
+        # Try to solve a user query in 5 steps
+        for i in range(10):
+            output = invoke_model(i, prompt_template, connect_id)
+            print(f'Step {i} output {output}')
+            done, human_prompt, assistant_prompt = agent_execution_step(i, output)
+            prompt_flow.append({"role":"assistant", "content": assistant_prompt })
+            if human_prompt is not None:
+                prompt_flow.append({"role":"user", "content":  human_prompt })
+            # To be displayed in StackTrace
+            sender.submit(encode_frame({"prompt_flow": prompt_flow, "done": done}, websocket_framing))
+
+            if not done:
+                print(f'{assistant_prompt}')
+            else:
+                print('Final answer from LLM:\n'+f'{assistant_prompt}')
+                return assistant_prompt
+                #break
 
-        prompt_template= {
-                        "anthropic_version": "bedrock-2023-05-31",
-                        "max_tokens": 10000,
-                        "system": system_prompt,
-                        "messages": prompt_flow
-                    }
+            prompt_template= {
+                            "anthropic_version": "bedrock-2023-05-31",
+                            "max_tokens": 10000,
+                            "system": system_prompt,
+                            "messages": prompt_flow
+                        }
+    finally:
+        print(f'Agent steps sent, {sender.close()}')
 
 
 def invoke_model(step_id, prompt, connect_id):
@@ -488,6 +639,7 @@ def extract_file_extension(base64_encoded_file):
 def handler(event, context):
     global region
     global websocket_client
+    global websocket_framing
     LOG.info(
         "---  Amazon Opensearch Serverless vector db example with Amazon Bedrock Models ---")
     print(f'event - {event}')
@@ -506,12 +658,15 @@ def handler(event, context):
             if 'body' in event:
                 input_to_llm = json.loads(event['body'], strict=False)
                 print('input_to_llm: ', input_to_llm)
+                # Negotiated per message, a UI that does not ask gets the base64 frames it decodes today
+                websocket_framing = input_to_llm.get('framing', WEBSOCKET_FRAMING)
                 query = input_to_llm['query']
                 behaviour = input_to_llm['behaviour']
                 if 'agent' not in behaviour:
                     query_vectordb = input_to_llm['query_vectordb'] if 'query_vectordb' in input_to_llm else 'no'
                     model_id = input_to_llm['model_id']
-                    query_data(query, behaviour, model_id, query_vectordb, connect_id)
+                    query_data(query, behaviour, model_id, query_vectordb, connect_id,
+                               input_to_llm.get('retrieval'), input_to_llm.get('fusion'), input_to_llm.get('filters'))
                 else:
                     query_agents(behaviour, query, connect_id)
         elif routeKey == '$connect':
@@ -651,8 +806,11 @@ def claude3_prompt_builder_for_images_and_text(query, context, output):
                                         )
                     print(f'invoke_response --- {invoke_response}')
                     text_data_from_file = invoke_response['Payload'].read()
-                else:
+                elif user_query_type['file_extension'] in ['pdf']:
                     text_data_from_file = get_contents(user_query_type['file_extension'], get_file_from_s3(s3_bucket_name, s3_key))
+                else:
+                    # Streamed and decoded range by range, only what fits the prompt is read
+                    text_data_from_file = read_s3_text(s3_client, s3_bucket_name, s3_key, QUERY_FILE_MAX_CHARS)
                 prompt_content.append({ "type": "text", "text": f"""This is additional data {text_data_from_file}. Provide useful insights"""})
 
 
@@ -690,11 +848,15 @@ def success_response(connect_id, result):
     websocket_send(connect_id, success_msg)
 
 def websocket_send(connect_id, message):
+    websocket_post(connect_id, encode_frame(message, websocket_framing))
+
+
+def websocket_post(connect_id, data):
     global websocket_client
     global wss_url
     print(f'WSS URL {wss_url}, connect_id {connect_id}')
     response = websocket_client.post_to_connection(
-                Data=base64.b64encode(json.dumps(message, indent=4).encode('utf-8')),
+                Data=data,
                 ConnectionId=connect_id
             )
 
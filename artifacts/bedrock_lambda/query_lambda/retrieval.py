@@ -0,0 +1,231 @@
+import json
+
+# Rank constant of reciprocal-rank fusion, 60 as in the original RRF paper
+RRF_K = 60
+# Chunk metadata a query can filter on, written at ingest (index_lambda document_metadata and incremental_utils)
+FILTER_FIELDS = ['collection', 'tenant', 'doc_type', 'document_date', 'source', 'doc_id', 'timestamp']
+RANGE_OPERATORS = ['gte', 'gt', 'lte', 'lt']
+# Engines that apply a filter while walking the HNSW graph, nmslib can only filter the top k afterwards
+EFFICIENT_FILTER_ENGINES = ['faiss', 'lucene']
+# Without efficient filtering k * this many neighbours are fetched, so filtering leaves enough
+POST_FILTER_OVERSAMPLE = 10
+# Engines the post-filtering warning was printed for, once per container
+_warned_engines = set()
+# Near-duplicate links stay within these fields (index_lambda document_metadata.SCOPE_FIELDS), a filter on
+# another field can leave out a canonical chunk whose links it matches
+LINK_SCOPE_FIELDS = ['collection', 'tenant']
+
+
+def metadata_filter(expression):
+    '''
+    OpenSearch filter of a filters payload, None when it is empty. Keys are FILTER_FIELDS, a value
+    matches a term, a list any of its terms and an object of gte/gt/lte/lt a range, e.g.
+    {"collection": "manuals", "tenant": ["acme", "shared"], "document_date": {"gte": "2024-01-01"}}.
+    Raises ValueError for other fields or operators.
+    '''
+    if not expression:
+        return None
+    if not isinstance(expression, dict):
+        raise ValueError('filters must be an object of metadata field to value')
+    clauses = []
+    for field, value in expression.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f'Cannot filter on {field}, supported: {FILTER_FIELDS}')
+        if isinstance(value, dict):
+            unknown = [operator for operator in value if operator not in RANGE_OPERATORS]
+            if len(value) == 0 or len(unknown) > 0:
+                raise ValueError(f'Range of {field} takes {RANGE_OPERATORS}, got {list(value)}')
+            clauses.append({"range": {field: value}})
+        elif isinstance(value, list):
+            if len(value) == 0:
+                raise ValueError(f'Filter on {field} needs at least one value')
+            clauses.append({"terms": {field: value}})
+        else:
+            clauses.append({"term": {field: value}})
+    return {"bool": {"filter": clauses}}
+
+
+def _filter_fields(filter):
+    # Field of each clause of a metadata_filter
+    clauses = filter["bool"]["filter"] if filter is not None else []
+    return [(clause, list(list(clause.values())[0])[0]) for clause in clauses]
+
+
+def scope_filter(filter):
+    '''The clauses of a metadata_filter on LINK_SCOPE_FIELDS, None when there are none'''
+    clauses = [clause for clause, field in _filter_fields(filter) if field in LINK_SCOPE_FIELDS]
+    return {"bool": {"filter": clauses}} if len(clauses) > 0 else None
+
+
+def with_links(ops_client, index_name, hits, scope_hits, filter, size):
+    '''
+    Near-duplicate chunks are stored as a link (duplicate_of) to their canonical chunk without an
+    embedding, a filtered kNN search finds neither when the canonical chunk does not match the filter.
+    scope_hits are the nearest chunks within the scope of the filter, the ones missing from hits are
+    looked up as canonical chunks of links matching the filter. A link found replaces its canonical
+    chunk at the same score, then the size best are kept.
+    '''
+    found = set(hit['_id'] for hit in hits)
+    canonical = {}
+    for hit in scope_hits:
+        if hit['_id'] not in found:
+            canonical.setdefault(hit.get('fields', {}).get('chunk_id', [hit['_id']])[0], hit.get('_score') or 0.0)
+    if len(canonical) == 0:
+        return hits
+    query = {
+        # A canonical chunk can have links in many documents, one is kept
+        "size": min(len(canonical) * POST_FILTER_OVERSAMPLE, 1000),
+        "query": {"bool": {"filter": [filter, {"terms": {"duplicate_of": sorted(canonical)}}]}},
+        "_source": False,
+        "fields": ["text", "doc_type", "duplicate_of"]
+    }
+    try:
+        links = ops_client.search(body=query, index=index_name)["hits"]["hits"]
+    except Exception as e:
+        print(f'Could not resolve near-duplicate links, exception={e}')
+        return hits
+    resolved = []
+    for link in links:
+        canonical_id = link.get('fields', {}).get('duplicate_of', [None])[0]
+        if canonical_id in canonical:
+            resolved.append(dict(link, _score=canonical.pop(canonical_id)))
+    return sorted(hits + resolved, key=lambda hit: hit.get('_score') or 0.0, reverse=True)[:size]
+
+
+def index_engine(ops_client, index_name, default='nmslib'):
+    '''
+    kNN engine of the embedding field of index_name (an alias reads the index behind it), which decides
+    how a filter can be applied. default when the mapping cannot be read or has no method.
+    '''
+    try:
+        for mapping in ops_client.indices.get_mapping(index=index_name).values():
+            return mapping['mappings']['properties']['embedding']['method']['engine']
+    except Exception as e:
+        print(f'Could not read the kNN engine of {index_name}, assuming {default}. exception={e}')
+    return default
+
+
+def knn_query(vector, k=5, size=10, fields=None, filter=None, engine='nmslib', ef_search=None):
+    '''
+    A filter is applied inside the approximate search (efficient k-NN filtering) on faiss and
+    lucene, the k nearest chunks returned all match it. nmslib post-filters k * POST_FILTER_OVERSAMPLE
+    neighbours, which can return fewer than size chunks for a selective filter, a warning is printed once.
+    lucene has no ef_search index setting, its candidate list is k, so ef_search raises k
+    and size still caps the hits.
+    '''
+    if engine == 'lucene' and ef_search is not None:
+        k = max(k, int(ef_search))
+    knn = {"vector": vector, "k": k}
+    query = {"knn": {"embedding": knn}}
+    if filter is not None:
+        if engine in EFFICIENT_FILTER_ENGINES:
+            knn["filter"] = filter
+        else:
+            if engine not in _warned_engines:
+                _warned_engines.add(engine)
+                print(f'Warning: {engine} cannot filter inside the kNN search, selective filters return few chunks. '
+                      f'Rebuild the index with a faiss or lucene index profile')
+            knn["k"] = k * POST_FILTER_OVERSAMPLE
+            query = {"bool": {"must": [query], "filter": [filter]}}
+    return {
+        "size": size,
+        "query": query,
+        "_source": False,
+        "fields": fields or ["text", "doc_type"]
+    }
+
+
+def lexical_query(text, size=10, fields=None, filter=None):
+    '''BM25 on text, near-duplicate chunks stored as links to their canonical chunk are left out'''
+    return {
+        "size": size,
+        "query": {"bool": {"must": [{"match": {"text": {"query": text}}}],
+                           "filter": [filter] if filter is not None else [],
+                           "must_not": [{"exists": {"field": "duplicate_of"}}]}},
+        "_source": False,
+        "fields": fields or ["text", "doc_type"]
+    }
+
+
+def reciprocal_rank_fusion(result_lists, weights=None, rank_constant=RRF_K):
+    '''Scores each hit by sum(weight / (rank_constant + rank)) over the lists it appears in, ranks start at 1'''
+    weights = weights or [1.0] * len(result_lists)
+    fused = {}
+    for hits, weight in zip(result_lists, weights):
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.setdefault(hit['_id'], {'hit': hit, 'score': 0.0})
+            entry['score'] = entry['score'] + weight / (rank_constant + rank)
+    return _ranked(fused)
+
+
+def weighted_fusion(result_lists, weights=None):
+    '''
+    Min-max normalizes the scores of each list to [0, 1] and sums them weighted. BM25 scores
+    are unbounded and kNN scores are not, normalizing makes them comparable per query.
+    '''
+    weights = weights or [1.0] * len(result_lists)
+    fused = {}
+    for hits, weight in zip(result_lists, weights):
+        if len(hits) == 0:
+            continue
+        scores = [hit.get('_score') or 0.0 for hit in hits]
+        low, high = min(scores), max(scores)
+        for hit, score in zip(hits, scores):
+            normalized = (score - low) / (high - low) if high > low else 1.0
+            entry = fused.setdefault(hit['_id'], {'hit': hit, 'score': 0.0})
+            entry['score'] = entry['score'] + weight * normalized
+    return _ranked(fused)
+
+
+def _ranked(fused):
+    ranked = sorted(fused.values(), key=lambda entry: entry['score'], reverse=True)
+    return [dict(entry['hit'], _score=entry['score']) for entry in ranked]
+
+
+def search_chunks(ops_client, index_name, text, vector, mode='knn', fusion='rrf', k=5, size=10,
+                  lexical_weight=1.0, vector_weight=1.0, filter=None, engine='nmslib', ef_search=None):
+    '''
+    Retrieves the chunks for a question. knn runs the vector query alone. hybrid sends the
+    lexical and vector queries in one _msearch round trip, each fetching size hits so a chunk
+    ranked low by one can be lifted by the other, then fuses the two rankings in the Lambda
+    with reciprocal-rank fusion (rrf) or min-max weighted scores (weighted) and keeps the top k.
+    filter (metadata_filter) scopes both queries, engine and ef_search are the ones of the index profile.
+    A filter on fields outside LINK_SCOPE_FIELDS also fetches the nearest chunks within the scope in the
+    same round trip, to resolve near-duplicate links (with_links).
+    '''
+    resolve_links = any(field not in LINK_SCOPE_FIELDS for _, field in _filter_fields(filter))
+    scope_knn = knn_query(vector, k * POST_FILTER_OVERSAMPLE, k * POST_FILTER_OVERSAMPLE, fields=["chunk_id"],
+                          filter=scope_filter(filter), engine=engine, ef_search=ef_search)
+    if mode != 'hybrid' or text is None or text.strip() == '':
+        query = knn_query(vector, k, size, filter=filter, engine=engine, ef_search=ef_search)
+        if not resolve_links:
+            return ops_client.search(body=query, index=index_name)["hits"]["hits"]
+        hits, scope_hits = _msearch(ops_client, index_name, [query, scope_knn])
+        if hits is None:
+            raise RuntimeError(f'kNN search of {index_name} failed')
+        return with_links(ops_client, index_name, hits, scope_hits or [], filter, size)
+
+    queries = [lexical_query(text, size, filter=filter), knn_query(vector, size, size, filter=filter, engine=engine, ef_search=ef_search)]
+    # A failed sub-query degrades to the other ranking rather than failing the question
+    result_lists = [hits or [] for hits in _msearch(ops_client, index_name, queries + ([scope_knn] if resolve_links else []))]
+    if resolve_links:
+        result_lists = [result_lists[0], with_links(ops_client, index_name, result_lists[1], result_lists[2], filter, size)]
+    weights = [lexical_weight, vector_weight]
+    fused = weighted_fusion(result_lists, weights) if fusion == 'weighted' else reciprocal_rank_fusion(result_lists, weights)
+    return fused[:k]
+
+
+def _msearch(ops_client, index_name, queries):
+    '''Hits of each query from one _msearch round trip, None for a query that failed'''
+    body = []
+    for query in queries:
+        body.extend([{}, query])
+    responses = ops_client.msearch(body='\n'.join(json.dumps(line) for line in body) + '\n', index=index_name)["responses"]
+    results = []
+    for response in responses:
+        if 'error' in response:
+            print(f'Sub-query failed, error={response["error"]}')
+            results.append(None)
+        else:
+            results.append(response["hits"]["hits"])
+    return results
@@ -0,0 +1,47 @@
+import codecs
+
+# Bytes per ranged GET, large enough to amortize the request, small enough to keep memory flat
+DEFAULT_RANGE_SIZE = 8 * 1024 * 1024
+
+
+def iter_s3_ranges(s3_client, bucket, key, range_size=DEFAULT_RANGE_SIZE):
+    '''
+    Yields the object in ranged GETs of range_size bytes. Every range is pinned to the
+    ETag read up front, so an object overwritten mid-read fails instead of mixing versions.
+    '''
+    head = s3_client.head_object(Bucket=bucket, Key=key)
+    size = head['ContentLength']
+    etag = head['ETag']
+    for start in range(0, size, range_size):
+        end = min(start + range_size, size) - 1
+        body = s3_client.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end}', IfMatch=etag)['Body']
+        yield body.read()
+
+
+def iter_s3_text(s3_client, bucket, key, range_size=DEFAULT_RANGE_SIZE, segment_size=64 * 1024,
+                 encoding='utf-8-sig', errors='replace'):
+    '''
+    Decodes the ranges incrementally, a multi-byte character split across two ranges is
+    completed by the next one, and yields the text in segment_size slices for
+    pipeline.stream_chunks. Memory stays around one range whatever the object size.
+    '''
+    decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+    for data in iter_s3_ranges(s3_client, bucket, key, range_size):
+        text = decoder.decode(data)
+        for start in range(0, len(text), segment_size):
+            yield text[start:start + segment_size]
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def read_s3_text(s3_client, bucket, key, max_chars, range_size=DEFAULT_RANGE_SIZE):
+    '''At most max_chars of the object text, reading stops at the first range past the limit'''
+    parts = []
+    length = 0
+    for segment in iter_s3_text(s3_client, bucket, key, range_size):
+        parts.append(segment[:max_chars - length])
+        length = length + len(parts[-1])
+        if length >= max_chars:
+            break
+    return ''.join(parts)
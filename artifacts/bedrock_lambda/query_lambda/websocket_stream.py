@@ -0,0 +1,174 @@
+import base64
+import json
+import queue
+import threading
+import time
+import zlib
+
+# base64 -> base64 of the JSON message, what the UI decodes with JSON.parse(atob(data)).
+# json -> the JSON message as is. deflate -> as json, frames of at least COMPRESS_MIN_BYTES
+# are raw deflate compressed and sent base64 encoded behind a '~' (JSON never starts with it)
+FRAMINGS = ['base64', 'json', 'deflate']
+COMPRESS_MIN_BYTES = 1024
+COMPRESSED_PREFIX = b'~'
+
+_DONE = object()
+
+
+def encode_frame(message, framing='base64'):
+    # atob() yields bytes as Latin-1 characters, base64 frames keep non ASCII text escaped
+    data = json.dumps(message, separators=(',', ':'), ensure_ascii=framing not in ['json', 'deflate']).encode('utf-8')
+    if framing == 'json':
+        return data
+    if framing == 'deflate':
+        if len(data) < COMPRESS_MIN_BYTES:
+            return data
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        compressed = COMPRESSED_PREFIX + base64.b64encode(compressor.compress(data) + compressor.flush())
+        return compressed if len(compressed) < len(data) else data
+    return base64.b64encode(data)
+
+
+class BackgroundSender:
+    '''
+    Posts frames on its own thread in submit order, so the Bedrock stream reader never waits
+    on the API Gateway management API. At most queue_size frames wait, a full queue blocks
+    submit (backpressure), busy() tells a WebSocketStream to keep coalescing meanwhile. After
+    a failed post (e.g. the client disconnected) the remaining frames are dropped and error is
+    set. close() waits for the queued frames, a Lambda must not return before it.
+    '''
+
+    def __init__(self, post, queue_size=64):
+        self.post = post
+        self.error = None
+        self.stats = {'frames_posted': 0, 'post_ms': 0.0, 'backpressure_ms': 0.0, 'max_queued': 0}
+        self._frames = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            data = self._frames.get()
+            try:
+                if data is _DONE:
+                    return
+                if self.error is not None:
+                    continue
+                start = time.perf_counter()
+                try:
+                    self.post(data)
+                    self.stats['frames_posted'] = self.stats['frames_posted'] + 1
+                except Exception as e:
+                    print(f'Websocket post failed, dropping the remaining frames, exception={e}')
+                    self.error = e
+                self.stats['post_ms'] = self.stats['post_ms'] + (time.perf_counter() - start) * 1000
+            finally:
+                self._frames.task_done()
+
+    def submit(self, data):
+        if self.error is not None:
+            return
+        start = time.perf_counter()
+        self._frames.put(data)
+        self.stats['backpressure_ms'] = self.stats['backpressure_ms'] + (time.perf_counter() - start) * 1000
+        self.stats['max_queued'] = max(self.stats['max_queued'], self._frames.qsize())
+
+    def busy(self):
+        return self._frames.unfinished_tasks > 0
+
+    def close(self, timeout=30):
+        '''Waits up to timeout seconds for the queued frames to be posted'''
+        self._frames.put(_DONE)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f'Websocket sender still posting after {timeout}s, {self._frames.qsize()} frames queued')
+        return {key: round(value, 3) for key, value in self.stats.items()}
+
+
+class WebSocketStream:
+    '''
+    Coalesces streamed answer text into frames for post_to_connection (send), so a response
+    of hundreds of few-character stream chunks costs a few signed API calls. Text is flushed
+    once max_bytes are pending or max_delay seconds after the oldest pending text: checked as
+    chunks arrive and, with timer, by a timer thread when the model pauses. While busy() is
+    true (a BackgroundSender still posting) only max_bytes flushes, frames grow when the API
+    is slow. send() flushes the pending text first, so the UI sees messages in order.
+    '''
+
+    def __init__(self, post, framing='base64', max_bytes=512, max_delay=0.03, clock=time.monotonic, busy=None, timer=True):
+        self.post = post
+        self.framing = framing if framing in FRAMINGS else 'base64'
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.clock = clock
+        self.busy = busy or (lambda: False)
+        self.timer = timer
+        self._pending = []
+        self._pending_bytes = 0
+        self._pending_since = None
+        self._timer = None
+        self._lock = threading.RLock()
+        self.stats = {'messages': 0, 'frames': 0, 'bytes': 0}
+
+    def text(self, chunk):
+        if chunk is None or chunk == '':
+            return
+        with self._lock:
+            self._pending.append(chunk)
+            self._pending_bytes = self._pending_bytes + len(chunk.encode('utf-8'))
+            self.stats['messages'] = self.stats['messages'] + 1
+            if self._pending_since is None:
+                self._pending_since = self.clock()
+                self._start_timer(self.max_delay)
+            if self._pending_bytes >= self.max_bytes or (self.clock() - self._pending_since >= self.max_delay and not self.busy()):
+                self.flush()
+
+    def _start_timer(self, delay):
+        if self.timer and self.max_delay > 0:
+            self._timer = threading.Timer(delay, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            if self._pending_since is None:
+                return
+            if self.busy():
+                # Checked again after another window, the sender is still posting the last frame
+                self._start_timer(self.max_delay)
+                return
+            self.flush()
+
+    def send(self, message):
+        with self._lock:
+            self.flush()
+            self.stats['messages'] = self.stats['messages'] + 1
+            self._post(message)
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if len(self._pending) == 0:
+                return
+            text = ''.join(self._pending)
+            self._pending = []
+            self._pending_bytes = 0
+            self._pending_since = None
+            self._post({"text": text})
+
+    def _post(self, message):
+        data = encode_frame(message, self.framing)
+        self.stats['frames'] = self.stats['frames'] + 1
+        self.stats['bytes'] = self.stats['bytes'] + len(data)
+        self.post(data)
+
+    def close(self):
+        '''Flushes the pending text, returns the frames and bytes posted and the calls saved against a frame per message'''
+        self.flush()
+        return {
+            'websocket_frames': self.stats['frames'],
+            'websocket_calls_saved': self.stats['messages'] - self.stats['frames'],
+            'websocket_bytes': self.stats['bytes']
+        }
@@ -0,0 +1,82 @@
+'''
+Embeds chunks against a local Bedrock stand-in with a requests-per-second quota and compares the
+previous fixed 10 worker pool (throttled chunks fail) with the AIMD controller of concurrency.py
+(throttled calls are retried, the limit follows the quota). Reports throughput, failed chunks,
+throttles and the limit the controller settled on, for a quota below and above 10 workers.
+
+    python benchmarks/bench_adaptive_concurrency.py --chunks 2000 --latency-ms 60
+'''
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+from concurrency import AdaptiveConcurrency
+from embedding_utils import get_embedding_adapter
+from local_bedrock import LocalBedrock
+
+MODEL_ID = 'amazon.titan-embed-image-v1'
+
+
+def run_fixed(client, texts):
+    adapter = get_embedding_adapter(client, MODEL_ID, max_workers=10)
+    failed = 0
+
+    def embed(text):
+        try:
+            return adapter.embed([text])
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        for result in executor.map(embed, texts):
+            failed = failed + (1 if result is None else 0)
+    return failed, None
+
+
+def run_adaptive(client, texts, max_workers):
+    limiter = AdaptiveConcurrency(initial=4, min_limit=2, max_limit=max_workers)
+    adapter = get_embedding_adapter(client, MODEL_ID, max_workers=max_workers, limiter=limiter)
+    failed = 0
+    for start in range(0, len(texts), max_workers):
+        try:
+            adapter.embed(texts[start:start + max_workers])
+        except Exception:
+            failed = failed + len(texts[start:start + max_workers])
+    return failed, limiter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=2000)
+    parser.add_argument('--latency-ms', type=float, default=60)
+    parser.add_argument('--max-workers', type=int, default=32)
+    args = parser.parse_args()
+    texts = [f'chunk {i} ' + 'lorem ipsum ' * 80 for i in range(args.chunks)]
+
+    # 10 workers at this latency make ~150 requests/s, one quota throttles them and one leaves headroom
+    for max_rps in [80, 400]:
+        for name in ['fixed-10', 'adaptive']:
+            client = LocalBedrock(latency_ms=args.latency_ms, max_rps=max_rps)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                if name == 'fixed-10':
+                    failed, limiter = run_fixed(client, texts)
+                else:
+                    failed, limiter = run_adaptive(client, texts, args.max_workers)
+            elapsed = time.perf_counter() - start
+            line = (f'quota={max_rps:4d}/s {name:9s} {(len(texts) - failed) / elapsed:7.1f} chunks/s '
+                    f'failed={failed:5d} throttled_calls={client.throttled:5d}')
+            if limiter is not None:
+                line = line + f' retries={limiter.retries} final_limit={limiter.limit}'
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+'''
+Simulates a large backfill through the durable work queue: a worker process drains a SQLite
+queue and is killed part way, then a new worker resumes. Reports documents processed more than
+once and the total time, against restarting a one-request-per-document loop from the start.
+Document processing is a sleep standing in for read, embed and index.
+
+    python benchmarks/bench_batch_ingestion.py --docs 2000 --doc-ms 5 --crash-after 3
+'''
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+
+from work_queue import SQLiteWorkQueue, checkpoint_id, drain
+
+
+class SQLiteCheckpoints:
+    '''Checkpoints that survive the worker process, like the DynamoDB job status table'''
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('CREATE TABLE IF NOT EXISTS checkpoints (id TEXT PRIMARY KEY, runs INTEGER NOT NULL)')
+
+    def done(self, key):
+        return self.db.execute('SELECT 1 FROM checkpoints WHERE id = ?', (key,)).fetchone() is not None
+
+    def record(self, key):
+        self.db.execute('INSERT INTO checkpoints (id, runs) VALUES (?, 1) '
+                        'ON CONFLICT(id) DO UPDATE SET runs = runs + 1', (key,))
+
+    def redone(self):
+        return self.db.execute('SELECT COALESCE(SUM(runs - 1), 0) FROM checkpoints').fetchone()[0]
+
+
+def worker(queue_path, checkpoint_path, doc_ms, visibility_timeout):
+    queue = SQLiteWorkQueue(queue_path)
+    checkpoints = SQLiteCheckpoints(checkpoint_path)
+
+    def process(item):
+        key = checkpoint_id(item)
+        if checkpoints.done(key):
+            return True
+        time.sleep(doc_ms / 1000)
+        checkpoints.record(key)
+        return True
+
+    drain(queue, process, max_workers=4, visibility_timeout=visibility_timeout)
+
+
+def run_queue(docs, doc_ms, crash_after):
+    directory = tempfile.mkdtemp()
+    queue_path, checkpoint_path = os.path.join(directory, 'queue.db'), os.path.join(directory, 'checkpoints.db')
+    SQLiteCheckpoints(checkpoint_path)
+    SQLiteWorkQueue(queue_path).enqueue([{'batch_id': 'bench', 's3_key': f'index/data/doc-{i}.txt'} for i in range(docs)])
+    visibility_timeout = 1
+    start = time.perf_counter()
+    process = multiprocessing.Process(target=worker, args=(queue_path, checkpoint_path, doc_ms, visibility_timeout))
+    process.start()
+    time.sleep(crash_after)
+    process.kill()
+    process.join()
+    done_at_crash = SQLiteCheckpoints(checkpoint_path).db.execute('SELECT COUNT(*) FROM checkpoints').fetchone()[0]
+    # Items in flight at the crash come back after the visibility timeout
+    time.sleep(visibility_timeout)
+    worker(queue_path, checkpoint_path, doc_ms, visibility_timeout)
+    elapsed = time.perf_counter() - start - visibility_timeout
+    checkpoints = SQLiteCheckpoints(checkpoint_path)
+    print(f'queue+checkpoints: done_at_crash={done_at_crash} redone={checkpoints.redone()} '
+          f'pending={SQLiteWorkQueue(queue_path).counts()["pending"]} total={elapsed:.1f}s')
+
+
+def run_restart(docs, doc_ms, crash_after):
+    # One document per call in order, a crash means the loop starts over
+    start = time.perf_counter()
+    done_at_crash = 0
+    for i in range(docs):
+        if time.perf_counter() - start >= crash_after:
+            break
+        time.sleep(doc_ms / 1000)
+        done_at_crash = done_at_crash + 1
+    for i in range(docs):
+        time.sleep(doc_ms / 1000)
+    print(f'restart from scratch: done_at_crash={done_at_crash} redone={done_at_crash} '
+          f'total={time.perf_counter() - start:.1f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=2000)
+    parser.add_argument('--doc-ms', type=float, default=5)
+    parser.add_argument('--crash-after', type=float, default=3)
+    args = parser.parse_args()
+    run_restart(args.docs, args.doc_ms, args.crash_after)
+    run_queue(args.docs, args.doc_ms, args.crash_after)
+
+
+if __name__ == '__main__':
+    main()
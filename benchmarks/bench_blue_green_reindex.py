@@ -0,0 +1,102 @@
+'''
+Search availability during a full re-index. A reader thread queries the alias the query
+lambda uses while the corpus is rebuilt, first the old way (delete the index, create it
+again, re-ingest) and then blue/green (build a new versioned index, swap the alias).
+Reports how many searches failed or came back empty during each rebuild.
+
+    python benchmarks/bench_blue_green_reindex.py --docs 5000 --round-trip-ms 20
+'''
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+from bulk_utils import bulk_index
+from index_versions import create_first_index, create_versioned_index, delete_indexes, first_index_name, swap_alias
+from local_opensearch import LocalOpenSearch
+
+ALIAS = 'rag-index'
+
+
+def make_docs(count, version):
+    return [{'_id': f'doc-{i}', 'text': f'chunk {i} of the corpus, version {version}', 'version': version}
+            for i in range(count)]
+
+
+class Reader(threading.Thread):
+    def __init__(self, client, expected_docs):
+        super().__init__(daemon=True)
+        self.client = client
+        self.expected_docs = expected_docs
+        self.running = True
+        self.searches = 0
+        self.errors = 0
+        self.empty = 0
+        self.partial = 0
+
+    def run(self):
+        while self.running:
+            self.searches = self.searches + 1
+            try:
+                total = self.client.search(body={'size': 3, 'query': {'match_all': {}}}, index=ALIAS)['hits']['total']['value']
+            except Exception:
+                self.errors = self.errors + 1
+                continue
+            if total == 0:
+                self.empty = self.empty + 1
+            elif total < self.expected_docs:
+                self.partial = self.partial + 1
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+
+def rebuild_in_place(client, docs):
+    delete_indexes(client, [ALIAS])
+    client.indices.create(index=ALIAS, body={})
+    bulk_index(client, ALIAS, docs)
+
+
+def rebuild_blue_green(client, docs):
+    new_index = create_versioned_index(client, ALIAS, {}, tune_settings=True, attach_alias=False)
+    bulk_index(client, new_index, docs)
+    delete_indexes(client, swap_alias(client, ALIAS, new_index, tune_settings=True))
+
+
+def measure(name, rebuild, docs_count, round_trip_ms):
+    client = LocalOpenSearch(round_trip_ms=round_trip_ms)
+    if name == 'in-place':
+        client.indices.create(index=ALIAS, body={})
+        bulk_index(client, ALIAS, make_docs(docs_count, 1))
+    else:
+        create_first_index(client, ALIAS, {})
+        bulk_index(client, first_index_name(ALIAS), make_docs(docs_count, 1))
+    reader = Reader(client, docs_count)
+    reader.start()
+    start = time.perf_counter()
+    rebuild(client, make_docs(docs_count, 2))
+    seconds = time.perf_counter() - start
+    reader.stop()
+    served = client.search(body={'size': 1}, index=ALIAS)
+    version = served['hits']['hits'][0]['_source']['version']
+    print(f'{name:10s} rebuild={seconds:5.2f}s searches={reader.searches:5d} errors={reader.errors:4d} '
+          f'empty={reader.empty:4d} partial={reader.partial:4d} serving_version={version} '
+          f'physical_indexes={len(client.indices_data)}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=5000)
+    parser.add_argument('--round-trip-ms', type=float, default=20)
+    args = parser.parse_args()
+    measure('in-place', rebuild_in_place, args.docs, args.round_trip_ms)
+    measure('blue-green', rebuild_blue_green, args.docs, args.round_trip_ms)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+'''
+Compares per-chunk ops_client.index() calls with the _bulk ingestion path of the index lambda
+against a local OpenSearch stand-in with a simulated signed round trip.
+
+    python benchmarks/bench_bulk_indexing.py --chunks 2000 --round-trip-ms 20
+'''
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+from bulk_utils import bulk_index
+from local_opensearch import LocalOpenSearch
+
+
+def make_docs(count, dimension):
+    for i in range(count):
+        yield {'embedding': [0.001 * (i % 97)] * dimension, 'text': f'chunk {i} ' + 'lorem ipsum ' * 80,
+               'timestamp': '2024-01-01T00:00:00+00:00'}
+
+
+def run_single(client, docs, workers):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda doc: client.index(index='bench', body=doc), docs))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=2000)
+    parser.add_argument('--dimension', type=int, default=384)
+    parser.add_argument('--round-trip-ms', type=float, default=20)
+    parser.add_argument('--workers', type=int, default=10)
+    parser.add_argument('--bulk-docs', type=int, default=500)
+    parser.add_argument('--failure-rate', type=float, default=0.02)
+    args = parser.parse_args()
+
+    single_client = LocalOpenSearch(round_trip_ms=args.round_trip_ms)
+    start = time.perf_counter()
+    run_single(single_client, list(make_docs(args.chunks, args.dimension)), args.workers)
+    single_secs = time.perf_counter() - start
+
+    bulk_client = LocalOpenSearch(round_trip_ms=args.round_trip_ms, failure_rate=args.failure_rate)
+    start = time.perf_counter()
+    stats = bulk_index(bulk_client, 'bench', make_docs(args.chunks, args.dimension),
+                       max_docs=args.bulk_docs, backoff_seconds=0.05)
+    bulk_secs = time.perf_counter() - start
+
+    print(f'single: {args.chunks} chunks, {single_client.requests} requests, {single_secs:.2f}s, '
+          f'{args.chunks / single_secs:.0f} chunks/s ({args.workers} threads)')
+    print(f'bulk:   {stats["indexed"]} chunks, {bulk_client.requests} requests, {bulk_secs:.2f}s, '
+          f'{stats["indexed"] / bulk_secs:.0f} chunks/s, retried_items={stats["retried_items"]}, '
+          f'failed={len(stats["failed"])} (failure_rate={args.failure_rate})')
+    print(f'speedup: {single_secs / bulk_secs:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+'''
+Chunk-count report of the token budget packer (chunking.TokenBudgetSplitter) against the
+1000 character / 50 overlap splitter, per embed model, on a corpus of .txt files such as the
+sample_data documents. Fewer chunks means fewer Titan calls and smaller Cohere batches.
+Also reports chunks over the model limit, which the character splitter produces for models
+with small limits.
+
+    python benchmarks/bench_chunk_packing.py --corpus path/to/sample_data
+'''
+import argparse
+import glob
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+from chunking import TokenBudgetSplitter, chunk_token_budget, estimate_tokens, model_token_limit
+
+MODEL_IDS = ['amazon.titan-embed-image-v1', 'amazon.titan-embed-text-v2:0', 'cohere.embed-english-v3']
+
+
+def character_splitter():
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        return RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=50).split_text, 'langchain'
+    except ImportError:
+        from bench_streaming_pipeline import split_text
+        return split_text, 'stand-in'
+
+
+def synthetic_corpus(documents=4, paragraphs=40):
+    rng = random.Random(27)
+    words = ('the index stores embeddings of every chunk so that a query can be answered from the most '
+             'similar passages while the model sees only a small context window of retrieved text').split()
+    corpus = {}
+    for d in range(documents):
+        text = []
+        for _ in range(paragraphs):
+            sentences = [' '.join(rng.choice(words) for _ in range(rng.randint(8, 30))).capitalize() + '.'
+                         for _ in range(rng.randint(2, 8))]
+            text.append(' '.join(sentences))
+        corpus[f'synthetic_doc_{d + 1}.txt'] = '\n\n'.join(text)
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', help='directory of .txt files, e.g. the sample_data directory')
+    parser.add_argument('--share', type=float, default=0.9)
+    parser.add_argument('--max-tokens', type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.corpus:
+        files = sorted(glob.glob(os.path.join(args.corpus, '**', '*.txt'), recursive=True))
+        if len(files) == 0:
+            sys.exit(f'No .txt files under {args.corpus}')
+        corpus = {}
+        for file_name in files:
+            with open(file_name, encoding='utf-8') as f:
+                corpus[os.path.relpath(file_name, args.corpus)] = f.read()
+    else:
+        print('No --corpus given, using a synthetic corpus')
+        corpus = synthetic_corpus()
+
+    split_text, splitter_name = character_splitter()
+    print(f'{len(corpus)} documents, {sum(len(text) for text in corpus.values()) / 1024:.0f} KB, character splitter: {splitter_name}')
+    for model_id in MODEL_IDS:
+        limit = model_token_limit(model_id)
+        budget = chunk_token_budget(model_id, args.share, args.max_tokens)
+        packer = TokenBudgetSplitter(budget)
+        character_chunks, packed_chunks, over_limit = 0, 0, 0
+        for text in corpus.values():
+            chunks = split_text(text)
+            character_chunks = character_chunks + len(chunks)
+            over_limit = over_limit + sum(1 for chunk in chunks if estimate_tokens(chunk) > limit)
+            packed_chunks = packed_chunks + len(packer.split_text(text))
+        reduction = 100 * (character_chunks - packed_chunks) / character_chunks
+        print(f'{model_id:30s} limit={limit:5d} budget={budget:5d} character_chunks={character_chunks:5d} '
+              f'(over limit {over_limit}) packed_chunks={packed_chunks:5d} reduction={reduction:6.1f}%')
+
+
+if __name__ == '__main__':
+    main()
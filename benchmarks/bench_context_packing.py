@@ -0,0 +1,104 @@
+'''
+Prompt context of the token-budgeted packer (context_packer.pack_context) against concatenating
+the retrieved chunks, the previous behaviour. Documents are split with two sentences of overlap
+and some of them repeat boilerplate sections of others, the retrieved candidates of a question
+are a run of neighbouring chunks of one document plus the boilerplate copies, in score order.
+Reports prompt tokens, distinct sentences in the context (the information the model gets) and
+the time the packing adds per question.
+
+    python benchmarks/bench_context_packing.py --questions 200 --candidates 10 --budget 2000
+'''
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'query_lambda'))
+
+from chunking import TokenBudgetSplitter, estimate_tokens
+from context_packer import pack_context
+
+_SENTENCE = re.compile(r'[^.]+\.')
+
+
+def make_documents(documents, sentences, seed=27):
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choice('bcdfghklmnprstvz') + rng.choice('aeiou') for _ in range(3)) for _ in range(3000)]
+    boilerplate = [' '.join(rng.sample(vocabulary, 14)).capitalize() + '.' for _ in range(sentences // 3)]
+    corpus = []
+    for d in range(documents):
+        text = [f'Document {d} sentence {s} ' + ' '.join(rng.sample(vocabulary, 12)) + '.' for s in range(sentences)]
+        if d % 2 == 1:
+            # Legal and safety sections shared across the manuals
+            position = rng.randrange(len(text))
+            text[position:position] = boilerplate
+        corpus.append(' '.join(text))
+    return corpus, boilerplate
+
+
+def make_candidates(chunks, boilerplate_chunks, candidates, rng):
+    start = rng.randrange(max(1, len(chunks) - candidates))
+    run = chunks[start:start + candidates - 2]
+    found = run + rng.sample(boilerplate_chunks, min(2, len(boilerplate_chunks)))
+    return [(text, 1.0 - rank * 0.02) for rank, text in enumerate(found)]
+
+
+def distinct_sentences(text):
+    return set(sentence.strip() for sentence in _SENTENCE.findall(text))
+
+
+def concatenated(passages, budget):
+    '''Previous behaviour: every retrieved chunk, and the same cut to the budget for a like for like comparison'''
+    context = ' '.join(text for text, _ in passages)
+    truncated = []
+    used = 0
+    for text, _ in passages:
+        tokens = estimate_tokens(text)
+        if used + tokens > budget:
+            break
+        truncated.append(text)
+        used = used + tokens
+    return context, ' '.join(truncated)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=20)
+    parser.add_argument('--sentences', type=int, default=120)
+    parser.add_argument('--questions', type=int, default=200)
+    parser.add_argument('--candidates', type=int, default=10)
+    parser.add_argument('--chunk-tokens', type=int, default=300)
+    parser.add_argument('--budget', type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus, boilerplate = make_documents(args.documents, args.sentences)
+    splitter = TokenBudgetSplitter(args.chunk_tokens, overlap_sentences=2)
+    chunks = [splitter.split_text(text) for text in corpus]
+    boilerplate_chunks = [chunk for document in chunks for chunk in document if any(b in chunk for b in boilerplate)]
+    rng = random.Random(27)
+
+    totals = {'all chunks': [0, 0], 'cut to budget': [0, 0], 'packed': [0, 0]}
+    packing_ms = []
+    for _ in range(args.questions):
+        passages = make_candidates(rng.choice(chunks), boilerplate_chunks, args.candidates, rng)
+        context, truncated = concatenated(passages, args.budget)
+        start = time.perf_counter()
+        packed, _ = pack_context(passages, args.budget)
+        packing_ms.append((time.perf_counter() - start) * 1000)
+        for name, text in (('all chunks', context), ('cut to budget', truncated), ('packed', packed)):
+            totals[name][0] = totals[name][0] + estimate_tokens(text)
+            totals[name][1] = totals[name][1] + len(distinct_sentences(text))
+
+    baseline = totals['all chunks'][0]
+    for name, (tokens, sentences) in totals.items():
+        print(f'{name:14s} tokens/question={tokens / args.questions:7.0f} ({tokens / baseline:4.0%}) '
+              f'distinct sentences/question={sentences / args.questions:5.1f} '
+              f'tokens/sentence={tokens / max(1, sentences):5.1f}')
+    packing_ms.sort()
+    print(f'packing p50={packing_ms[len(packing_ms) // 2]:.2f}ms p99={packing_ms[int(len(packing_ms) * 0.99)]:.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
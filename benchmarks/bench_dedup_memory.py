@@ -0,0 +1,82 @@
+'''
+Memory of near-duplicate suppression while one large document streams through the real
+index.index_text_stream: Python heap peak (tracemalloc) with DEDUP_MODE off, link with the
+in-memory signatures capped at --max-signatures, and link uncapped as before. Every chunk is
+unique, the worst case for the in-memory index. The OpenSearch stand-in drops indexed chunks
+so only the pipeline's own memory is measured, embeddings come from the hashing backend.
+Needs the index lambda's dependencies (boto3, opensearch-py, requests-aws4auth, langchain),
+no AWS calls are made.
+
+    python benchmarks/bench_dedup_memory.py --chunks 10000 --max-signatures 2000
+'''
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+for name, value in {'AWS_ACCESS_KEY_ID': 'local', 'AWS_SECRET_ACCESS_KEY': 'local', 'AWS_DEFAULT_REGION': 'us-east-1',
+                    'EMBED_BACKEND': 'hashing', 'EMBED_CACHE_BACKENDS': '', 'CHUNKER': 'character'}.items():
+    os.environ.setdefault(name, value)
+
+import index
+from local_opensearch import LocalOpenSearch
+
+WORDS = ('policy employee data retention access review approval security incident report manager quarterly '
+         'vendor contract customer record audit compliance training device password leave travel expense').split()
+
+
+class DiscardingOpenSearch(LocalOpenSearch):
+    '''Accepts every chunk without keeping it, searches find nothing'''
+
+    def _store(self, index, doc_id, doc):
+        return doc_id
+
+
+def segments(chunks, seed=27):
+    # About one 1000 character chunk per paragraph, a number per sentence keeps every chunk unique
+    rng = random.Random(seed)
+    for paragraph in range(chunks):
+        yield ' '.join(f'{" ".join(rng.choice(WORDS) for _ in range(12))} {paragraph * 10 + sentence}.'
+                       for sentence in range(8)) + '\n\n'
+
+
+def run(chunks, mode, max_signatures):
+    index.DEDUP_MODE = mode
+    index.DEDUP_MAX_SIGNATURES = max_signatures
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = index.index_text_stream(segments(chunks), 'bench/large-document.txt', incremental=False)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result['result']['chunks'], peak, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=10000)
+    parser.add_argument('--max-signatures', type=int, default=2000)
+    args = parser.parse_args()
+    index.ops_client = DiscardingOpenSearch(round_trip_ms=0, per_kb_ms=0)
+    index.create_index()
+
+    runs = [('off', 'off', args.max_signatures), (f'link, {args.max_signatures} kept', 'link', args.max_signatures),
+            ('link, uncapped', 'link', 10 ** 9)]
+    baseline = None
+    for name, mode, max_signatures in runs:
+        chunks, peak, seconds = run(args.chunks, mode, max_signatures)
+        baseline = peak if baseline is None else baseline
+        print(f'{name:20s} chunks={chunks} peak={peak / 1024 / 1024:7.1f}MB '
+              f'dedup={(peak - baseline) / 1024 / 1024:6.1f}MB {seconds:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+'''
+Per-query embedding latency of the embedding backends: Bedrock (a local stand-in with the
+network round trip as --bedrock-latency-ms), the hashing backend, and the in-process CPU
+backend when --model-path points to a model (ONNX directory or .npz static embeddings).
+
+    python benchmarks/bench_embedding_backends.py --queries 200 --model-path /opt/models/minilm
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'query_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+from embedding_utils import get_embedding_adapter
+from local_bedrock import LocalBedrock
+
+
+def measure(name, embedder, queries):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        embedder.embed([query], input_type='search_query')
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    print(f'{name:10s} dimension={embedder.dimension:5d} p50={latencies[len(latencies) // 2]:7.2f}ms '
+          f'p99={latencies[int(len(latencies) * 0.99) - 1]:7.2f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--bedrock-latency-ms', type=float, default=150)
+    parser.add_argument('--model-path')
+    args = parser.parse_args()
+    queries = [f'what does clause {i} of the contract say about termination and notice periods' for i in range(args.queries)]
+
+    measure('bedrock', get_embedding_adapter(LocalBedrock(latency_ms=args.bedrock_latency_ms), 'amazon.titan-embed-text-v2:0'), queries)
+    measure('hashing', get_embedding_adapter(None, 'amazon.titan-embed-text-v2:0', backend='hashing'), queries)
+    if args.model_path:
+        measure('local', get_embedding_adapter(None, 'amazon.titan-embed-text-v2:0', backend='local', model_path=args.model_path), queries)
+    else:
+        print('local      skipped, pass --model-path')
+
+
+if __name__ == '__main__':
+    main()
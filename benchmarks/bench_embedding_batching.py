@@ -0,0 +1,65 @@
+'''
+Compares the previous ingestion path, one invoke_model call per chunk on a 10 worker
+ThreadPoolExecutor, with the batched embedding adapters (multi-text requests for Cohere,
+bounded fan-out for Titan) against a local Bedrock stand-in. Titan accepts one text per
+request, so its adapter makes the same calls with the same fan-out as before.
+
+    python benchmarks/bench_embedding_batching.py --chunks 2000 --latency-ms 60
+'''
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+from embedding_utils import get_embedding_adapter
+from local_bedrock import LocalBedrock
+
+
+def embed_one(client, model_id, text):
+    if 'cohere' in model_id:
+        body = {"texts": [text], "input_type": 'search_document'}
+    else:
+        body = {"inputText": text, "embeddingConfig": {"outputEmbeddingLength": 384}}
+    client.invoke_model(body=json.dumps(body), modelId=model_id)
+
+
+def run_per_chunk(client, model_id, texts, workers=10):
+    # What _generate_embeddings_and_index did: a call per chunk, max_workers=10
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda text: embed_one(client, model_id, text), texts))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, default=60)
+    parser.add_argument('--workers', type=int, default=10)
+    args = parser.parse_args()
+    texts = [f'chunk {i} ' + 'lorem ipsum ' * 80 for i in range(args.chunks)]
+
+    for model_id in ['amazon.titan-embed-image-v1', 'cohere.embed-english-v3']:
+        client = LocalBedrock(latency_ms=args.latency_ms)
+        start = time.perf_counter()
+        run_per_chunk(client, model_id, texts)
+        baseline_secs = time.perf_counter() - start
+        baseline_calls = client.calls
+
+        client = LocalBedrock(latency_ms=args.latency_ms)
+        adapter = get_embedding_adapter(client, model_id, max_workers=args.workers)
+        start = time.perf_counter()
+        embeddings = adapter.embed(texts)
+        batched_secs = time.perf_counter() - start
+        assert len(embeddings) == len(texts)
+
+        print(f'{model_id}: per-chunk x10 workers {baseline_calls} calls {baseline_secs:.2f}s | '
+              f'adapter {client.calls} calls {batched_secs:.2f}s | '
+              f'{baseline_calls / client.calls:.1f}x fewer calls, {baseline_secs / batched_secs:.1f}x faster')
+
+
+if __name__ == '__main__':
+    main()
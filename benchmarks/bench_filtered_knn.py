@@ -0,0 +1,125 @@
+'''
+Tenant-scoped questions against a multi-tenant index: every tenant has its own version of the
+same policy documents, so an unscoped kNN search fills the context with other tenants' chunks.
+Compares no filter, post-filtering the k nearest neighbours (nmslib) and efficient filtering
+inside the approximate search (faiss, lucene) through retrieval.search_chunks, reporting recall@5
+of the tenant's chunk, hits in scope and hits returned per question.
+
+Runs against the in-process OpenSearch stand-in (exact kNN, its scoring time is not counted), or
+against a local OpenSearch with --host, e.g. docker run -p 9200:9200 -e discovery.type=single-node
+-e DISABLE_SECURITY_PLUGIN=true opensearchproject/opensearch:2.11.0, which builds a faiss index
+and also shows the latency of each mode.
+
+    python benchmarks/bench_filtered_knn.py --tenants 200 --questions 200
+    python benchmarks/bench_filtered_knn.py --host http://localhost:9200 --tenants 500
+'''
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'query_lambda'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+from bulk_utils import bulk_index
+from document_metadata import DOCUMENT_METADATA_MAPPING
+from embedding_utils import get_embedding_adapter
+from local_opensearch import LocalOpenSearch
+from retrieval import metadata_filter, search_chunks
+
+INDEX = 'bench-filtered-knn'
+POLICIES = {
+    'refund': 'refund purchase returned within days receipt store credit original payment',
+    'travel': 'travel booking flight hotel expense approval economy class reimbursement',
+    'security': 'security password rotation badge access laptop encryption incident report',
+    'leave': 'leave vacation sick days carry over manager approval calendar request',
+    'shipping': 'shipping carrier delivery tracking parcel damaged address customs fees'
+}
+
+
+def make_corpus(tenants, seed=27):
+    rng = random.Random(seed)
+    corpus = []
+    for t in range(tenants):
+        for policy, words in POLICIES.items():
+            # Tenants word the same policy alike, they differ in a few details
+            body = words.split() + [rng.choice(['30', '60', '90', '14']), rng.choice(['manager', 'director', 'team lead'])]
+            rng.shuffle(body)
+            corpus.append({'_id': f'{t}-{policy}', 'tenant': f'tenant-{t}', 'collection': 'policies', 'doc_type': 'pdf',
+                           'text': f'The {policy} policy: ' + ' '.join(body) + '.'})
+    return corpus
+
+
+def make_client(args, dimension):
+    if not args.host:
+        client = LocalOpenSearch(round_trip_ms=args.round_trip_ms, per_kb_ms=0.01)
+        client.indices.create(index=INDEX, body={})
+        return client
+    from opensearchpy import OpenSearch
+    client = OpenSearch(hosts=[args.host], timeout=60)
+    if client.indices.exists(index=INDEX):
+        client.indices.delete(index=INDEX)
+    client.indices.create(index=INDEX, body={
+        'settings': {'index': {'knn': True}},
+        'mappings': {'properties': {
+            'text': {'type': 'text'},
+            **DOCUMENT_METADATA_MAPPING,
+            'embedding': {'type': 'knn_vector', 'dimension': dimension,
+                          'method': {'name': 'hnsw', 'engine': 'faiss', 'space_type': 'l2'}}}}})
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tenants', type=int, default=200)
+    parser.add_argument('--questions', type=int, default=200)
+    parser.add_argument('--dimension', type=int, default=256)
+    parser.add_argument('--round-trip-ms', type=float, default=15)
+    parser.add_argument('--host', help='OpenSearch URL, the in-process stand-in when omitted')
+    args = parser.parse_args()
+
+    embedder = get_embedding_adapter(None, 'amazon.titan-embed-text-v2:0', dimension=args.dimension, backend='hashing')
+    corpus = make_corpus(args.tenants)
+    client = make_client(args, args.dimension)
+    embeddings = embedder.embed([chunk['text'] for chunk in corpus])
+    bulk_index(client, INDEX, [{**chunk, 'embedding': embedding} for chunk, embedding in zip(corpus, embeddings)])
+    if args.host:
+        client.indices.refresh(index=INDEX)
+
+    rng = random.Random(27)
+    questions = []
+    for _ in range(args.questions):
+        policy = rng.choice(list(POLICIES))
+        words = rng.sample(POLICIES[policy].split(), 5)
+        questions.append((f'What does the {policy} policy say about ' + ' '.join(words), f'tenant-{rng.randrange(args.tenants)}', policy))
+    vectors = embedder.embed([text for text, _, _ in questions], 'search_query')
+
+    modes = {
+        'no filter': lambda text, vector, tenant: search_chunks(client, INDEX, text, vector, k=5, size=5),
+        'post-filter': lambda text, vector, tenant: search_chunks(client, INDEX, text, vector, k=5, size=5,
+                                                                  filter=metadata_filter({'tenant': tenant}), engine='nmslib'),
+        'efficient filter': lambda text, vector, tenant: search_chunks(client, INDEX, text, vector, k=5, size=5,
+                                                                       filter=metadata_filter({'tenant': tenant}), engine='faiss')
+    }
+    for name, search in modes.items():
+        latencies = []
+        found = 0
+        in_scope = 0
+        returned = 0
+        for (text, tenant, policy), vector in zip(questions, vectors):
+            start = time.perf_counter()
+            scoring = getattr(client, 'search_seconds', 0)
+            hits = search(text, vector, tenant)
+            latencies.append((time.perf_counter() - start - getattr(client, 'search_seconds', 0) + scoring) * 1000)
+            found = found + any(hit['_id'] == f'{tenant[len("tenant-"):]}-{policy}' for hit in hits)
+            in_scope = in_scope + sum(1 for hit in hits if hit['_id'].split('-')[0] == tenant[len('tenant-'):])
+            returned = returned + len(hits)
+        latencies.sort()
+        print(f'{name:16s} recall@5={found / len(questions):4.0%} in scope={in_scope / max(1, returned):4.0%} '
+              f'hits/question={returned / len(questions):.1f} p50={latencies[len(latencies) // 2]:6.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
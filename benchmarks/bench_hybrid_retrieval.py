@@ -0,0 +1,148 @@
+'''
+Latency and recall@k of pure kNN against hybrid BM25 + kNN retrieval (retrieval.search_chunks)
+on a corpus of manual chunks that each mention a part number and an error code. Half of the
+questions ask for an identifier ("what does error E1047 mean"), half paraphrase the chunk.
+Query and chunk vectors come from the hashing backend with identifiers stripped, standing in for
+a dense model that splits part numbers into sub-word pieces carrying little signal.
+
+Runs against the in-process OpenSearch stand-in (--round-trip-ms per request, exact kNN, BM25,
+its scoring time is not counted), or against a local OpenSearch with --host, e.g. docker run -p 9200:9200 -e
+discovery.type=single-node -e DISABLE_SECURITY_PLUGIN=true opensearchproject/opensearch:2.11.0
+
+    python benchmarks/bench_hybrid_retrieval.py --chunks 2000 --questions 200
+    python benchmarks/bench_hybrid_retrieval.py --host http://localhost:9200
+'''
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'query_lambda'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+from bulk_utils import bulk_index
+from embedding_utils import get_embedding_adapter
+from local_opensearch import LocalOpenSearch
+from retrieval import knn_query, lexical_query, reciprocal_rank_fusion, search_chunks
+
+INDEX = 'bench-hybrid'
+TOPICS = {
+    'pump': 'pump impeller seal flow pressure priming cavitation',
+    'valve': 'valve actuator stem seat leakage torque position',
+    'sensor': 'sensor calibration drift signal temperature reading offset',
+    'motor': 'motor winding bearing vibration current overload speed',
+    'controller': 'controller firmware relay display fault reset configuration'
+}
+_IDENTIFIER = re.compile(r'\b\S*\d\S*\b')
+
+
+class IdentifierBlindEmbedder:
+    def __init__(self, dimension):
+        self.adapter = get_embedding_adapter(None, 'amazon.titan-embed-text-v2:0', dimension=dimension, backend='hashing')
+
+    def embed(self, texts, input_type='search_document'):
+        return self.adapter.embed([_IDENTIFIER.sub(' ', text) for text in texts], input_type)
+
+
+def make_corpus(chunks, seed=27):
+    rng = random.Random(seed)
+    # Words that tell chunks of the same topic apart
+    vocabulary = [''.join(rng.choice('bcdfghklmnprstvz') + rng.choice('aeiou') for _ in range(3)) for _ in range(2000)]
+    corpus = []
+    for i in range(chunks):
+        topic = rng.choice(list(TOPICS))
+        words = TOPICS[topic].split()
+        part, error = f'PN-{10000 + i}', f'E{1000 + i}'
+        body = ' '.join(rng.sample(words, 5) + rng.sample(vocabulary, 15))
+        corpus.append({'_id': str(i), 'topic': topic, 'part': part, 'error': error,
+                       'text': f'The {topic} assembly with part number {part} reports error {error} when the {body}.'})
+    return corpus
+
+
+def make_questions(corpus, count, seed=27):
+    rng = random.Random(seed)
+    questions = []
+    for chunk in rng.sample(corpus, count):
+        if len(questions) % 2 == 0:
+            text = rng.choice([f'What does error {chunk["error"]} mean?', f'Where is part {chunk["part"]} used?'])
+            questions.append(('exact', text, chunk['_id']))
+        else:
+            # The distinctive words of the chunk, reordered, as a paraphrase
+            words = chunk['text'].split(' when the ')[1].rstrip('.').split()
+            questions.append(('semantic', f'{chunk["topic"]} problem with ' + ' '.join(rng.sample(words, 8)), chunk['_id']))
+    return questions
+
+
+def make_client(args, dimension):
+    if not args.host:
+        client = LocalOpenSearch(round_trip_ms=args.round_trip_ms, per_kb_ms=0.01)
+        client.indices.create(index=INDEX, body={})
+        return client
+    from opensearchpy import OpenSearch
+    client = OpenSearch(hosts=[args.host], timeout=60)
+    if client.indices.exists(index=INDEX):
+        client.indices.delete(index=INDEX)
+    client.indices.create(index=INDEX, body={
+        'settings': {'index': {'knn': True}},
+        'mappings': {'properties': {
+            'text': {'type': 'text'},
+            'embedding': {'type': 'knn_vector', 'dimension': dimension,
+                          'method': {'name': 'hnsw', 'engine': 'nmslib', 'space_type': 'cosinesimil'}}}}})
+    return client
+
+
+def two_round_trips(client, text, vector, k=5, size=10):
+    lexical = client.search(body=lexical_query(text, size), index=INDEX)['hits']['hits']
+    vector_hits = client.search(body=knn_query(vector, size, size), index=INDEX)['hits']['hits']
+    return reciprocal_rank_fusion([lexical, vector_hits])[:k]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=2000)
+    parser.add_argument('--questions', type=int, default=200)
+    parser.add_argument('--dimension', type=int, default=256)
+    parser.add_argument('--round-trip-ms', type=float, default=15)
+    parser.add_argument('--host', help='OpenSearch URL, the in-process stand-in when omitted')
+    args = parser.parse_args()
+
+    embedder = IdentifierBlindEmbedder(args.dimension)
+    corpus = make_corpus(args.chunks)
+    client = make_client(args, args.dimension)
+    embeddings = embedder.embed([chunk['text'] for chunk in corpus])
+    bulk_index(client, INDEX, [{'_id': chunk['_id'], 'text': chunk['text'], 'embedding': embedding}
+                               for chunk, embedding in zip(corpus, embeddings)])
+    if args.host:
+        client.indices.refresh(index=INDEX)
+    questions = make_questions(corpus, args.questions)
+    vectors = embedder.embed([text for _, text, _ in questions], 'search_query')
+
+    modes = {
+        'knn': lambda text, vector: search_chunks(client, INDEX, text, vector, 'knn', k=5, size=5),
+        'hybrid rrf': lambda text, vector: search_chunks(client, INDEX, text, vector, 'hybrid', 'rrf'),
+        'hybrid weighted': lambda text, vector: search_chunks(client, INDEX, text, vector, 'hybrid', 'weighted'),
+        '2 round trips': lambda text, vector: two_round_trips(client, text, vector)
+    }
+    for name, search in modes.items():
+        latencies = []
+        found = {'exact': 0, 'semantic': 0}
+        requests = getattr(client, 'requests', 0)
+        for (kind, text, target), vector in zip(questions, vectors):
+            start = time.perf_counter()
+            scoring = getattr(client, 'search_seconds', 0)
+            hits = search(text, vector)
+            # The stand-in scores by brute force in process, only its modelled round trips count
+            latencies.append((time.perf_counter() - start - getattr(client, 'search_seconds', 0) + scoring) * 1000)
+            found[kind] = found[kind] + any(hit['_id'] == target for hit in hits[:5])
+        latencies.sort()
+        per_kind = len(questions) // 2
+        print(f'{name:16s} p50={latencies[len(latencies) // 2]:6.1f}ms p90={latencies[int(len(latencies) * 0.9)]:6.1f}ms '
+              f'recall@5 exact={found["exact"] / per_kind:.0%} semantic={found["semantic"] / per_kind:.0%}'
+              + (f' requests/question={(client.requests - requests) / len(questions):.0f}' if not args.host else ''))
+
+
+if __name__ == '__main__':
+    main()
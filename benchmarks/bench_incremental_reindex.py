@@ -0,0 +1,74 @@
+'''
+Indexes a synthetic manual with deterministic chunk ids, edits a few pages and re-indexes it
+incrementally, reporting how many chunks were embedded, moved and deleted each time.
+
+    python benchmarks/bench_incremental_reindex.py --pages 500 --edited-pages 3
+
+--assigned-ids runs it against a stand-in that rejects client supplied _id like serverless vector
+search collections, chunks are then looked up by chunk_id before every _bulk request.
+'''
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+from bulk_utils import bulk_index
+from embedding_utils import get_embedding_adapter
+from incremental_utils import IncrementalPlan, document_id, fetch_existing_chunks, iter_chunk_ids
+from local_bedrock import LocalBedrock
+from local_opensearch import LocalOpenSearch
+
+
+def make_manual(pages, paragraphs_per_page=3):
+    rng = random.Random(27)
+    words = ['valve', 'pressure', 'torque', 'sensor', 'firmware', 'calibrate', 'assembly', 'warranty']
+    return [[f'Page {page} paragraph {p}. ' + ' '.join(rng.choice(words) for _ in range(140))
+             for p in range(paragraphs_per_page)] for page in range(pages)]
+
+
+def reindex(client, embedder, source, chunk_texts, custom_ids):
+    plan = IncrementalPlan(fetch_existing_chunks(client, 'bench', document_id(source)))
+    to_index = list(plan.chunks_to_embed(iter_chunk_ids(source, chunk_texts)))
+    embeddings = embedder.embed([text for text, _ in to_index]) if to_index else []
+    docs = [dict(metadata, text=text, embedding=embedding) for (text, metadata), embedding in zip(to_index, embeddings)]
+    docs.extend({'_op': 'update', '_id': chunk['_id'], 'chunk_ordinal': chunk['chunk_ordinal']} for chunk in plan.moved)
+    removed_ids = plan.removed_ids()
+    docs.extend({'_op': 'delete', '_id': chunk_id} for chunk_id in removed_ids)
+    stats = bulk_index(client, 'bench', docs, custom_ids=custom_ids)
+    return len(to_index), len(plan.moved), len(removed_ids), stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--edited-pages', type=int, default=3)
+    parser.add_argument('--latency-ms', type=float, default=60)
+    parser.add_argument('--assigned-ids', action='store_true')
+    args = parser.parse_args()
+
+    client = LocalOpenSearch(round_trip_ms=20, custom_ids=not args.assigned_ids)
+    client.indices.create(index='bench', body={})
+    embedder = get_embedding_adapter(LocalBedrock(latency_ms=args.latency_ms), 'amazon.titan-embed-image-v1')
+    manual = make_manual(args.pages)
+    source = 'index/data/manual.pdf'
+
+    for label in ['full build', 'unchanged re-index', 'edited re-index']:
+        if label == 'edited re-index':
+            for page in random.Random(5).sample(range(args.pages), args.edited_pages):
+                manual[page][1] = manual[page][1] + ' Revised torque specification.'
+            # A page inserted near the front shifts the position of every later chunk
+            manual.insert(10, ['Inserted errata page. ' + 'calibrate sensor ' * 60])
+        chunk_texts = [paragraph for page in manual for paragraph in page]
+        start = time.perf_counter()
+        embedded, moved, deleted, stats = reindex(client, embedder, source, chunk_texts, not args.assigned_ids)
+        print(f'{label}: {len(chunk_texts)} chunks, embedded={embedded}, moved={moved}, deleted={deleted}, '
+              f'bulk_requests={stats["requests"]}, {time.perf_counter() - start:.2f}s, '
+              f'indexed_total={client.count("bench")}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+'''
+Builds one index per vector index profile of cdk.json on a local OpenSearch and reports
+index size, build time, query latency and recall@k against exact search, so the cheapest
+profile that meets the recall target can be picked.
+
+    docker run -p 9200:9200 -e discovery.type=single-node -e DISABLE_SECURITY_PLUGIN=true opensearchproject/opensearch:2.13.0
+    python benchmarks/bench_index_profiles.py --endpoint http://localhost:9200 --docs 5000 --queries 50
+'''
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import urllib.request
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+
+from embedding_utils import to_byte_vector
+from index_profiles import build_index_body, load_index_profile
+
+
+def call(endpoint, method, path, body=None, ndjson=False):
+    data = None
+    if body is not None:
+        data = (body if ndjson else json.dumps(body)).encode('utf-8')
+    request = urllib.request.Request(f'{endpoint}{path}', data=data, method=method,
+                                     headers={'Content-Type': 'application/x-ndjson' if ndjson else 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def normalized(vector):
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def make_vectors(count, dimension, rng, centers):
+    # Clustered vectors behave more like text embeddings than uniform noise
+    vectors = []
+    for _ in range(count):
+        center = centers[rng.randrange(len(centers))]
+        vectors.append(normalized([c + rng.gauss(0, 0.35) for c in center]))
+    return vectors
+
+
+def exact_top_k(vectors, query, k):
+    scores = [(sum(a * b for a, b in zip(vector, query)), i) for i, vector in enumerate(vectors)]
+    scores.sort(reverse=True)
+    return [str(i) for _, i in scores[:k]]
+
+
+def run_profile(endpoint, name, profile, vectors, queries, truths, k):
+    index_name = f'bench-profile-{name}'
+    dimension = len(vectors[0])
+    byte_vectors = profile['data_type'] == 'byte'
+    try:
+        call(endpoint, 'DELETE', f'/{index_name}')
+    except Exception:
+        pass
+    call(endpoint, 'PUT', f'/{index_name}', build_index_body(profile, dimension))
+
+    start = time.perf_counter()
+    for batch_start in range(0, len(vectors), 500):
+        lines = []
+        for i in range(batch_start, min(batch_start + 500, len(vectors))):
+            vector = to_byte_vector(vectors[i]) if byte_vectors else vectors[i]
+            lines.append(json.dumps({'index': {'_id': str(i)}}))
+            lines.append(json.dumps({'embedding': vector}))
+        call(endpoint, 'POST', f'/{index_name}/_bulk', '\n'.join(lines) + '\n', ndjson=True)
+    call(endpoint, 'POST', f'/{index_name}/_refresh')
+    call(endpoint, 'POST', f'/{index_name}/_forcemerge?max_num_segments=1')
+    build_secs = time.perf_counter() - start
+    size_bytes = call(endpoint, 'GET', f'/{index_name}/_stats/store')['indices'][index_name]['total']['store']['size_in_bytes']
+
+    latencies, recalls = [], []
+    for query, truth in zip(queries, truths):
+        vector = to_byte_vector(query) if byte_vectors else query
+        knn = {'vector': vector, 'k': k}
+        start = time.perf_counter()
+        response = call(endpoint, 'POST', f'/{index_name}/_search',
+                        {'size': k, '_source': False, 'query': {'knn': {'embedding': knn}}})
+        latencies.append((time.perf_counter() - start) * 1000)
+        found = [hit['_id'] for hit in response['hits']['hits']]
+        recalls.append(len(set(found) & set(truth)) / k)
+    latencies.sort()
+    call(endpoint, 'DELETE', f'/{index_name}')
+    return {'profile': name, 'size_mb': size_bytes / 1024 / 1024, 'build_secs': build_secs,
+            'p50_ms': latencies[len(latencies) // 2], 'p99_ms': latencies[int(len(latencies) * 0.99) - 1],
+            'recall': sum(recalls) / len(recalls)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--endpoint', default='http://localhost:9200')
+    parser.add_argument('--cdk-json', default=os.path.join(os.path.dirname(__file__), '..', 'cdk.json'))
+    parser.add_argument('--docs', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--recall-target', type=float, default=0.95)
+    args = parser.parse_args()
+
+    try:
+        call(args.endpoint, 'GET', '/')
+    except Exception as e:
+        sys.exit(f'OpenSearch is not reachable at {args.endpoint}: {e}')
+
+    with open(args.cdk_json) as f:
+        profiles = json.load(f)['context']['vector_index_profiles']
+
+    results = []
+    data_by_dimension = {}
+    for name, profile_config in profiles.items():
+        profile = load_index_profile(json.dumps(dict(profile_config, name=name)))
+        dimension = profile['dimension']
+        if dimension not in data_by_dimension:
+            rng = random.Random(27)
+            centers = [[rng.gauss(0, 1) for _ in range(dimension)] for _ in range(50)]
+            vectors = make_vectors(args.docs, dimension, rng, centers)
+            queries = make_vectors(args.queries, dimension, rng, centers)
+            data_by_dimension[dimension] = (vectors, queries, [exact_top_k(vectors, query, args.k) for query in queries])
+        vectors, queries, truths = data_by_dimension[dimension]
+        result = run_profile(args.endpoint, name, profile, vectors, queries, truths, args.k)
+        results.append(result)
+        print(f'{name:20s} dim={dimension:5d} size={result["size_mb"]:7.1f}MB build={result["build_secs"]:6.1f}s '
+              f'p50={result["p50_ms"]:6.1f}ms p99={result["p99_ms"]:6.1f}ms recall@{args.k}={result["recall"]:.3f}')
+
+    passing = [result for result in results if result['recall'] >= args.recall_target]
+    if len(passing) > 0:
+        cheapest = min(passing, key=lambda result: result['size_mb'])
+        print(f'smallest profile meeting recall {args.recall_target}: {cheapest["profile"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+'''
+Near-duplicate suppression on a corpus of policy documents that share boilerplate sections
+(the same clauses with the company name, dates and a few words changed) next to sections of
+their own. Ingests every document into a local OpenSearch stand-in with and without
+dedup_utils.ChunkDeduplicator and reports embedded chunks, embed tokens, stored vectors,
+the dedup overhead per chunk and how many chunks of the documents' own sections were
+wrongly taken for duplicates. Documents are spread over --tenants tenants and linked within
+their tenant as the index lambda does, corpus wide linking ignores the tenant. Filtered recall
+asks for a shared clause of every document with a filter on its source and counts how often
+the document's own copy comes back, through retrieval.search_chunks (which resolves links)
+and through a plain filtered kNN search.
+
+    python benchmarks/bench_near_duplicates.py --documents 200 --threshold 0.85
+'''
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'query_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+from bulk_utils import bulk_index
+from chunking import TokenBudgetSplitter, estimate_tokens
+from dedup_utils import ChunkDeduplicator
+from embedding_utils import get_embedding_adapter
+from incremental_utils import iter_chunk_ids
+from local_opensearch import LocalOpenSearch
+from pipeline import grouped
+from retrieval import knn_query, metadata_filter, search_chunks
+
+WORDS = ('policy employee data retention access review approval security incident report manager quarterly '
+         'vendor contract customer record audit compliance training device password leave travel expense').split()
+UNIQUE_MARKER = 'Section specific to this policy'
+
+
+def paragraph(rng, sentences=6):
+    return ' '.join(' '.join(rng.choice(WORDS) for _ in range(rng.randint(10, 22))).capitalize() + '.'
+                    for _ in range(sentences))
+
+
+def make_corpus(documents, boilerplate_sections=6, own_sections=4):
+    rng = random.Random(27)
+    boilerplate = [paragraph(rng) for _ in range(boilerplate_sections)]
+    corpus = {}
+    for d in range(documents):
+        sections = [f'Company {d} policy, effective {2020 + d % 5}-0{1 + d % 9}-01.']
+        for section in boilerplate:
+            # Each copy rewords a word or two
+            words = section.split()
+            for _ in range(rng.randint(0, 2)):
+                words[rng.randrange(len(words))] = rng.choice(WORDS)
+            sections.append(' '.join(words))
+        own = [f'{UNIQUE_MARKER} {d}. ' + paragraph(rng) for _ in range(own_sections)]
+        # The document's own sections come before or after the shared clauses
+        sections = sections + own if rng.random() < 0.5 else own + sections
+        corpus[f'policies/policy-{d}.txt'] = '\n\n'.join(sections)
+    return corpus
+
+
+def tenant_of(source, tenants):
+    return f'tenant-{int(source.split("-")[-1].split(".")[0]) % tenants}'
+
+
+def ingest(corpus, splitter, embedder, threshold, scope, tenants):
+    client = LocalOpenSearch(round_trip_ms=0, per_kb_ms=0)
+    client.indices.create(index='bench', body={})
+    stats = {'chunks': 0, 'embedded': 0, 'embed_tokens': 0, 'duplicates': 0, 'wrong_duplicates': 0, 'dedup_seconds': 0.0}
+    for source, text in corpus.items():
+        dedup = None
+        if scope == 'corpus':
+            dedup = ChunkDeduplicator(client, 'bench', threshold, scope={})
+        elif scope == 'tenant':
+            dedup = ChunkDeduplicator(client, 'bench', threshold, scope={'collection': None, 'tenant': tenant_of(source, tenants)})
+        docs = []
+        chunks = ((chunk_text, dict(metadata, tenant=tenant_of(source, tenants)))
+                  for chunk_text, metadata in iter_chunk_ids(source, splitter.split_text(text)))
+        for group in grouped(chunks, 32):
+            stats['chunks'] = stats['chunks'] + len(group)
+            if dedup is not None:
+                start = time.perf_counter()
+                unique, duplicates = dedup.partition(group)
+                stats['dedup_seconds'] = stats['dedup_seconds'] + time.perf_counter() - start
+                stats['duplicates'] = stats['duplicates'] + len(duplicates)
+                stats['wrong_duplicates'] = stats['wrong_duplicates'] + sum(1 for chunk_text, _, _, _ in duplicates if UNIQUE_MARKER in chunk_text)
+                docs.extend(dict(metadata, text=chunk_text, duplicate_of=canonical_id) for chunk_text, metadata, canonical_id, _ in duplicates)
+            else:
+                unique = [(chunk_text, metadata, {}) for chunk_text, metadata in group]
+            embeddings = embedder.embed([chunk_text for chunk_text, _, _ in unique])
+            stats['embedded'] = stats['embedded'] + len(unique)
+            stats['embed_tokens'] = stats['embed_tokens'] + sum(estimate_tokens(chunk_text) for chunk_text, _, _ in unique)
+            docs.extend(dict(metadata, **fields, text=chunk_text, embedding=embedding)
+                        for (chunk_text, metadata, fields), embedding in zip(unique, embeddings))
+        bulk_index(client, 'bench', docs)
+    stats['vectors'] = sum(1 for doc in client.indices_data['bench'].values() if 'embedding' in doc)
+    return client, stats
+
+
+def filtered_recall(client, corpus, embedder, tenants, resolve_links):
+    # The first shared clause of every document, asked for with a filter on the document's source
+    found = 0
+    for source, text in corpus.items():
+        sections = text.split('\n\n')
+        clause = [section for section in sections if not section.startswith(UNIQUE_MARKER)][1]
+        vector = embedder.embed([clause])[0]
+        filter = metadata_filter({'tenant': tenant_of(source, tenants), 'source': source})
+        if resolve_links:
+            hits = search_chunks(client, 'bench', clause, vector, k=3, size=3, filter=filter, engine='faiss')
+        else:
+            hits = client.search(body=knn_query(vector, 3, 3, filter=filter, engine='faiss'), index='bench')['hits']['hits']
+        texts = [hit.get('fields', {}).get('text', [''])[0] for hit in hits]
+        found = found + (1 if any(clause[:100] in chunk_text for chunk_text in texts) else 0)
+    return found / len(corpus)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=200)
+    parser.add_argument('--threshold', type=float, default=0.85)
+    parser.add_argument('--chunk-tokens', type=int, default=250)
+    parser.add_argument('--tenants', type=int, default=4)
+    args = parser.parse_args()
+    corpus = make_corpus(args.documents)
+    splitter = TokenBudgetSplitter(args.chunk_tokens)
+    embedder = get_embedding_adapter(None, 'amazon.titan-embed-text-v2:0', dimension=1024, backend='hashing')
+
+    runs = [(scope or 'off', *ingest(corpus, splitter, embedder, args.threshold, scope, args.tenants))
+            for scope in [None, 'tenant', 'corpus']]
+    baseline = runs[0][2]
+    for name, client, stats in runs:
+        print(f'{name:8s} chunks={stats["chunks"]} embedded={stats["embedded"]} embed_tokens={stats["embed_tokens"]} '
+              f'vectors={stats["vectors"]} duplicates={stats["duplicates"]} wrong_duplicates={stats["wrong_duplicates"]} '
+              f'filtered_recall={filtered_recall(client, corpus, embedder, args.tenants, True):.0%} '
+              f'(without links {filtered_recall(client, corpus, embedder, args.tenants, False):.0%})')
+    for name, _, deduped in runs[1:]:
+        saved = 1 - deduped['embed_tokens'] / baseline['embed_tokens']
+        per_chunk_ms = deduped['dedup_seconds'] * 1000 / max(deduped['chunks'], 1)
+        print(f'{name:8s} embed tokens saved {saved:.0%}, vectors saved {baseline["vectors"] - deduped["vectors"]} '
+              f'({(baseline["vectors"] - deduped["vectors"]) * 1024 * 4 / 1024 / 1024:.1f}MB of float vectors), '
+              f'dedup {per_chunk_ms:.2f}ms per chunk')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+'''
+OCR of a set of uploaded images against local Textract and S3 stand-ins: one synchronous
+detect_document_text per image (the previous per-request flow), the concurrent ocr_images
+stage on a cold cache, and a re-index of the same images (e.g. after switching embed models)
+served from the ETag keyed cache. Reports wall time and Textract calls.
+
+    python benchmarks/bench_ocr_cache.py --images 40 --ocr-latency 0.5
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+from concurrency import AdaptiveConcurrency
+from local_s3 import LocalS3
+from local_textract import LocalTextract
+from ocr_utils import OCRResultCache, ocr_images
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=40)
+    parser.add_argument('--ocr-latency', type=float, default=0.5)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    s3 = LocalS3()
+    keys = [f'index/data/scan-{i}.png' for i in range(args.images)]
+    for i, key in enumerate(keys):
+        s3.put_object(Bucket='local', Key=key, Body=f'image bytes {i}'.encode('utf-8') * 1000)
+
+    textract = LocalTextract(ocr_latency=args.ocr_latency)
+    start = time.perf_counter()
+    for key in keys:
+        body = s3.get_object(Bucket='local', Key=key)['Body'].read()
+        textract.detect_document_text(Document={'Bytes': body})
+    print(f'sequential per request: {time.perf_counter() - start:6.2f}s textract_calls={textract.calls}')
+
+    textract = LocalTextract(ocr_latency=args.ocr_latency)
+    cache = OCRResultCache(s3, 'local')
+    limiter = AdaptiveConcurrency(initial=args.workers, min_limit=1, max_limit=args.workers)
+    start = time.perf_counter()
+    ocr_images(textract, s3, 'local', keys, cache, limiter, args.workers)
+    print(f'concurrent, cold cache: {time.perf_counter() - start:6.2f}s textract_calls={textract.calls}')
+
+    # A new container: the in-memory tier is empty, results come from the S3 tier
+    textract = LocalTextract(ocr_latency=args.ocr_latency)
+    cache = OCRResultCache(s3, 'local')
+    start = time.perf_counter()
+    ocr_images(textract, s3, 'local', keys, cache, limiter, args.workers)
+    print(f're-index, warm cache:   {time.perf_counter() - start:6.2f}s textract_calls={textract.calls} cache_hits={cache.hits}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+'''
+Query embedding latency for FAQ-style traffic: questions drawn from a Zipf distribution over
+--questions distinct questions, each asked with varying case, spacing and punctuation. Requests
+are spread round-robin over --containers warm containers. Compares no cache, the per-container
+LRU/TTL cache and the per-container cache with a shared tier (a local stand-in for the DynamoDB
+table with --shared-latency-ms per call). Bedrock is a local stand-in with --bedrock-latency-ms.
+
+    python benchmarks/bench_query_embedding_cache.py --requests 1000 --containers 4
+'''
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'query_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+from embedding_utils import get_embedding_adapter
+from local_bedrock import LocalBedrock
+from query_cache import DynamoDBCacheTier, QueryEmbeddingCache, TTLCache
+
+
+class LocalTable:
+    '''get_item/put_item of a DynamoDB table resource, every call sleeps latency_ms'''
+
+    def __init__(self, latency_ms):
+        self.latency_ms = latency_ms
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def get_item(self, Key):
+        time.sleep(self.latency_ms / 1000)
+        with self.lock:
+            item = self.items.get(Key['cache_key'])
+        return {'Item': item} if item is not None else {}
+
+    def put_item(self, Item):
+        time.sleep(self.latency_ms / 1000)
+        with self.lock:
+            self.items[Item['cache_key']] = Item
+
+
+def make_traffic(requests, questions, seed=27):
+    rng = random.Random(seed)
+    topics = ['reset my password', 'change the billing address', 'export a report', 'cancel the subscription',
+              'add a team member', 'enable two factor login', 'download an invoice', 'update the plan']
+    asked = [f'How do I {rng.choice(topics)} for account type {i}' for i in range(questions)]
+    weights = [1 / (rank + 1) for rank in range(questions)]
+    traffic = []
+    for question in rng.choices(asked, weights, k=requests):
+        variant = question.lower() if rng.random() < 0.3 else question
+        variant = variant + rng.choice(['?', '', ' ?', '??'])
+        traffic.append(variant.replace(' ', '  ') if rng.random() < 0.1 else variant)
+    return traffic
+
+
+def run(name, traffic, containers, bedrock, shared_table, cache_size):
+    embedder = get_embedding_adapter(bedrock, 'amazon.titan-embed-text-v2:0', dimension=384)
+    caches = [QueryEmbeddingCache(embedder, TTLCache(cache_size, 3600),
+                                  DynamoDBCacheTier(shared_table) if shared_table is not None else None)
+              for _ in range(containers)]
+    latencies = []
+    hits = 0
+    shared_hits = 0
+    calls = bedrock.calls
+    for position, query in enumerate(traffic):
+        _, metrics = caches[position % containers].embed_query(query)
+        latencies.append(metrics['query_embedding_ms'])
+        hits = hits + metrics['query_embedding_cache_hit']
+        shared_hits = shared_hits + metrics['query_embedding_shared_hit']
+    latencies.sort()
+    print(f'{name:14s} p50={latencies[len(latencies) // 2]:7.2f}ms p90={latencies[int(len(latencies) * 0.9)]:7.2f}ms '
+          f'mean={sum(latencies) / len(latencies):7.2f}ms hit_rate={hits / len(traffic):.0%} '
+          f'shared_hits={shared_hits} bedrock_calls={bedrock.calls - calls}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--questions', type=int, default=300)
+    parser.add_argument('--containers', type=int, default=4)
+    parser.add_argument('--bedrock-latency-ms', type=float, default=60)
+    parser.add_argument('--shared-latency-ms', type=float, default=4)
+    args = parser.parse_args()
+    traffic = make_traffic(args.requests, args.questions)
+    bedrock = LocalBedrock(latency_ms=args.bedrock_latency_ms)
+
+    run('no cache', traffic, args.containers, bedrock, None, 0)
+    run('per container', traffic, args.containers, bedrock, None, 1024)
+    run('with shared', traffic, args.containers, bedrock, LocalTable(args.shared_latency_ms), 1024)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+'''
+Peak RSS of reading, decoding and chunking a large UTF-8 text object from S3 (a local, file
+backed stand-in) with ranged GETs and incremental decoding, against the previous
+get()['Body'].read() + decode(). Each mode runs in its own process so ru_maxrss is not shared.
+The text mixes multi-byte characters so range boundaries fall inside characters.
+
+    python benchmarks/bench_s3_streaming.py --size-mb 2048
+    python benchmarks/bench_s3_streaming.py --size-mb 300 --compare-whole
+'''
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+from bench_streaming_pipeline import split_text
+from local_s3 import LocalS3
+from pipeline import stream_chunks
+from s3_stream import iter_s3_text
+
+
+def write_corpus(path, size_mb):
+    line = 'Die Größe des Objekts spielt keine Rolle — 東京 データ naïve café résumé. ' * 8 + '\n'
+    block = (line * 2000).encode('utf-8')
+    with open(path, 'wb') as f:
+        for _ in range(max(1, size_mb * 1024 * 1024 // len(block))):
+            f.write(block)
+
+
+def run(mode, path, range_mb):
+    s3 = LocalS3()
+    s3.put_file('local', 'index/data/large.txt', path)
+    start = time.perf_counter()
+    chunks = 0
+    characters = 0
+    if mode == 'stream':
+        segments = iter_s3_text(s3, 'local', 'index/data/large.txt', range_size=range_mb * 1024 * 1024)
+        for chunk in stream_chunks(segments, split_text):
+            chunks = chunks + 1
+            characters = characters + len(chunk)
+    else:
+        text = s3.get_object(Bucket='local', Key='index/data/large.txt')['Body'].read().decode()
+        for chunk in split_text(text):
+            chunks = chunks + 1
+            characters = characters + len(chunk)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{mode:6s}: chunks={chunks} characters={characters} gets={s3.gets} '
+          f'time={time.perf_counter() - start:.1f}s peak_rss={peak_mb:.0f}MB')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=2048)
+    parser.add_argument('--range-mb', type=int, default=8)
+    parser.add_argument('--compare-whole', action='store_true', help='also run the whole-object read, needs several times --size-mb of RAM')
+    parser.add_argument('--mode')
+    parser.add_argument('--path')
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.mode, args.path, args.range_mb)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'large.txt')
+        write_corpus(path, args.size_mb)
+        print(f'object size {os.path.getsize(path) / 1024 / 1024:.0f}MB')
+        for mode in ['stream', 'whole'] if args.compare_whole else ['stream']:
+            subprocess.run([sys.executable, __file__, '--mode', mode, '--path', path, '--range-mb', str(args.range_mb)], check=True)
+
+
+if __name__ == '__main__':
+    main()
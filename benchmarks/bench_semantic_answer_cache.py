@@ -0,0 +1,91 @@
+'''
+Semantic answer cache on paraphrased QnA traffic. Requests are drawn from a Zipf distribution
+over --questions base questions, each asked as one of several paraphrases. The retrieved context
+of a question is derived from its topic and the corpus version, halfway through the run a third
+of the documents are edited and at 75% the index is rebuilt and its alias swapped. Reports the
+hit rate, generations saved, answers replayed for a different base question (wrong answers)
+and answers replayed from before an edit or rebuild (stale answers), which must both be 0.
+
+Query embeddings come from the hashing backend, which only captures word overlap. Real embed
+models score paraphrases higher, calibrate --threshold (ANSWER_CACHE_THRESHOLD) on their scores.
+
+    python benchmarks/bench_semantic_answer_cache.py --requests 2000 --threshold 0.9
+'''
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'query_lambda'))
+
+from answer_cache import SemanticAnswerCache, fingerprint
+from embedding_utils import get_embedding_adapter
+from query_cache import QueryEmbeddingCache, TTLCache
+
+SUBJECTS = ['password', 'billing address', 'monthly report', 'subscription', 'team member', 'two factor login',
+            'invoice', 'plan', 'api key', 'webhook', 'data export', 'audit log']
+ACTIONS = ['reset', 'change', 'download', 'cancel', 'add', 'enable', 'remove', 'update']
+PARAPHRASES = ['How do I {action} the {subject} in the admin console?',
+               'how do i {action} the {subject} in the admin console',
+               'How can I {action} the {subject} in the admin console?',
+               'How do I {action} the {subject} in the admin console, please?',
+               'In the admin console, how do I {action} the {subject}?']
+
+
+def make_traffic(requests, questions, seed=27):
+    rng = random.Random(seed)
+    combinations = [(action, subject) for action in ACTIONS for subject in SUBJECTS]
+    base = [(action, subject, i) for i, (action, subject) in enumerate(rng.sample(combinations, questions))]
+    weights = [1 / (rank + 1) for rank in range(questions)]
+    return [(question, rng.choice(PARAPHRASES).format(action=question[0], subject=question[1]))
+            for question in rng.choices(base, weights, k=requests)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--questions', type=int, default=60)
+    parser.add_argument('--threshold', type=float, default=0.9)
+    parser.add_argument('--generation-seconds', type=float, default=4.0, help='assumed time of one streamed generation')
+    args = parser.parse_args()
+
+    embedder = get_embedding_adapter(None, 'amazon.titan-embed-text-v2:0', dimension=1024, backend='hashing')
+    query_embeddings = QueryEmbeddingCache(embedder, TTLCache(1024, 3600))
+    cache = SemanticAnswerCache(TTLCache(512, 3600), threshold=args.threshold)
+    traffic = make_traffic(args.requests, args.questions)
+    edited_topics = set(random.Random(1).sample(SUBJECTS, len(SUBJECTS) // 3))
+
+    hits = 0
+    wrong = 0
+    stale = 0
+    lookup_ms = []
+    for position, (question, text) in enumerate(traffic):
+        edited = position >= len(traffic) // 2
+        generation = 'rag-index-v2' if position >= len(traffic) * 3 // 4 else 'rag-index-v1'
+        # Context retrieved for the question: its topic documents, at the version the index serves
+        version = 2 if edited and question[1] in edited_topics else 1
+        context = f'{question[1]} documentation version {version}'
+        start = time.perf_counter()
+        embedding, _ = query_embeddings.embed_query(text)
+        key = SemanticAnswerCache.key('anthropic.claude-3-haiku', 'english', fingerprint(context), generation)
+        cached = cache.get(key, embedding)
+        lookup_ms.append((time.perf_counter() - start) * 1000)
+        answer = {'question': question[2], 'context': context, 'generation': generation}
+        if cached is None:
+            cache.put(key, embedding, answer)
+            continue
+        hits = hits + 1
+        wrong = wrong + (cached[0]['question'] != question[2])
+        stale = stale + (cached[0]['context'] != context or cached[0]['generation'] != generation)
+
+    lookup_ms.sort()
+    generations = len(traffic) - hits
+    print(f'requests={len(traffic)} hits={hits} hit_rate={hits / len(traffic):.0%} generations={generations} '
+          f'wrong_answers={wrong} stale_answers={stale}')
+    print(f'lookup p50={lookup_ms[len(lookup_ms) // 2]:.2f}ms p99={lookup_ms[int(len(lookup_ms) * 0.99)]:.2f}ms, '
+          f'generation time saved {hits * args.generation_seconds / 60:.0f} min at {args.generation_seconds}s per answer')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+'''
+Peak memory of the streaming read -> chunk -> embed -> _bulk pipeline against the previous
+load-everything approach, on a synthetic text file. Each mode runs in its own process so
+ru_maxrss is not shared between them.
+
+    python benchmarks/bench_streaming_pipeline.py --size-mb 200
+'''
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+
+from bulk_utils import bulk_index
+from pipeline import grouped, iter_file_segments, pipelined, stream_chunks
+
+
+def split_text(text, chunk_size=1000, overlap=50):
+    '''Stand-in for RecursiveCharacterTextSplitter.split_text, cuts on the last space before chunk_size'''
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            space = text.rfind(' ', start + overlap + 1, end)
+            end = space if space > start else end
+        chunk = text[start:end].strip()
+        if chunk != '':
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+class NullOpenSearch:
+    '''Accepts _bulk requests without keeping the documents, records when the first batch landed'''
+
+    def __init__(self):
+        self.first_batch_at = None
+        self.items = 0
+
+    def bulk(self, body, index=None):
+        if self.first_batch_at is None:
+            self.first_batch_at = time.perf_counter()
+        count = body.count('\n') // 2
+        self.items = self.items + count
+        return {'errors': False, 'items': []}
+
+
+def embed(texts):
+    return [[float(len(text) % 7)] * 16 for text in texts]
+
+
+def embedded_docs(chunks):
+    for group in grouped(chunks, 96):
+        for text, embedding in zip(group, embed(group)):
+            yield {'text': text, 'embedding': embedding}
+
+
+def run(mode, file_name):
+    client = NullOpenSearch()
+    start = time.perf_counter()
+    if mode == 'streaming':
+        chunks = pipelined(stream_chunks(iter_file_segments(file_name), split_text), 256)
+        bulk_index(client, 'bench', pipelined(embedded_docs(chunks), 256))
+    else:
+        with open(file_name, 'r') as f:
+            text = f.read()
+        chunks = split_text(text)
+        docs = list(embedded_docs(chunks))
+        bulk_index(client, 'bench', docs)
+    total = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{mode}: {client.items} chunks, peak_rss={peak_mb:.0f}MB, '
+          f'first_batch_indexed_after={client.first_batch_at - start:.2f}s, total={total:.2f}s')
+
+
+def write_synthetic_file(file_name, size_mb):
+    words = ['policy', 'release', 'notes', 'customer', 'account', 'billing', 'region', 'latency', 'index', 'vector']
+    line = ' '.join(words[(i * 7) % len(words)] for i in range(180)) + '.\n\n'
+    with open(file_name, 'w') as f:
+        written = 0
+        while written < size_mb * 1024 * 1024:
+            f.write(line)
+            written = written + len(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=200)
+    parser.add_argument('--mode', choices=['streaming', 'load-all'])
+    parser.add_argument('--file')
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run(args.mode, args.file)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, 'synthetic.txt')
+        write_synthetic_file(file_name, args.size_mb)
+        print(f'synthetic file: {os.path.getsize(file_name) / 1024 / 1024:.0f}MB')
+        for mode in ['streaming', 'load-all']:
+            subprocess.run([sys.executable, __file__, '--mode', mode, '--file', file_name], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+'''
+Runs the PDF flow offline against a local Textract + SNS stand-in and compares how a job's
+completion is noticed: the previous fixed 3 s sleep-poll, polling with exponential backoff,
+and the completion event. Reports Textract API calls and the delay between the job finishing
+and indexing starting. Durations are scaled by --time-scale to keep the run short.
+
+    python benchmarks/bench_textract_completion.py --jobs 20 --time-scale 0.1
+'''
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'index_lambda'))
+sys.path.append(os.path.dirname(__file__))
+
+from job_store import InMemoryJobStore
+from local_textract import LocalTextract
+from textract_utils import parse_textract_notifications, poll_job_status
+
+
+def read_pages(textract, job_id):
+    # Same paging as index.getJobResults, drained the way index_text_stream would
+    lines = 0
+    next_token = None
+    while True:
+        response = textract.get_document_text_detection(JobId=job_id, NextToken=next_token)
+        lines = lines + len(response['Blocks'])
+        next_token = response.get('NextToken')
+        if not next_token:
+            return lines
+
+
+def run(strategy, durations, scale):
+    textract = LocalTextract()
+    store = InMemoryJobStore()
+    delays = []
+    lock = threading.Lock()
+
+    def index_job(job_id):
+        completed_at = textract.jobs[job_id]['completed_at']
+        with lock:
+            delays.append(time.time() - completed_at)
+        read_pages(textract, job_id)
+
+    def on_notification(event):
+        for notification in parse_textract_notifications(event):
+            store.update(notification['job_id'], textract_status=notification['status'], status_checked_at=time.time())
+            if notification['status'] == 'SUCCEEDED':
+                index_job(notification['job_id'])
+
+    def fixed_poll(job_id):
+        while textract.get_document_text_detection(JobId=job_id)['JobStatus'] == 'IN_PROGRESS':
+            time.sleep(3 * scale)
+        index_job(job_id)
+
+    def backoff_poll(job_id):
+        if poll_job_status(textract, job_id, store, initial_delay=1 * scale, max_delay=10 * scale) == 'SUCCEEDED':
+            index_job(job_id)
+
+    if strategy == 'event':
+        textract.subscribe(on_notification)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_and_wait(textract, strategy, durations, scale, fixed_poll, backoff_poll, delays)
+
+    delays.sort()
+    print(f'{strategy}: textract_calls={textract.calls}, completion_to_indexing p50={delays[len(delays) // 2] / scale:.2f}s '
+          f'max={delays[-1] / scale:.2f}s (unscaled)')
+
+
+def start_and_wait(textract, strategy, durations, scale, fixed_poll, backoff_poll, delays):
+    threads = []
+    for i, duration in enumerate(durations):
+        job_id = textract.start_document_text_detection(
+            DocumentLocation={'S3Object': {'Bucket': 'local', 'Name': f'index/data/doc-{i}.pdf'}},
+            NotificationChannel={'SNSTopicArn': 'local'} if strategy == 'event' else None,
+            duration=duration * scale)['JobId']
+        if strategy != 'event':
+            thread = threading.Thread(target=fixed_poll if strategy == 'fixed-3s-poll' else backoff_poll, args=(job_id,))
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+    while len(delays) < len(durations):
+        time.sleep(0.01)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=20)
+    parser.add_argument('--time-scale', type=float, default=0.1)
+    args = parser.parse_args()
+    rng = random.Random(27)
+    # Multi page PDFs typically take tens of seconds to a few minutes in Textract
+    durations = [rng.uniform(10, 120) for _ in range(args.jobs)]
+    for strategy in ['fixed-3s-poll', 'backoff-poll', 'event']:
+        run(strategy, durations, args.time_scale)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+'''
+API Gateway post_to_connection calls and bytes of streaming an answer to the websocket:
+one pretty printed base64 frame per Bedrock stream chunk (the previous behaviour) against
+websocket_stream.WebSocketStream coalescing with each framing. Stream chunks of 1-3 words
+arrive every --chunk-ms on a simulated clock, each post costs --post-ms plus --per-kb-ms, as a
+signed HTTPS call from the Lambda does. Also reports the frames of an agent run, whose
+prompt_flow message grows with every step.
+The pipelined section replays --live-answers in real time with sleeping posts: how long reading
+the Bedrock stream takes and when the last frame is out, posting on the reader thread against
+posting on a websocket_stream.BackgroundSender. The pause section streams a few words, then
+the model stops for --pause-ms (a tool call, a slow region): how long the words wait to be
+posted with the flush timer and with the window only checked when the next chunk arrives.
+
+    python benchmarks/bench_websocket_streaming.py --answers 50 --flush-bytes 512 --flush-ms 30
+    python benchmarks/bench_websocket_streaming.py --chunk-ms 4 --post-ms 40   # fast model, slow posts
+'''
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'artifacts', 'bedrock_lambda', 'query_lambda'))
+
+from websocket_stream import FRAMINGS, BackgroundSender, WebSocketStream, encode_frame
+
+WORDS = ('the index stores embeddings of every chunk so that a query can be answered from the most similar '
+         'passages while the model sees only a small context window of retrieved text').split()
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def legacy_frame_size(message):
+    '''Bytes of a message framed as before, pretty printed JSON in base64'''
+    return len(base64.b64encode(json.dumps(message, indent=4).encode('utf-8')))
+
+
+def make_answer(rng, chunks):
+    return [' ' + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))) for _ in range(chunks)]
+
+
+def make_prompt_flows(rng, steps=10):
+    flow = [{'role': 'user', 'content': [{'type': 'text', 'text': 'What were the sales per region last quarter?'}]}]
+    flows = []
+    for step in range(steps):
+        flow.append({'role': 'assistant', 'content': [{'type': 'text', 'text': ' '.join(rng.choice(WORDS) for _ in range(120))}]})
+        flow.append({'role': 'user', 'content': [{'type': 'tool_result', 'content': ' '.join(rng.choice(WORDS) for _ in range(80))}]})
+        flows.append({'prompt_flow': list(flow), 'done': step == steps - 1})
+    return flows
+
+
+def live_run(answer, args, mode):
+    '''(seconds reading the stream, seconds until the last frame is posted, frames) of one answer'''
+    def post(data):
+        time.sleep((args.post_ms + len(data) / 1024 * args.per_kb_ms) / 1000)
+
+    sender = BackgroundSender(post) if mode == 'background sender' else None
+    if mode == 'per chunk':
+        stream = WebSocketStream(post, max_bytes=0)
+    elif sender is None:
+        stream = WebSocketStream(post, max_bytes=args.flush_bytes, max_delay=args.flush_ms / 1000)
+    else:
+        stream = WebSocketStream(sender.submit, max_bytes=args.flush_bytes, max_delay=args.flush_ms / 1000, busy=sender.busy)
+    start = time.perf_counter()
+    next_chunk = start
+    for chunk in answer:
+        # Bedrock delivers the next chunk at its own pace, a reader that was held up finds it waiting
+        next_chunk = next_chunk + args.chunk_ms / 1000
+        time.sleep(max(0.0, next_chunk - time.perf_counter()))
+        stream.text(chunk)
+    read_seconds = time.perf_counter() - start
+    stats = stream.close()
+    if sender is not None:
+        sender.close()
+    return read_seconds, time.perf_counter() - start, stats['websocket_frames']
+
+
+def pause_delay(args, timer):
+    '''Milliseconds until text streamed before a pause of the model is posted'''
+    posted = []
+    stream = WebSocketStream(lambda data: posted.append(time.perf_counter()), max_bytes=args.flush_bytes,
+                             max_delay=args.flush_ms / 1000, timer=timer)
+    start = time.perf_counter()
+    stream.text(' the refund policy')
+    time.sleep(args.pause_ms / 1000)
+    stream.text(' says')
+    stream.close()
+    return (posted[0] - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--answers', type=int, default=50)
+    parser.add_argument('--chunks', type=int, default=300, help='stream chunks per answer')
+    parser.add_argument('--chunk-ms', type=float, default=12)
+    parser.add_argument('--flush-bytes', type=int, default=512)
+    parser.add_argument('--flush-ms', type=float, default=30)
+    parser.add_argument('--post-ms', type=float, default=15)
+    parser.add_argument('--per-kb-ms', type=float, default=0.05)
+    parser.add_argument('--live-answers', type=int, default=3)
+    parser.add_argument('--pause-ms', type=float, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(27)
+    answers = [make_answer(rng, args.chunks) for _ in range(args.answers)]
+    legacy_bytes = sum(legacy_frame_size({'text': chunk}) for answer in answers for chunk in answer)
+    legacy_calls = sum(len(answer) for answer in answers)
+    print(f'{"per chunk":18s} calls/answer={legacy_calls / len(answers):6.1f} KB/answer={legacy_bytes / len(answers) / 1024:6.1f} '
+          f'post time/answer={(legacy_calls * args.post_ms + legacy_bytes / 1024 * args.per_kb_ms) / len(answers):7.0f}ms')
+
+    for framing in FRAMINGS:
+        calls = 0
+        sent = 0
+        calls_saved = 0
+        first_text_ms = []
+        for answer in answers:
+            clock = SimulatedClock()
+            posted = []
+            stream = WebSocketStream(lambda data: posted.append((clock.now, data)), framing,
+                                     args.flush_bytes, args.flush_ms / 1000, clock, timer=False)
+            for chunk in answer:
+                clock.now = clock.now + args.chunk_ms / 1000
+                stream.text(chunk)
+            stream.send({'text': 'ack-end-of-string'})
+            stats = stream.close()
+            calls = calls + stats['websocket_frames']
+            sent = sent + stats['websocket_bytes']
+            calls_saved = calls_saved + stats['websocket_calls_saved']
+            # Delay of the first text on screen against sending the first chunk as it arrives
+            first_text_ms.append((posted[0][0] - args.chunk_ms / 1000) * 1000)
+        print(f'{"coalesced " + framing:18s} calls/answer={calls / len(answers):6.1f} KB/answer={sent / len(answers) / 1024:6.1f} '
+              f'post time/answer={(calls * args.post_ms + sent / 1024 * args.per_kb_ms) / len(answers):7.0f}ms '
+              f'first text +{max(first_text_ms):.0f}ms, saved {calls_saved / len(answers):.0f} calls '
+              f'{(legacy_bytes - sent) / len(answers) / 1024:.1f}KB per answer')
+
+    flows = make_prompt_flows(rng)
+    sizes = {'legacy': sum(legacy_frame_size(flow) for flow in flows)}
+    sizes.update({framing: sum(len(encode_frame(flow, framing)) for flow in flows) for framing in FRAMINGS})
+    print('agent run, 10 prompt_flow frames: ' + ', '.join(f'{name} {size / 1024:.0f}KB' for name, size in sizes.items()))
+    print(f'compact JSON of a frame decodes to the same message: {json.loads(encode_frame(flows[-1], "json")) == flows[-1]}')
+
+    for mode in ['per chunk', 'coalesced', 'background sender']:
+        runs = [live_run(answer, args, mode) for answer in answers[:args.live_answers]]
+        print(f'pipelined {mode:17s} stream read in {sum(run[0] for run in runs) / len(runs):5.2f}s, '
+              f'last frame out at {sum(run[1] for run in runs) / len(runs):5.2f}s, '
+              f'frames/answer={sum(run[2] for run in runs) / len(runs):5.1f} '
+              f'(model streams for {args.chunks * args.chunk_ms / 1000:.2f}s)')
+
+    print(f'pause of {args.pause_ms:.0f}ms: text posted after {pause_delay(args, True):.0f}ms with the flush timer, '
+          f'{pause_delay(args, False):.0f}ms when the next chunk arrives')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import hashlib
+import io
+import json
+import threading
+import time
+from collections import deque
+
+
+class LocalThrottlingError(Exception):
+    '''Shaped like the botocore ClientError Bedrock raises when the account quota is exceeded'''
+
+    def __init__(self):
+        super().__init__('ThrottlingException: Too many requests, please wait before trying again.')
+        self.response = {'Error': {'Code': 'ThrottlingException'}}
+
+
+class LocalBedrock:
+    '''
+    In-process stand-in for the bedrock-runtime client, only invoke_model for embed models.
+    Each call sleeps for a fixed latency plus a small per-text cost and returns
+    deterministic vectors derived from the text, so repeated texts embed identically.
+    With max_rps, calls above that many requests in the last second are throttled.
+    '''
+
+    def __init__(self, latency_ms=60, per_text_ms=2, dimension=384, max_rps=None):
+        self.latency_ms = latency_ms
+        self.per_text_ms = per_text_ms
+        self.dimension = dimension
+        self.max_rps = max_rps
+        self.calls = 0
+        self.throttled = 0
+        self.recent = deque()
+        self.lock = threading.Lock()
+
+    def _vector(self, text, dimension):
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        return [((digest[i % len(digest)] + i) % 255) / 255.0 - 0.5 for i in range(dimension)]
+
+    def invoke_model(self, body, modelId, accept=None, contentType=None):
+        request = json.loads(body)
+        with self.lock:
+            self.calls = self.calls + 1
+            if self.max_rps is not None:
+                now = time.monotonic()
+                while self.recent and now - self.recent[0] > 1:
+                    self.recent.popleft()
+                if len(self.recent) >= self.max_rps:
+                    self.throttled = self.throttled + 1
+                    raise LocalThrottlingError()
+                self.recent.append(now)
+        if 'texts' in request:
+            time.sleep((self.latency_ms + self.per_text_ms * len(request['texts'])) / 1000)
+            result = {'embeddings': [self._vector(text, 1024) for text in request['texts']]}
+        else:
+            time.sleep((self.latency_ms + self.per_text_ms) / 1000)
+            dimension = request.get('dimensions', request.get('embeddingConfig', {}).get('outputEmbeddingLength', self.dimension))
+            result = {'embedding': self._vector(request['inputText'], dimension)}
+        return {'body': io.BytesIO(json.dumps(result).encode('utf-8'))}
@@ -0,0 +1,348 @@
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+
+
+_TOKEN = re.compile(r'\w+')
+
+
+def _tokens(text):
+    return _TOKEN.findall(text.lower())
+
+
+class RequestError(Exception):
+    '''Stands in for opensearchpy's RequestError, error holds the OpenSearch error type'''
+
+    def __init__(self, error):
+        super().__init__(error)
+        self.error = error
+
+
+class _Indices:
+    def __init__(self, store):
+        self.store = store
+
+    def exists(self, index):
+        return index in self.store.indices_data or index in self.store.aliases
+
+    def create(self, index, body=None, ignore=None):
+        with self.store.lock:
+            if index in self.store.indices_data or index in self.store.aliases:
+                raise RequestError('resource_already_exists_exception')
+            self.store.indices_data[index] = {}
+            for alias in (body or {}).get('aliases', {}):
+                self.store.aliases[alias] = index
+        return {'acknowledged': True, 'index': index}
+
+    def delete(self, index):
+        with self.store.lock:
+            for name in index.split(','):
+                if name in self.store.aliases:
+                    raise ValueError(f'cannot delete alias {name} as an index')
+                self.store.indices_data.pop(name, None)
+                for alias in [alias for alias, target in self.store.aliases.items() if target == name]:
+                    del self.store.aliases[alias]
+        return {'acknowledged': True}
+
+    def exists_alias(self, name):
+        return name in self.store.aliases
+
+    def get_alias(self, name):
+        return {self.store.aliases[name]: {'aliases': {name: {}}}}
+
+    def update_aliases(self, body):
+        # Applied under the lock in one step, like the atomic _aliases API
+        self.store._round_trip(len(json.dumps(body)))
+        with self.store.lock:
+            for action in body['actions']:
+                op, spec = list(action.items())[0]
+                if op == 'add':
+                    self.store.aliases[spec['alias']] = spec['index']
+                elif op == 'remove':
+                    self.store.aliases.pop(spec['alias'], None)
+                elif op == 'remove_index':
+                    self.store.indices_data.pop(spec['index'], None)
+        return {'acknowledged': True}
+
+    def put_settings(self, index, body):
+        self.store.settings[index] = body
+        return {'acknowledged': True}
+
+    def refresh(self, index):
+        return {'_shards': {'failed': 0}}
+
+    def put_mapping(self, index, body):
+        return {'acknowledged': True}
+
+
+class LocalOpenSearch:
+    '''
+    In-process stand-in for the opensearch-py client used by the lambdas.
+    Every call sleeps for a fixed round trip plus a per-KB cost, so request counts
+    and payload sizes show up in wall time the way they do against AOSS.
+    failure_rate makes individual _bulk items fail with a 429. Without custom_ids an index operation
+    carrying an _id is rejected, as serverless vector search collections do.
+    '''
+
+    def __init__(self, round_trip_ms=20, per_kb_ms=0.02, failure_rate=0.0, seed=27, custom_ids=True):
+        self.custom_ids = custom_ids
+        self.auto_ids = itertools.count(1)
+        self.round_trip_ms = round_trip_ms
+        self.per_kb_ms = per_kb_ms
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.indices_data = {}
+        self.aliases = {}
+        self.settings = {}
+        self.requests = 0
+        # Time spent scoring in process, a benchmark subtracts it to keep only the modelled round trips
+        self.search_seconds = 0.0
+        self._text_stats_cache = {}
+        self.indices = _Indices(self)
+
+    def _round_trip(self, payload_bytes):
+        with self.lock:
+            self.requests = self.requests + 1
+        time.sleep((self.round_trip_ms + self.per_kb_ms * payload_bytes / 1024) / 1000)
+
+    def _resolve(self, name):
+        return self.aliases.get(name, name)
+
+    def _store(self, index, doc_id, doc):
+        with self.lock:
+            index = self._resolve(index)
+            self._text_stats_cache.pop(index, None)
+            docs = self.indices_data.setdefault(index, {})
+            if doc_id is None:
+                doc_id = f'auto-{next(self.auto_ids)}'
+            docs[doc_id] = doc
+        return doc_id
+
+    def index(self, index, body, id=None):
+        self._round_trip(len(json.dumps(body)))
+        if id is not None and not self.custom_ids:
+            raise RequestError('illegal_argument_exception')
+        doc_id = self._store(index, id, body)
+        return {'_id': doc_id, 'result': 'created'}
+
+    def bulk(self, body, index=None):
+        self._round_trip(len(body))
+        lines = body.strip().split('\n')
+        items = []
+        errors = False
+        position = 0
+        while position < len(lines):
+            action = json.loads(lines[position])
+            op = list(action.keys())[0]
+            meta = action[op]
+            source = None
+            if op != 'delete':
+                source = json.loads(lines[position + 1])
+                position = position + 1
+            position = position + 1
+            target = meta.get('_index', index)
+            if self.random.random() < self.failure_rate:
+                errors = True
+                items.append({op: {'_id': meta.get('_id'), 'status': 429,
+                                   'error': {'type': 'es_rejected_execution_exception', 'reason': 'rejected'}}})
+                continue
+            if op == 'delete':
+                with self.lock:
+                    self._text_stats_cache.pop(self._resolve(target), None)
+                    found = self.indices_data.get(self._resolve(target), {}).pop(meta['_id'], None)
+                items.append({op: {'_id': meta['_id'], 'status': 200 if found is not None else 404}})
+                errors = errors or found is None
+            elif op == 'update':
+                with self.lock:
+                    self._text_stats_cache.pop(self._resolve(target), None)
+                    doc = self.indices_data.get(self._resolve(target), {}).get(meta['_id'])
+                    if doc is not None:
+                        doc.update(source['doc'])
+                items.append({op: {'_id': meta['_id'], 'status': 200 if doc is not None else 404}})
+                errors = errors or doc is None
+            elif meta.get('_id') is not None and not self.custom_ids:
+                errors = True
+                items.append({op: {'_id': meta['_id'], 'status': 400, 'error': {
+                    'type': 'illegal_argument_exception', 'reason': 'Document ID is not supported in create/index operation request'}}})
+            else:
+                doc_id = self._store(target, meta.get('_id'), source)
+                items.append({op: {'_id': doc_id, 'status': 201, 'result': 'created'}})
+        return {'took': 1, 'errors': errors, 'items': items}
+
+    def _score(self, doc, query, stats):
+        '''Score of doc for query, None when it does not match. knn is exact cosine, match is BM25'''
+        if 'knn' in query:
+            field, spec = list(query['knn'].items())[0]
+            vector = doc.get(field)
+            if vector is None:
+                return None
+            # Efficient filtering: only matching documents are candidates
+            if spec.get('filter') is not None and self._score(doc, spec['filter'], stats) is None:
+                return None
+            dot = sum(a * b for a, b in zip(vector, spec['vector']))
+            norm = math.sqrt(sum(a * a for a in vector)) * math.sqrt(sum(b * b for b in spec['vector']))
+            # cosinesimil space type score of the knn plugin
+            return 1 / (2 - (dot / norm if norm > 0 else 0))
+        if 'match' in query:
+            field, spec = list(query['match'].items())[0]
+            terms = _tokens(spec['query'] if isinstance(spec, dict) else spec)
+            doc_terms = stats['tokens'].get(id(doc)) or _tokens(doc.get(field) or '')
+            if len(doc_terms) == 0:
+                return None
+            score = 0.0
+            for term in set(terms):
+                frequency = doc_terms.count(term)
+                if frequency == 0:
+                    continue
+                df = stats['df'].get(term, 0)
+                idf = math.log(1 + (stats['docs'] - df + 0.5) / (df + 0.5))
+                score = score + idf * frequency * 2.2 / (frequency + 1.2 * (0.25 + 0.75 * len(doc_terms) / stats['avgdl']))
+            return score if score > 0 else None
+        if 'term' in query:
+            field, value = list(query['term'].items())[0]
+            return 1.0 if doc.get(field) == (value['value'] if isinstance(value, dict) else value) else None
+        if 'terms' in query:
+            field, values = list(query['terms'].items())[0]
+            if isinstance(doc.get(field), list):
+                return 1.0 if any(value in values for value in doc[field]) else None
+            return 1.0 if doc.get(field) in values else None
+        if 'exists' in query:
+            return 1.0 if doc.get(query['exists']['field']) is not None else None
+        if 'range' in query:
+            field, bounds = list(query['range'].items())[0]
+            value = doc.get(field)
+            if value is None:
+                return None
+            checks = {'gte': lambda bound: value >= bound, 'gt': lambda bound: value > bound,
+                      'lte': lambda bound: value <= bound, 'lt': lambda bound: value < bound}
+            return 1.0 if all(checks[op](bound) for op, bound in bounds.items()) else None
+        if 'bool' in query:
+            score = 0.0
+            for clause in query['bool'].get('must', []):
+                clause_score = self._score(doc, clause, stats)
+                if clause_score is None:
+                    return None
+                score = score + clause_score
+            for clause in query['bool'].get('filter', []):
+                if self._score(doc, clause, stats) is None:
+                    return None
+            for clause in query['bool'].get('must_not', []):
+                if self._score(doc, clause, stats) is not None:
+                    return None
+            return score or 1.0
+        return 1.0
+
+    def _matches(self, doc, query):
+        return self._score(doc, query, None) is not None
+
+    def _text_stats(self, index, docs, query):
+        '''Document frequencies and tokens of the text field, cached until the index is written to'''
+        if 'match' not in json.dumps(query):
+            return None
+        cached = self._text_stats_cache.get(index)
+        if cached is not None and cached['docs'] == len(docs):
+            return cached
+        df = {}
+        tokens = {}
+        lengths = 0
+        for _, doc in docs:
+            terms = _tokens(doc.get('text') or '')
+            tokens[id(doc)] = terms
+            lengths = lengths + len(terms)
+            for term in set(terms):
+                df[term] = df.get(term, 0) + 1
+        stats = {'docs': len(docs), 'df': df, 'tokens': tokens, 'avgdl': max(lengths / max(len(docs), 1), 1)}
+        self._text_stats_cache[index] = stats
+        return stats
+
+    def search(self, body, index):
+        self._round_trip(len(json.dumps(body)))
+        return self._search(body, index)
+
+    def msearch(self, body, index=None):
+        '''_msearch: header and body lines, all searches in one round trip'''
+        self._round_trip(len(body))
+        lines = [json.loads(line) for line in body.strip().split('\n')]
+        responses = []
+        for header, search_body in zip(lines[0::2], lines[1::2]):
+            try:
+                responses.append(self._search(search_body, header.get('index', index)))
+            except Exception as e:
+                responses.append({'error': {'reason': str(e)}, 'status': 404})
+        return {'took': 1, 'responses': responses}
+
+    def _search(self, body, index):
+        start = time.perf_counter()
+        try:
+            return self._run_search(body, index)
+        finally:
+            with self.lock:
+                self.search_seconds = self.search_seconds + time.perf_counter() - start
+
+    def _run_search(self, body, index):
+        with self.lock:
+            if self._resolve(index) not in self.indices_data:
+                raise KeyError(f'index_not_found_exception {index}')
+            docs = list(self.indices_data[self._resolve(index)].items())
+        query = body.get('query', {'match_all': {}})
+        stats = self._text_stats(self._resolve(index), docs, query)
+        # A knn clause inside a bool finds its k neighbours first, the bool filters them after (post-filtering)
+        knn = [clause for clause in query.get('bool', {}).get('must', []) if 'knn' in clause]
+        if len(knn) > 0:
+            neighbours = sorted(((self._score(doc, knn[0], stats), doc_id) for doc_id, doc in docs), reverse=True,
+                                key=lambda neighbour: -1 if neighbour[0] is None else neighbour[0])
+            allowed = set(doc_id for score, doc_id in neighbours[:list(knn[0]['knn'].values())[0]['k']] if score is not None)
+            docs = [(doc_id, doc) for doc_id, doc in docs if doc_id in allowed]
+        hits = []
+        for doc_id, doc in docs:
+            score = self._score(doc, query, stats)
+            if score is not None:
+                hits.append((doc_id, doc, score))
+        sort_fields = [list(field.keys())[0] for field in body.get('sort', [])]
+        if len(sort_fields) > 0:
+            hits.sort(key=lambda hit: [hit[1].get(field) for field in sort_fields])
+            if 'search_after' in body:
+                hits = [hit for hit in hits if [hit[1].get(field) for field in sort_fields] > body['search_after']]
+        else:
+            hits.sort(key=lambda hit: hit[2], reverse=True)
+        if 'knn' in query:
+            hits = hits[:list(query['knn'].values())[0]['k']]
+        results = []
+        for doc_id, doc, score in hits[:body.get('size', 10)]:
+            source_fields = body.get('_source', True)
+            if isinstance(source_fields, list):
+                source = {field: doc.get(field) for field in source_fields}
+            else:
+                source = doc if source_fields else {}
+            result = {'_id': doc_id, '_score': score, '_source': source}
+            if 'fields' in body:
+                result['fields'] = {field: [doc[field]] for field in body['fields'] if doc.get(field) is not None}
+            if len(sort_fields) > 0:
+                result['sort'] = [doc.get(field) for field in sort_fields]
+            results.append(result)
+        response = {'hits': {'total': {'value': len(hits)}, 'hits': results}}
+        if 'aggs' in body:
+            response['aggregations'] = {name: self._composite(agg['composite'], hits) for name, agg in body['aggs'].items()}
+        return response
+
+    def _composite(self, composite, hits):
+        '''Composite aggregation over one terms source, paged by after'''
+        name, terms = list(composite['sources'][0].items())[0]
+        field = terms['terms']['field']
+        keys = sorted(set(doc[field] for _, doc, _ in hits if doc.get(field) is not None))
+        if 'after' in composite:
+            keys = [key for key in keys if key > composite['after'][name]]
+        buckets = [{'key': {name: key}, 'doc_count': sum(1 for _, doc, _ in hits if doc.get(field) == key)}
+                   for key in keys[:composite['size']]]
+        result = {'buckets': buckets}
+        if len(buckets) > 0:
+            result['after_key'] = buckets[-1]['key']
+        return result
+
+    def count(self, index):
+        return len(self.indices_data.get(self._resolve(index), {}))
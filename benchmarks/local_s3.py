@@ -0,0 +1,54 @@
+import hashlib
+import io
+import os
+import threading
+
+
+class LocalS3:
+    '''
+    In-process stand-in for the S3 client calls used by the lambdas: head_object, put_object and
+    get_object with Range and IfMatch. put_file registers a file on disk as an object, so
+    multi-GB objects can be served range by range without holding them in memory.
+    '''
+
+    def __init__(self):
+        self.objects = {}
+        self.files = {}
+        self.gets = 0
+        self.lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        with self.lock:
+            self.objects[(Bucket, Key)] = Body
+
+    def put_file(self, Bucket, Key, path):
+        with self.lock:
+            self.files[(Bucket, Key)] = path
+
+    def head_object(self, Bucket, Key):
+        with self.lock:
+            if (Bucket, Key) in self.files:
+                stat = os.stat(self.files[(Bucket, Key)])
+                return {'ETag': f'"{stat.st_size}-{stat.st_mtime_ns}"', 'ContentLength': stat.st_size}
+            body = self.objects[(Bucket, Key)]
+        return {'ETag': f'"{hashlib.md5(body).hexdigest()}"', 'ContentLength': len(body)}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        with self.lock:
+            self.gets = self.gets + 1
+            path = self.files.get((Bucket, Key))
+            if path is None and (Bucket, Key) not in self.objects:
+                raise KeyError(f'NoSuchKey {Key}')
+        if IfMatch is not None and self.head_object(Bucket, Key)['ETag'] != IfMatch:
+            raise ValueError('PreconditionFailed')
+        start, end = 0, None
+        if Range is not None:
+            start, end = [int(position) for position in Range.replace('bytes=', '').split('-')]
+        if path is not None:
+            with open(path, 'rb') as f:
+                f.seek(start)
+                body = f.read() if end is None else f.read(end - start + 1)
+        else:
+            body = self.objects[(Bucket, Key)]
+            body = body[start:] if end is None else body[start:end + 1]
+        return {'Body': io.BytesIO(body)}
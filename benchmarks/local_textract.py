@@ -0,0 +1,76 @@
+import itertools
+import json
+import threading
+import time
+
+
+class LocalTextract:
+    '''
+    In-process stand-in for the Textract async text detection API and its SNS notification.
+    A job finishes duration seconds after it starts, get_document_text_detection pages its
+    LINE blocks with NextToken, and when a NotificationChannel is passed the completion
+    message is delivered to every subscriber as an SNS-shaped Lambda event.
+    detect_document_text (synchronous image OCR) takes ocr_latency seconds per call.
+    '''
+
+    def __init__(self, pages_per_job=3, lines_per_page=20, blocks_per_response=25, ocr_latency=0.5):
+        self.ocr_latency = ocr_latency
+        self.pages_per_job = pages_per_job
+        self.lines_per_page = lines_per_page
+        self.blocks_per_response = blocks_per_response
+        self.subscribers = []
+        self.calls = 0
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def start_document_text_detection(self, DocumentLocation, NotificationChannel=None, duration=1.0):
+        job_id = f'local-job-{next(self.ids)}'
+        with self.lock:
+            self.calls = self.calls + 1
+            self.jobs[job_id] = {'status': 'IN_PROGRESS', 'location': DocumentLocation['S3Object']}
+
+        def complete():
+            with self.lock:
+                self.jobs[job_id]['status'] = 'SUCCEEDED'
+                self.jobs[job_id]['completed_at'] = time.time()
+            if NotificationChannel is not None:
+                self._publish(job_id)
+
+        threading.Timer(duration, complete).start()
+        return {'JobId': job_id}
+
+    def _publish(self, job_id):
+        job = self.jobs[job_id]
+        message = {'JobId': job_id, 'Status': job['status'], 'API': 'StartDocumentTextDetection',
+                   'Timestamp': int(time.time() * 1000),
+                   'DocumentLocation': {'S3ObjectName': job['location']['Name'], 'S3Bucket': job['location']['Bucket']}}
+        event = {'Records': [{'EventSource': 'aws:sns', 'Sns': {'Message': json.dumps(message)}}]}
+        for callback in self.subscribers:
+            callback(event)
+
+    def get_document_text_detection(self, JobId, NextToken=None, MaxResults=1000):
+        with self.lock:
+            self.calls = self.calls + 1
+            status = self.jobs[JobId]['status']
+        if status != 'SUCCEEDED':
+            return {'JobStatus': status}
+        lines = [f'page {page} line {line} of {JobId}' for page in range(self.pages_per_job)
+                 for line in range(self.lines_per_page)]
+        start = int(NextToken) if NextToken else 0
+        end = start + min(MaxResults, self.blocks_per_response)
+        response = {'JobStatus': status,
+                    'Blocks': [{'BlockType': 'LINE', 'Text': text} for text in lines[start:end]]}
+        if end < len(lines):
+            response['NextToken'] = str(end)
+        return response
+
+    def detect_document_text(self, Document):
+        with self.lock:
+            self.calls = self.calls + 1
+        time.sleep(self.ocr_latency)
+        name = Document['S3Object']['Name'] if 'S3Object' in Document else f'{len(Document["Bytes"])} bytes'
+        return {'Blocks': [{'BlockType': 'LINE', 'Text': f'line {line} of {name}'} for line in range(self.lines_per_page)]}
@@ -6,6 +6,7 @@ from aws_cdk import (
     aws_s3 as _s3
 )
 import uuid
+import json
 import aws_cdk as _cdk
 import os
 from constructs import Construct, DependencyGroup
@@ -24,6 +25,11 @@ class ApiGw_Stack(Stack):
         secret_api_key = self.node.try_get_context("secret_api_key")
         is_opensearch = self.node.try_get_context("is_aoss")
         embed_model_id = self.node.try_get_context("embed_model_id")
+        # bedrock, local (CPU model packaged at embed_model_path) or hashing (offline tests)
+        embed_backend = self.node.try_get_context("embed_backend") or 'bedrock'
+        embed_model_path = self.node.try_get_context("embed_model_path") or ''
+        # yes -> query embeddings are also cached in a DynamoDB table shared by every query lambda container
+        query_cache_shared = self.node.try_get_context("query_cache_shared") or 'yes'
 
         html_header_name = 'Amazon Bedrock'
         try:
@@ -33,6 +39,9 @@ class ApiGw_Stack(Stack):
             pass
 
         env_params = self.node.try_get_context(env_name)
+        # Vector index engine, HNSW parameters, dimension and storage shared by the index and query lambdas
+        index_profile_name = env_params.get('index_profile', 'faiss-hnsw')
+        index_profile = dict(self.node.try_get_context('vector_index_profiles')[index_profile_name], name=index_profile_name)
         print(f'Collection_endpoint={collection_endpoint}')
         
         print(f'Secret Key={secret_api_key}')
@@ -148,7 +157,10 @@ class ApiGw_Stack(Stack):
                                             'OPENSEARCH_VECTOR_ENDPOINT': collection_endpoint,
                                             'REGION': region,
                                             'S3_BUCKET_NAME': bucket_name,
-                                            'EMBED_MODEL_ID': embed_model_id
+                                            'EMBED_MODEL_ID': embed_model_id,
+                                            'EMBED_BACKEND': embed_backend,
+                                            'EMBED_MODEL_PATH': embed_model_path,
+                                            'INDEX_PROFILE': json.dumps(index_profile)
                               },
                               memory_size=3000,
                               layers= [boto3_bedrock_layer , opensearchpy_layer, aws4auth_layer, langchainpy_layer])
@@ -168,7 +180,10 @@ class ApiGw_Stack(Stack):
                                             'REST_ENDPOINT_URL': rest_endpoint_url,
                                             'IS_RAG_ENABLED': is_opensearch,
                                             'S3_BUCKET_NAME': bucket_name,
-                                            'EMBED_MODEL_ID': embed_model_id
+                                            'EMBED_MODEL_ID': embed_model_id,
+                                            'EMBED_BACKEND': embed_backend,
+                                            'EMBED_MODEL_PATH': embed_model_path,
+                                            'INDEX_PROFILE': json.dumps(index_profile)
                               },
                               memory_size=3000,
                               layers= [boto3_bedrock_layer , opensearchpy_layer, aws4auth_layer, langchainpy_layer]
@@ -196,6 +211,46 @@ class ApiGw_Stack(Stack):
         bedrock_querying_lambda_function.add_to_role_policy(bedrock_oss_policy)
         bedrock_indexing_lambda_function.add_to_role_policy(bedrock_oss_policy)
         
+        # Textract publishes PDF job completion to SNS, which triggers indexing instead of sleep-polling
+        job_status_table = _cdk.aws_dynamodb.Table(self, f'agentic-rag-job-status-{env_name}',
+                                                  partition_key=_cdk.aws_dynamodb.Attribute(name='job_id', type=_cdk.aws_dynamodb.AttributeType.STRING),
+                                                  billing_mode=_cdk.aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+                                                  removal_policy=_cdk.RemovalPolicy.DESTROY)
+        job_status_table.grant_read_write_data(bedrock_indexing_lambda_function)
+        textract_topic = _cdk.aws_sns.Topic(self, f'agentic-rag-textract-{env_name}', enforce_ssl=True)
+        textract_sns_role = _iam.Role(self, f'textract-sns-publish-{env_name}', assumed_by=_iam.ServicePrincipal('textract.amazonaws.com'))
+        textract_topic.grant_publish(textract_sns_role)
+        textract_topic.add_subscription(_cdk.aws_sns_subscriptions.LambdaSubscription(bedrock_indexing_lambda_function))
+        bedrock_indexing_lambda_function.add_to_role_policy(_iam.PolicyStatement(actions=["iam:PassRole"],
+                                                                                 resources=[textract_sns_role.role_arn]))
+        bedrock_indexing_lambda_function.add_environment('JOB_STATUS_TABLE', job_status_table.table_name)
+        bedrock_indexing_lambda_function.add_environment('TEXTRACT_SNS_TOPIC_ARN', textract_topic.topic_arn)
+        bedrock_indexing_lambda_function.add_environment('TEXTRACT_SNS_ROLE_ARN', textract_sns_role.role_arn)
+
+        # Batch ingestion: one message per document, drained by the index lambda with per document checkpoints
+        ingest_dead_letter_queue = _cdk.aws_sqs.Queue(self, f'agentic-rag-ingest-dlq-{env_name}',
+                                                      retention_period=_cdk.Duration.days(14), enforce_ssl=True)
+        ingest_queue = _cdk.aws_sqs.Queue(self, f'agentic-rag-ingest-{env_name}',
+                                          # 6x the lambda timeout as recommended for SQS event sources
+                                          visibility_timeout=_cdk.Duration.seconds(1800),
+                                          enforce_ssl=True,
+                                          dead_letter_queue=_cdk.aws_sqs.DeadLetterQueue(max_receive_count=3, queue=ingest_dead_letter_queue))
+        ingest_queue.grant_send_messages(bedrock_indexing_lambda_function)
+        bedrock_indexing_lambda_function.add_event_source(_cdk.aws_lambda_event_sources.SqsEventSource(ingest_queue,
+                                                                                                        batch_size=5,
+                                                                                                        max_concurrency=10,
+                                                                                                        report_batch_item_failures=True))
+        bedrock_indexing_lambda_function.add_environment('INGEST_QUEUE_URL', ingest_queue.queue_url)
+
+        if query_cache_shared == 'yes':
+            query_cache_table = _cdk.aws_dynamodb.Table(self, f'agentic-rag-query-cache-{env_name}',
+                                                       partition_key=_cdk.aws_dynamodb.Attribute(name='cache_key', type=_cdk.aws_dynamodb.AttributeType.STRING),
+                                                       billing_mode=_cdk.aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+                                                       time_to_live_attribute='expires_at',
+                                                       removal_policy=_cdk.RemovalPolicy.DESTROY)
+            query_cache_table.grant_read_write_data(bedrock_querying_lambda_function)
+            bedrock_querying_lambda_function.add_environment('QUERY_CACHE_TABLE', query_cache_table.table_name)
+
         bedrock_querying_lambda_function.add_environment('WSS_URL', wss_url + '/' + env_name)
         bedrock_index_lambda_integration = _cdk.aws_apigateway.LambdaIntegration(
         bedrock_indexing_lambda_function, proxy=True, allow_test_invoke=True)
@@ -296,6 +351,9 @@ class ApiGw_Stack(Stack):
         index_docs_api = rag_llm_api.add_resource("index-documents")
         detect_text_api = rag_llm_api.add_resource("detect-text")
         index_files_api = rag_llm_api.add_resource("index-files")
+        index_batch_api = rag_llm_api.add_resource("index-batch")
+        reindex_api = rag_llm_api.add_resource("reindex")
+        swap_index_api = rag_llm_api.add_resource("swap-index")
         get_job_status_api = rag_llm_api.add_resource("get-job-status")
         get_presigned_url_api = rag_llm_api.add_resource("get-presigned-url")
         
@@ -340,6 +398,27 @@ class ApiGw_Stack(Stack):
             api_key_required=True,
             method_responses=method_responses,
         )
+        index_batch_api.add_method(
+            "POST",
+            lambda_integration,
+            operation_name="Index a batch of files",
+            api_key_required=True,
+            method_responses=method_responses,
+        )
+        reindex_api.add_method(
+            "POST",
+            lambda_integration,
+            operation_name="Rebuild the index behind the alias",
+            api_key_required=True,
+            method_responses=method_responses,
+        )
+        swap_index_api.add_method(
+            "POST",
+            lambda_integration,
+            operation_name="Swap the alias to a rebuilt index",
+            api_key_required=True,
+            method_responses=method_responses,
+        )
         get_job_status_api.add_method(
             "GET",
             lambda_integration,
@@ -373,6 +452,9 @@ class ApiGw_Stack(Stack):
         self.add_cors_options(get_job_status_api)
         self.add_cors_options(get_presigned_url_api)
         self.add_cors_options(index_files_api)
+        self.add_cors_options(index_batch_api)
+        self.add_cors_options(reindex_api)
+        self.add_cors_options(swap_index_api)
         self.add_cors_options(detect_text_api)
         
         